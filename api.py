@@ -0,0 +1,158 @@
+"""
+Shared HTTP client for the Nostradamus IoT API.
+All requests from main.py and live.py go through one lazily created
+httpx.Client, so connections are pooled and kept alive across calls and
+httpx is only imported when the first request is made. Requests to
+send_data/get_data/statistics are paced by the shared rate limiter and
+retried after 429/503 once the limiter has slowed down. The asyncio
+engine (live_async.py) uses the *_async variants, backed by one
+httpx.AsyncClient per event loop run.
+"""
+
+import atexit
+import threading
+
+from instrumentation import METRICS, RATE_LIMIT_WAIT
+from lazy import lazy_import
+from rate_limit import LIMITER, THROTTLE_STATUSES, parse_retry_after
+
+httpx = lazy_import('httpx')
+
+DEFAULT_TIMEOUT = 30.0
+MAX_CONNECTIONS = 20
+THROTTLE_RETRIES = 3  # Extra attempts after 429/503 on rate-limited endpoints
+
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+
+
+class ApiTimeout(Exception):
+    """Request timed out"""
+
+
+class ApiUnavailable(Exception):
+    """API could not be reached (DNS, connection refused, TLS...)"""
+
+
+def client():
+    """Returns shared httpx.Client, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(
+                    timeout=DEFAULT_TIMEOUT,
+                    limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+                )
+                atexit.register(close)
+    return _client
+
+
+def close():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def clean_params(params):
+    """Drops None-valued query params (httpx would send them as empty strings)"""
+    if params is None:
+        return None
+    return {key: value for key, value in params.items() if value is not None}
+
+
+def send(method, url, params=None, **kwargs):
+    """Sends one request with shared client, mapping transport errors"""
+    try:
+        return client().request(method, url, params=params, **kwargs)
+    except httpx.TimeoutException as e:
+        raise ApiTimeout(str(e)) from e
+    except httpx.TransportError as e:
+        raise ApiUnavailable(str(e)) from e
+
+
+def request(method, url, params=None, **kwargs):
+    """Sends request through rate limiter - None-valued params are dropped, transport errors are mapped"""
+    params = clean_params(params)
+    bucket = LIMITER.bucket(url)
+    if bucket is None:
+        return send(method, url, params, **kwargs)
+
+    for attempt in range(THROTTLE_RETRIES + 1):
+        waited = bucket.acquire()
+        if waited:
+            METRICS.record(RATE_LIMIT_WAIT, waited)
+        response = send(method, url, params, **kwargs)
+        if not throttled(bucket, url, response):
+            return response
+    return response
+
+
+def throttled(bucket, url, response):
+    """Feeds response status back into bucket, returns True if request should be retried"""
+    if response.status_code not in THROTTLE_STATUSES:
+        bucket.succeeded()
+        return False
+    METRICS.count(f'throttled_{LIMITER.endpoint_class(url)}')
+    bucket.throttled(parse_retry_after(response.headers.get('Retry-After')))
+    return True
+
+
+def async_client():
+    """Returns shared httpx.AsyncClient of the running event loop, created on first use"""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=DEFAULT_TIMEOUT,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        )
+    return _async_client
+
+
+async def aclose():
+    """Closes async client - call before the event loop ends"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def send_async(method, url, params=None, **kwargs):
+    try:
+        return await async_client().request(method, url, params=params, **kwargs)
+    except httpx.TimeoutException as e:
+        raise ApiTimeout(str(e)) from e
+    except httpx.TransportError as e:
+        raise ApiUnavailable(str(e)) from e
+
+
+async def request_async(method, url, params=None, **kwargs):
+    """Async request() - same rate limits, retries and error mapping"""
+    params = clean_params(params)
+    bucket = LIMITER.bucket(url)
+    if bucket is None:
+        return await send_async(method, url, params, **kwargs)
+
+    for attempt in range(THROTTLE_RETRIES + 1):
+        waited = await bucket.acquire_async()
+        if waited:
+            METRICS.record(RATE_LIMIT_WAIT, waited)
+        response = await send_async(method, url, params, **kwargs)
+        if not throttled(bucket, url, response):
+            return response
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Synthetic AgroSense dataset for benchmarks.
+Creates the `agrosense` tables used by main.py/live.py in a local PostgreSQL
+(PostGIS required) and fills lora_measurement with N modules x M months of
+10-minute readings, ending now.
+
+    python bench/generate_dataset.py --dsn "dbname=bench user=postgres" --modules 20 --months 3
+
+Existing agrosense tables are only replaced with --force, and never when
+lora_measurement holds any rows - point --dsn at a dedicated benchmark database.
+"""
+
+import argparse
+import io
+import math
+import random
+from datetime import datetime, timedelta, timezone
+
+import os
+import sys
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stations import REGISTRY
+
+PIS_SENSORS = REGISTRY['PIS'].sensor_names
+RHMZ_SENSORS = REGISTRY['RHMZ'].sensor_names
+
+DROP_SQL = '''
+SET search_path TO agrosense, public;
+DROP TABLE IF EXISTS lora_measurement, lora_device_type_sensor_type, lora_sensor_type,
+    lora_module_location, lora_module CASCADE;
+'''
+
+SCHEMA_SQL = '''
+CREATE EXTENSION IF NOT EXISTS postgis;
+CREATE SCHEMA IF NOT EXISTS agrosense;
+SET search_path TO agrosense, public;
+
+CREATE TABLE lora_module (
+    mac_address varchar PRIMARY KEY,
+    name varchar NOT NULL
+);
+
+CREATE TABLE lora_module_location (
+    mac_address_lora_module varchar REFERENCES lora_module (mac_address),
+    location geometry(Point, 4326)
+);
+
+CREATE TABLE lora_sensor_type (
+    id serial PRIMARY KEY,
+    name varchar NOT NULL
+);
+
+CREATE TABLE lora_device_type_sensor_type (
+    id serial PRIMARY KEY,
+    id_lora_sensor_type integer REFERENCES lora_sensor_type (id)
+);
+
+CREATE TABLE lora_measurement (
+    id bigserial PRIMARY KEY,
+    mac_address_lora_module varchar NOT NULL,
+    id_lora_device_type_sensor_type integer NOT NULL,
+    date timestamp NOT NULL,
+    value numeric,
+    valid boolean DEFAULT TRUE,
+    device_on boolean DEFAULT TRUE
+);
+'''
+
+INDEX_SQL = '''
+SET search_path TO agrosense, public;
+CREATE INDEX lora_measurement_mac_date_idx ON lora_measurement (mac_address_lora_module, date);
+ANALYZE;
+'''
+
+
+def sensor_value(sensor, t):
+    """Plausible reading for sensor at epoch seconds t"""
+    day = math.sin(2 * math.pi * (t % 86400) / 86400)
+    year = math.sin(2 * math.pi * (t % 31536000) / 31536000)
+    if sensor in ('Temperatura vazduha', 'Temperatura zemljišta'):
+        return 12 + 10 * year + 6 * day + random.gauss(0, 0.5)
+    if sensor == 'Tačka rose':
+        return 5 + 8 * year + 2 * day + random.gauss(0, 0.5)
+    if sensor in ('Vlažnost vazduha', 'Vlažnost lista'):
+        return min(100.0, max(0.0, 70 - 20 * day + random.gauss(0, 3)))
+    if sensor == 'Količina padavina':
+        return max(0.0, random.gauss(0, 0.4)) if random.random() < 0.1 else 0.0
+    if sensor in ('Brzina vetra', 'Udar vetra'):
+        return max(0.0, random.gauss(3, 1.5))
+    if sensor == 'Smer vetra':
+        return random.uniform(0, 360)
+    if sensor == 'Solarno zračenje':
+        return max(0.0, 300 * day + random.gauss(0, 10))
+    if sensor == 'Vazdušni pritisak':
+        return 1013 + random.gauss(0, 5)
+    return random.random()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic agrosense dataset")
+    parser.add_argument('--dsn', required=True, help="libpq connection string of local benchmark database")
+    parser.add_argument('--modules', type=int, default=10, help="number of modules (half PIS, half RHMZ)")
+    parser.add_argument('--months', type=int, default=1, help="months of history ending now")
+    parser.add_argument('--interval-minutes', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true',
+                        help="drop and recreate existing (empty) agrosense tables")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('agrosense.lora_measurement') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM agrosense.lora_measurement)")
+            if cur.fetchone()[0]:
+                conn.close()
+                sys.exit("❌ agrosense.lora_measurement is not empty - refusing to replace it, "
+                         "use a dedicated benchmark database")
+            if not args.force:
+                conn.close()
+                sys.exit("❌ agrosense tables already exist - pass --force to recreate them")
+            cur.execute(DROP_SQL)
+        cur.execute(SCHEMA_SQL)
+
+        sensor_ids = {}
+        for sensor in sorted(set(PIS_SENSORS) | set(RHMZ_SENSORS)):
+            cur.execute("INSERT INTO lora_sensor_type (name) VALUES (%s) RETURNING id", (sensor,))
+            sensor_type_id = cur.fetchone()[0]
+            cur.execute("INSERT INTO lora_device_type_sensor_type (id_lora_sensor_type) VALUES (%s) RETURNING id", (sensor_type_id,))
+            sensor_ids[sensor] = cur.fetchone()[0]
+
+        modules = []
+        for i in range(args.modules):
+            if i % 2 == 0:
+                mac, sensors = f"PIS_BENCH_{i:03d}", PIS_SENSORS
+            else:
+                mac, sensors = f"{i:04X}_RHMZ", RHMZ_SENSORS
+            modules.append((mac, sensors))
+            cur.execute("INSERT INTO lora_module (mac_address, name) VALUES (%s, %s)", (mac, f"Bench station {i}"))
+            cur.execute(
+                "INSERT INTO lora_module_location VALUES (%s, ST_SetSRID(ST_MakePoint(%s, %s), 4326))",
+                (mac, 19.0 + random.random(), 45.0 + random.random())
+            )
+
+        end = datetime.now(timezone.utc).replace(second=0, microsecond=0, tzinfo=None)
+        end -= timedelta(minutes=end.minute % args.interval_minutes)
+        start = end - timedelta(days=30 * args.months)
+        step = timedelta(minutes=args.interval_minutes)
+
+        total = 0
+        for mac, sensors in modules:
+            buffer = io.StringIO()
+            t = start
+            while t <= end:
+                epoch = (t - datetime(1970, 1, 1)).total_seconds()
+                for sensor in sensors:
+                    buffer.write(f"{mac}\t{sensor_ids[sensor]}\t{t.isoformat()}\t{sensor_value(sensor, epoch):.3f}\n")
+                    total += 1
+                t += step
+            buffer.seek(0)
+            cur.execute("SET search_path TO agrosense, public;")
+            cur.copy_expert(
+                "COPY lora_measurement (mac_address_lora_module, id_lora_device_type_sensor_type, date, value) FROM STDIN",
+                buffer
+            )
+            print(f"   ✅ {mac}: generated")
+
+        cur.execute(INDEX_SQL)
+
+    conn.close()
+    print(f"🎉 Generated {total} measurements for {len(modules)} modules ({start.isoformat()} - {end.isoformat()})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Local stub of the Nostradamus IoT API for benchmarks.
+Implements the /projects/{id}/collections/... endpoints used by main.py and
+live.py (collections, send_data, get_data, statistics, delete_data) with
+configurable latency, error rate and per-endpoint rate limit (429 with
+Retry-After above the limit). Request counts are available on /__stats.
+
+    python bench/mock_api.py --port 8765 --latency-ms 50 --error-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+COLLECTION_RE = re.compile(r'^/api/v1/projects/(?P<project>[^/]+)/collections(?:/(?P<collection>[^/]+))?(?:/(?P<action>[^/]+))?/?$')
+
+
+def parse_ts(value):
+    dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def truncate(dt, unit):
+    if unit.endswith('hour'):
+        return dt.replace(minute=0, second=0, microsecond=0)
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if unit.endswith('week'):
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+class MockState:
+    """In-memory collections and request statistics"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, rate_limit=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.windows = {}  # endpoint -> (second, requests in that second)
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.collections = {}  # collection_id -> {'name': ..., 'records': [...]}
+        self.requests = {}
+        self.errors = 0
+        self.records_received = 0
+        self.bytes_received = 0
+
+    def count(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def over_limit(self, endpoint):
+        """True if endpoint got more than rate_limit requests in current second"""
+        if not self.rate_limit:
+            return False
+        second = int(time.time())
+        with self.lock:
+            window, count = self.windows.get(endpoint, (second, 0))
+            count = count + 1 if window == second else 1
+            self.windows[endpoint] = (second, count)
+            if count > self.rate_limit:
+                self.throttled += 1
+                return True
+        return False
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': dict(self.requests),
+                'total_requests': sum(self.requests.values()),
+                'errors_injected': self.errors,
+                'throttled': self.throttled,
+                'records_received': self.records_received,
+                'bytes_received': self.bytes_received,
+                'records_stored': {c['name']: len(c['records']) for c in self.collections.values()},
+            }
+
+
+def matches(record, filters):
+    for f in filters:
+        value = record.get(f['property_name'])
+        expected = f['property_value']
+        op = f.get('operator', 'eq')
+        if f['property_name'] == 'timestamp' and value is not None:
+            value, expected = parse_ts(value), parse_ts(expected)
+        if value is None:
+            return False
+        if op == 'eq' and value != expected:
+            return False
+        if op == 'gt' and not value > expected:
+            return False
+        if op == 'gte' and not value >= expected:
+            return False
+        if op == 'lt' and not value < expected:
+            return False
+        if op == 'lte' and not value <= expected:
+            return False
+    return True
+
+
+def make_handler(state):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            with state.lock:
+                state.bytes_received += len(raw)
+            return json.loads(raw) if raw else None
+
+        def handle_request(self, method):
+            url = urlparse(self.path)
+            if url.path == '/__stats':
+                self.reply(200, state.stats())
+                return
+
+            match = COLLECTION_RE.match(url.path)
+            if not match:
+                self.reply(404, {'detail': 'Not found'})
+                return
+
+            collection_id = match.group('collection')
+            action = match.group('action')
+            endpoint = f"{method} {action or ('collection' if collection_id else 'collections')}"
+            state.count(endpoint)
+
+            delay = state.latency_ms + random.uniform(0, state.jitter_ms)
+            if delay:
+                time.sleep(delay / 1000.0)
+            body = self.read_body() if method in ('POST', 'DELETE') else None
+            if state.over_limit(endpoint):
+                self.send_response(429)
+                self.send_header('Retry-After', '1')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            if state.error_rate and random.random() < state.error_rate:
+                with state.lock:
+                    state.errors += 1
+                self.reply(503, {'detail': 'Injected error'})
+                return
+
+            params = {k: v if len(v) > 1 else v[0] for k, v in parse_qs(url.query).items()}
+
+            if collection_id is None:
+                if method == 'GET':
+                    with state.lock:
+                        result = [{'collection_id': cid, 'collection_name': c['name']} for cid, c in state.collections.items()]
+                    self.reply(200, result)
+                else:
+                    new_id = str(uuid.uuid4())
+                    with state.lock:
+                        state.collections[new_id] = {'name': body.get('name'), 'records': []}
+                    self.reply(200, {'collection_id': new_id, 'collection_name': body.get('name')})
+                return
+
+            collection = state.collections.get(collection_id)
+            if collection is None:
+                self.reply(404, {'detail': 'Collection not found'})
+                return
+
+            if action is None and method == 'DELETE':
+                with state.lock:
+                    state.collections.pop(collection_id, None)
+                self.reply(200, {'message': 'Collection deleted'})
+            elif action == 'send_data':
+                with state.lock:
+                    collection['records'].extend(body)
+                    state.records_received += len(body)
+                self.reply(200, {'message': f'{len(body)} records stored'})
+            elif action == 'get_data':
+                self.reply(200, {'data': self.get_data(collection, params)})
+            elif action == 'statistics':
+                self.reply(200, self.statistics(collection, params))
+            elif action == 'delete_data':
+                self.reply(200, self.delete_data(collection, body or {}))
+            else:
+                self.reply(404, {'detail': 'Not found'})
+
+        def get_data(self, collection, params):
+            filters = json.loads(params['filters']) if 'filters' in params else []
+            with state.lock:
+                records = [r for r in collection['records'] if matches(r, filters)]
+            if 'order_by' in params:
+                order = json.loads(params['order_by'])
+                records.sort(key=lambda r: parse_ts(r[order['field']]) if order['field'] == 'timestamp' else r.get(order['field']),
+                             reverse=order.get('order') == 'desc')
+            if 'limit' in params:
+                records = records[:int(params['limit'])]
+            attributes = params.get('attributes')
+            if attributes:
+                attributes = [attributes] if isinstance(attributes, str) else attributes
+                records = [{a: r.get(a) for a in attributes} for r in records]
+            return records
+
+        def statistics(self, collection, params):
+            filters = json.loads(params['filters']) if 'filters' in params else []
+            with state.lock:
+                records = [r for r in collection['records'] if matches(r, filters)]
+            attribute = params.get('attribute')
+
+            if params.get('stat') == 'distinct' and attribute == 'key':
+                per_key = {}
+                for r in records:
+                    entry = per_key.setdefault(r['key'], {'key': r['key'], 'min_timestamp': r['timestamp'],
+                                                          'max_timestamp': r['timestamp'], 'total_records': 0})
+                    if parse_ts(r['timestamp']) < parse_ts(entry['min_timestamp']):
+                        entry['min_timestamp'] = r['timestamp']
+                    if parse_ts(r['timestamp']) > parse_ts(entry['max_timestamp']):
+                        entry['max_timestamp'] = r['timestamp']
+                    entry['total_records'] += 1
+                return {'key_statistics': list(per_key.values())}
+
+            if params.get('stat') == 'count' and params.get('interval'):
+                buckets = {}
+                for r in records:
+                    bucket = truncate(parse_ts(r['timestamp']), params['interval'])
+                    buckets[bucket] = buckets.get(bucket, 0) + 1
+                return {f'{attribute}_statistics': [
+                    {'interval_start': b.strftime('%Y-%m-%dT%H:%M:%SZ'), 'count': c} for b, c in sorted(buckets.items())
+                ]}
+
+            values = [r.get(attribute) for r in records if isinstance(r.get(attribute), (int, float))]
+            stat = params.get('stat') or 'count'
+            result = {
+                'count': len(values),
+                'min': min(values) if values else None,
+                'max': max(values) if values else None,
+                'avg': sum(values) / len(values) if values else None,
+            }.get(stat)
+            return {f'{attribute}_statistics': {stat: result}}
+
+        def delete_data(self, collection, body):
+            ts_from = parse_ts(body['timestamp_from']) if body.get('timestamp_from') else None
+            ts_to = parse_ts(body['timestamp_to']) if body.get('timestamp_to') else None
+
+            def selected(r):
+                if body.get('key') and r.get('key') != body['key']:
+                    return False
+                ts = parse_ts(r['timestamp'])
+                if ts_from and ts < ts_from:
+                    return False
+                if ts_to and ts > ts_to:
+                    return False
+                return True
+
+            with state.lock:
+                before = len(collection['records'])
+                collection['records'] = [r for r in collection['records'] if not selected(r)]
+                deleted = before - len(collection['records'])
+            return {'message': f'{deleted} records deleted'}
+
+        def do_GET(self):
+            self.handle_request('GET')
+
+        def do_POST(self):
+            self.handle_request('POST')
+
+        def do_DELETE(self):
+            self.handle_request('DELETE')
+
+    return Handler
+
+
+def start_mock_api(port=0, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, host='127.0.0.1', rate_limit=0.0):
+    """Starts mock API in background thread, returns (server, state, base_url)"""
+    state = MockState(latency_ms, jitter_ms, error_rate, rate_limit)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://{host}:{server.server_address[1]}/api/v1"
+    return server, state, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Nostradamus IoT API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="added latency per request")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="random extra latency per request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="requests per second per endpoint before 429 (0 = unlimited)")
+    args = parser.parse_args()
+
+    server, state, base_url = start_mock_api(args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.host, args.rate_limit)
+    print(f"🧪 Mock Nostradamus API listening on {base_url} (stats: /__stats)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an OTLP/HTTP collector.
+Accepts JSON-encoded spans on /v1/traces (as sent by tracing.py), appends
+them as JSON lines to a file and prints the slowest modules and batches on
+Ctrl+C.
+
+    python bench/otlp_collector.py --port 4318 --output data/traces.jsonl
+    python live.py --otlp-endpoint http://localhost:4318
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def attribute_value(value):
+    if 'intValue' in value:
+        return int(value['intValue'])
+    if 'doubleValue' in value:
+        return value['doubleValue']
+    if 'boolValue' in value:
+        return value['boolValue']
+    return value.get('stringValue')
+
+
+def flatten(payload):
+    """Converts OTLP JSON payload into tracing.py JSONL span dicts"""
+    spans = []
+    for resource_spans in payload.get('resourceSpans', []):
+        for scope_spans in resource_spans.get('scopeSpans', []):
+            for span in scope_spans.get('spans', []):
+                start_ns, end_ns = int(span['startTimeUnixNano']), int(span['endTimeUnixNano'])
+                status = span.get('status', {})
+                spans.append({
+                    'name': span['name'],
+                    'trace_id': span['traceId'],
+                    'span_id': span['spanId'],
+                    'parent_span_id': span.get('parentSpanId') or None,
+                    'start_ns': start_ns,
+                    'end_ns': end_ns,
+                    'duration_ms': round((end_ns - start_ns) / 1e6, 3),
+                    'status': 'error' if status.get('code') == 2 else 'ok',
+                    'error': status.get('message') or None,
+                    'attributes': {a['key']: attribute_value(a['value']) for a in span.get('attributes', [])},
+                })
+    return spans
+
+
+def slowest(spans, name, top=10):
+    """Returns slowest spans with given name"""
+    return sorted((s for s in spans if s['name'] == name), key=lambda s: -s['duration_ms'])[:top]
+
+
+def print_report(spans):
+    for name in ('module', 'batch_upload'):
+        print(f"\n🐢 Slowest {name} spans:")
+        for span in slowest(spans, name):
+            attrs = ', '.join(f"{k}={v}" for k, v in span['attributes'].items())
+            print(f"   {span['duration_ms']:>10.1f} ms  {span['status']:<5}  {attrs}")
+
+
+def start_collector(port=4318, output=None, host='127.0.0.1'):
+    """Starts collector in background thread, returns (server, received spans list)"""
+    received = []
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            if self.path.rstrip('/') != '/v1/traces':
+                status = 404
+            else:
+                spans = flatten(json.loads(raw or b'{}'))
+                with lock:
+                    received.extend(spans)
+                    if output:
+                        with open(output, 'a', encoding='utf-8') as f:
+                            for span in spans:
+                                f.write(json.dumps(span, ensure_ascii=False) + "\n")
+                status = 200
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, received
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OTLP/HTTP trace collector")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4318)
+    parser.add_argument('--output', help="append received spans as JSON lines to this file")
+    parser.add_argument('--report', help="only print slowest spans from existing JSONL trace file")
+    args = parser.parse_args()
+
+    if args.report:
+        with open(args.report, encoding='utf-8') as f:
+            print_report([json.loads(line) for line in f if line.strip()])
+        return
+
+    server, received = start_collector(args.port, args.output, args.host)
+    print(f"🧵 OTLP collector listening on http://{args.host}:{args.port}/v1/traces")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"\n📥 Received {len(received)} spans")
+        print_report(received)
+
+
+if __name__ == "__main__":
+    main()
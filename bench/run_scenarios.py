@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark scenarios for the live and backfill paths.
+Runs main.py/live.py code against the mock Nostradamus API and a local
+PostgreSQL filled by generate_dataset.py, and reports rows/s, peak RSS and
+request counts per scenario. Every scenario runs in its own process so peak
+RSS is not shared between them.
+
+    python bench/run_scenarios.py --dsn "dbname=bench user=postgres" --latency-ms 20
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = ['live', 'live_async', 'live_incremental', 'backfill', 'backfill_rerun']
+
+
+def fetch_stats(api_url):
+    root = api_url.split('/api/v1')[0]
+    with urllib.request.urlopen(f"{root}/__stats") as response:
+        return json.loads(response.read())
+
+
+def configure(module, api_url, dsn):
+    """Points script module at mock API and benchmark database"""
+    from psycopg2.extensions import parse_dsn
+
+    module.BASE_URL = api_url
+    module.DB_CONFIG = parse_dsn(dsn)
+    module.MASTER_KEY = module.WRITE_KEY = module.READ_KEY = 'bench'
+    for config in module.STATION_CONFIG.values():
+        config['collection_id'] = None
+
+
+def run_live(api_url, dsn, runs=1, engine='sync'):
+    import live
+    configure(live, api_url, dsn)
+    for _ in range(runs):
+        live.setup_collections()
+        if engine == 'async':
+            import live_async
+            live_async.process_and_send_live_data(live)
+        else:
+            live.process_and_send_live_data()
+    return live.METRICS.summary()
+
+
+def run_backfill(api_url, dsn, date_from, date_to, runs=1):
+    import main
+    configure(main, api_url, dsn)
+    main.date_from = date_from
+    main.date_to = date_to
+    for _ in range(runs):
+        state = main.setup_collections(main.new_state())
+        main.process_and_send_data(state)
+    return main.METRICS.summary()
+
+
+def run_child(args):
+    """Runs single scenario in current process and prints JSON result"""
+    before = fetch_stats(args.api_url)
+    started = time.perf_counter()
+
+    if args.scenario == 'live':
+        metrics = run_live(args.api_url, args.dsn)
+    elif args.scenario == 'live_async':
+        metrics = run_live(args.api_url, args.dsn, engine='async')
+    elif args.scenario == 'live_incremental':
+        metrics = run_live(args.api_url, args.dsn, runs=2)
+    elif args.scenario == 'backfill':
+        metrics = run_backfill(args.api_url, args.dsn, args.date_from, args.date_to)
+    elif args.scenario == 'backfill_rerun':
+        metrics = run_backfill(args.api_url, args.dsn, args.date_from, args.date_to, runs=2)
+    else:
+        raise ValueError(f"Unknown scenario: {args.scenario}")
+
+    elapsed = time.perf_counter() - started
+    after = fetch_stats(args.api_url)
+    records = after['records_received'] - before['records_received']
+    requests_delta = {
+        endpoint: count - before['requests'].get(endpoint, 0)
+        for endpoint, count in after['requests'].items()
+        if count - before['requests'].get(endpoint, 0)
+    }
+
+    result = {
+        'scenario': args.scenario,
+        'elapsed_s': round(elapsed, 3),
+        'records_sent': records,
+        'rows_per_s': round(records / elapsed, 1) if elapsed > 0 else None,
+        'bytes_sent': after['bytes_received'] - before['bytes_received'],
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'requests': requests_delta,
+        'total_requests': sum(requests_delta.values()),
+        'stages': metrics['stages'],
+    }
+    print('BENCH_RESULT ' + json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run sync benchmark scenarios")
+    parser.add_argument('--dsn', required=True, help="libpq connection string of benchmark database")
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--months', type=int, default=1, help="backfill period ending now")
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--output', help="append JSON results to this file")
+    # Internal - used when scenario runs in child process
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', help=argparse.SUPPRESS)
+    parser.add_argument('--date-from', help=argparse.SUPPRESS)
+    parser.add_argument('--date-to', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        run_child(args)
+        return
+
+    from mock_api import start_mock_api
+
+    server, state, api_url = start_mock_api(0, args.latency_ms, args.jitter_ms, args.error_rate)
+    now = datetime.now(timezone.utc)
+    date_from = (now - timedelta(days=30 * args.months)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    date_to = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+    print(f"🧪 Mock API: {api_url} (latency {args.latency_ms}ms, error rate {args.error_rate})")
+
+    results = []
+    for scenario in args.scenarios:
+        print(f"\n▶️  Scenario: {scenario}")
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--dsn', args.dsn, '--scenario', scenario,
+             '--api-url', api_url, '--date-from', date_from, '--date-to', date_to],
+            cwd=ROOT, capture_output=True, text=True
+        )
+        line = next((l for l in child.stdout.splitlines() if l.startswith('BENCH_RESULT ')), None)
+        if child.returncode != 0 or line is None:
+            print(f"❌ Scenario {scenario} failed:\n{child.stderr[-2000:]}")
+            continue
+        result = json.loads(line[len('BENCH_RESULT '):])
+        results.append(result)
+        print(f"   ⏱️  {result['elapsed_s']}s, {result['records_sent']} records, {result['rows_per_s']} rows/s, "
+              f"peak RSS {result['peak_rss_mb']} MB, {result['total_requests']} requests")
+
+    server.shutdown()
+
+    if args.output:
+        with open(args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'run_at': now.isoformat(), 'results': results}) + "\n")
+        print(f"\n📝 Results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
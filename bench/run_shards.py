@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Runs several sharded backfill workers against the same local PostgreSQL and
+mock API, then checks that every module was processed by exactly one worker.
+
+    python bench/run_shards.py --dsn "dbname=bench user=postgres" --workers 3
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_worker(args):
+    """Runs one backfill worker in current process and prints JSON result"""
+    import main
+    from run_scenarios import configure
+
+    configure(main, args.api_url, args.dsn)
+    code = main.main([
+        'backfill', '--from', args.date_from, '--to', args.date_to,
+        '--shard-index', str(args.shard_index), '--shard-count', str(args.workers),
+        '--worker-id', f"bench-worker-{args.shard_index}",
+    ])
+    result = {
+        'shard_index': args.shard_index,
+        'exit_code': code,
+        'modules': sorted(main.METRICS.summary()['modules']),
+    }
+    print('SHARD_RESULT ' + json.dumps(result))
+
+
+def local_modules(dsn):
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT mac_address FROM agrosense.lora_module")
+            return sorted(row[0] for row in cur.fetchall())
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run sharded backfill workers locally")
+    parser.add_argument('--dsn', required=True, help="libpq connection string of benchmark database")
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--days', type=int, default=7, help="backfill period ending now")
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    # Internal - used when worker runs in child process
+    parser.add_argument('--shard-index', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', help=argparse.SUPPRESS)
+    parser.add_argument('--date-from', help=argparse.SUPPRESS)
+    parser.add_argument('--date-to', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.shard_index is not None:
+        run_worker(args)
+        return
+
+    from mock_api import start_mock_api
+
+    server, state, api_url = start_mock_api(0, args.latency_ms)
+    now = datetime.now(timezone.utc)
+    date_from = (now - timedelta(days=args.days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    date_to = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    # Create collections once so workers do not race on creating them
+    import main as sync
+    from run_scenarios import configure
+    configure(sync, api_url, args.dsn)
+    sync.setup_collections(sync.new_state())
+
+    print(f"🧪 Starting {args.workers} workers against {api_url}")
+    started = time.perf_counter()
+    children = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--dsn', args.dsn, '--workers', str(args.workers),
+             '--shard-index', str(i), '--api-url', api_url, '--date-from', date_from, '--date-to', date_to],
+            cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        for i in range(args.workers)
+    ]
+
+    results = []
+    for i, child in enumerate(children):
+        stdout, stderr = child.communicate()
+        line = next((l for l in stdout.splitlines() if l.startswith('SHARD_RESULT ')), None)
+        if line is None:
+            print(f"❌ Worker {i} failed:\n{stderr[-2000:]}")
+            continue
+        results.append(json.loads(line[len('SHARD_RESULT '):]))
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    seen = {}
+    for result in results:
+        print(f"   Worker {result['shard_index']}: {len(result['modules'])} modules, exit code {result['exit_code']}")
+        for mac in result['modules']:
+            seen.setdefault(mac, []).append(result['shard_index'])
+
+    duplicated = {mac: workers for mac, workers in seen.items() if len(workers) > 1}
+    missing = [mac for mac in local_modules(args.dsn) if mac not in seen and not sync.is_module_excluded(mac)]
+    print(f"\n⏱️  {elapsed:.1f}s, {state.records_received} records received by mock API")
+    if duplicated or missing or len(results) != args.workers:
+        print(f"❌ Duplicated: {duplicated}\n❌ Missing: {missing}")
+        sys.exit(1)
+    print("✅ Every module was processed by exactly one worker")
+
+
+if __name__ == "__main__":
+    main()
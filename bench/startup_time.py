@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for main.py and live.py.
+Measures wall time of fresh interpreters importing each script and running
+`--help`, plus cumulative import time of the slowest top-level modules
+(python -X importtime). With --compare REV the same is measured on a git
+revision (extracted with git archive) for a before/after comparison.
+
+    python bench/startup_time.py --runs 20
+    python bench/startup_time.py --runs 20 --compare HEAD~1
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    'import main': ['-c', 'import main'],
+    'import live': ['-c', 'import live'],
+    'main.py --help': ['main.py', '--help'],
+    'live.py --help': ['live.py', '--help'],
+}
+
+
+def measure(tree, args, runs):
+    """Returns list of wall times (ms) of `python <args>` run in tree"""
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=tree, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+def top_imports(tree, module, top=8):
+    """Returns [(cumulative_ms, module)] of slowest top-level imports of module"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=tree, capture_output=True, text=True, check=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit() or name.startswith('   '):
+            continue  # header line or nested import
+        entries.append((int(cumulative) / 1000, name.strip()))
+    return sorted(entries, reverse=True)[:top]
+
+
+def extract_revision(revision, directory):
+    archive = os.path.join(directory, 'tree.tar')
+    subprocess.run(['git', 'archive', '--format=tar', '-o', archive, revision], cwd=ROOT, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(directory)
+    return directory
+
+
+def report(label, tree, runs):
+    print(f"\n📦 {label}")
+    results = {}
+    for name, args in COMMANDS.items():
+        try:
+            times = measure(tree, args, runs)
+        except subprocess.CalledProcessError:
+            print(f"   {name:<16} failed")
+            continue
+        results[name] = statistics.median(times)
+        print(f"   {name:<16} median {results[name]:7.1f} ms   min {min(times):7.1f} ms")
+    for module in ('main', 'live'):
+        print(f"   Slowest imports of {module}:")
+        for cumulative, name in top_imports(tree, module):
+            print(f"      {cumulative:7.1f} ms  {name}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure interpreter startup and import time of the scripts")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--compare', metavar='REV', help="also measure this git revision")
+    args = parser.parse_args()
+
+    current = report('Working tree', ROOT, args.runs)
+    if not args.compare:
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = report(f"Revision {args.compare}", extract_revision(args.compare, directory), args.runs)
+
+    print(f"\n⚖️  {args.compare} -> working tree (median)")
+    for name, value in current.items():
+        if name in baseline:
+            print(f"   {name:<16} {baseline[name]:7.1f} ms -> {value:7.1f} ms ({value - baseline[name]:+.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
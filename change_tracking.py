@@ -0,0 +1,114 @@
+"""
+Change tracking for late-arriving and corrected measurements.
+Instead of measurement time (lm.date > last_timestamp) runs are driven by an
+insertion-order watermark stored in the local PostgreSQL
+(nostradamus_sync.change_watermark), so rows inserted late with an old date
+and rows whose valid/device_on flag flipped are found however old they are.
+
+Two cursors are supported:
+    xmin - transaction ID of last insert/update of the row (PostgreSQL 13+).
+           Catches inserts and updates; the watermark is the oldest running
+           transaction, so rows committed after the run started are not lost.
+           Needs a scan of lora_measurement (age(xmin) is not indexable).
+    id   - lora_measurement.id (bigserial). Uses the primary key index but
+           only sees inserts.
+Physically deleted rows are not detected by either cursor.
+"""
+
+import reconcile
+from lazy import lazy_import
+
+psycopg2_extras = lazy_import('psycopg2.extras')
+
+CURSORS = ('xmin', 'id')
+
+SCHEMA_SQL = '''
+    CREATE SCHEMA IF NOT EXISTS nostradamus_sync;
+    CREATE TABLE IF NOT EXISTS nostradamus_sync.change_watermark (
+        consumer varchar PRIMARY KEY,
+        watermark bigint NOT NULL,
+        updated_at timestamptz NOT NULL DEFAULT now()
+    );
+'''
+
+READ_WATERMARK_SQL = 'SELECT watermark FROM nostradamus_sync.change_watermark WHERE consumer = %s'
+
+WRITE_WATERMARK_SQL = '''
+    INSERT INTO nostradamus_sync.change_watermark (consumer, watermark, updated_at)
+    VALUES (%s, %s, now())
+    ON CONFLICT (consumer) DO UPDATE SET watermark = EXCLUDED.watermark, updated_at = now()
+'''
+
+# Position to resume from next run, taken before changed rows are read
+CURRENT_WATERMARK_SQL = {
+    'xmin': 'SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint',
+    'id': 'SELECT COALESCE(MAX(id), 0) FROM lora_measurement',
+}
+
+# xmin is a 32-bit wrapping xid - age() gives its distance from the next xid,
+# so "changed since watermark" is age(xmin) <= next_xid - watermark
+CHANGED_SINCE = {
+    'xmin': 'age(lm.xmin) <= pg_snapshot_xmax(pg_current_snapshot())::text::bigint - %s',
+    'id': 'lm.id > %s',
+}
+
+CHANGED_BUCKETS_QUERY = '''
+    SELECT
+        lm.mac_address_lora_module AS mac_address,
+        date_trunc(%s, lm.date) AS bucket,
+        COUNT(*) AS changed_rows
+    FROM lora_measurement lm
+    JOIN lora_device_type_sensor_type ldt ON lm.id_lora_device_type_sensor_type = ldt.id
+    JOIN lora_sensor_type st ON ldt.id_lora_sensor_type = st.id
+    WHERE
+        {changed_since}
+        AND lm.mac_address_lora_module = ANY(%s)
+        AND st.name = ANY(%s)
+    GROUP BY 1, 2
+'''
+
+
+def ensure_schema(conn):
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+    conn.commit()
+
+
+def read_watermark(conn, consumer):
+    """Returns stored watermark of consumer, None on first run"""
+    with conn.cursor() as cur:
+        cur.execute(READ_WATERMARK_SQL, (consumer,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def write_watermark(conn, consumer, watermark):
+    with conn.cursor() as cur:
+        cur.execute(WRITE_WATERMARK_SQL, (consumer, watermark))
+    conn.commit()
+
+
+def current_watermark(conn, cursor='xmin'):
+    with conn.cursor() as cur:
+        cur.execute("SET search_path TO agrosense, public;")
+        cur.execute(CURRENT_WATERMARK_SQL[cursor])
+        return cur.fetchone()[0]
+
+
+def fetch_changed_buckets(conn, since, mac_addresses, sensor_names, cursor='xmin', unit='hour'):
+    """
+    Returns {mac: {bucket_start: changed_rows}} of buckets with rows inserted or
+    updated after watermark since. valid/device_on are not filtered, so rows that
+    were invalidated are reported too (their bucket has to be re-sent without them).
+    """
+    if cursor not in CURSORS:
+        raise ValueError(f"Invalid change cursor. Use one of: {', '.join(CURSORS)}")
+    query = CHANGED_BUCKETS_QUERY.format(changed_since=CHANGED_SINCE[cursor])
+    changed = {}
+    with conn.cursor(cursor_factory=psycopg2_extras.RealDictCursor) as cur:
+        cur.execute("SET search_path TO agrosense, public;")
+        cur.execute(query, (unit, since, list(mac_addresses), list(sensor_names)))
+        for row in cur.fetchall():
+            bucket = reconcile.truncate(row['bucket'], unit)
+            changed.setdefault(row['mac_address'], {})[bucket] = row['changed_rows']
+    return changed
@@ -0,0 +1,246 @@
+"""
+Compact columnar batch - holds one module's rows column-wise (float arrays
+with null masks, float64 epoch timestamps and a shared key/name/location
+header) and turns them into JSON only when they are sent. Timestamps keep
+microseconds; they are sent as UTC with a Z suffix, with a fraction only
+when they have one (2024-01-01T00:00:00Z, 2024-01-01T00:00:00.250000Z).
+"""
+
+import json
+import math
+import time
+from array import array
+from datetime import datetime, timezone
+
+import copy_export
+
+HEADER_FIELDS = ('key', 'name', 'latitude_4326', 'longitude_4326')
+RESOLUTION = 0.000001  # Timestamps are kept to the microsecond
+
+
+def parse_timestamp(value):
+    """Converts ISO timestamp string (UTC if naive) to epoch seconds, fraction kept"""
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def to_array(typecode, values):
+    """Copies buffer of NumPy values into array of typecode ('d' for timestamps and columns)"""
+    result = array(typecode)
+    result.frombytes(values.tobytes())
+    return result
+
+
+def format_timestamp(epoch):
+    """Converts epoch seconds to ISO timestamp string used by the API, microseconds only if present"""
+    seconds, micros = divmod(round(epoch * 1000000), 1000000)
+    if micros:
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + '.%06dZ' % micros
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+
+class ColumnarBatch:
+    """Rows of a single module stored column by column"""
+
+    def __init__(self, fields, key=None, name=None, latitude=None, longitude=None):
+        self.fields = list(fields)
+        self.key = key
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timestamps = array('d')
+        self.columns = {field: array('d') for field in self.fields}
+        self.masks = {field: bytearray() for field in self.fields}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __bool__(self):
+        return len(self.timestamps) > 0
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by column buffers"""
+        size = self.timestamps.itemsize * len(self.timestamps)
+        for field in self.fields:
+            size += self.columns[field].itemsize * len(self.columns[field]) + len(self.masks[field])
+        return size
+
+    def set_header(self, key, name, latitude, longitude):
+        self.key = key
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def append(self, timestamp, values):
+        """Appends one row - timestamp in (fractional) epoch seconds, values aligned with fields (None for null)"""
+        self.timestamps.append(timestamp)
+        for field, value in zip(self.fields, values):
+            if value is None:
+                self.columns[field].append(0.0)
+                self.masks[field].append(0)
+            else:
+                self.columns[field].append(float(value))
+                self.masks[field].append(1)
+
+    def append_record(self, record):
+        """Appends one row from API-shaped dict"""
+        if self.key is None:
+            self.set_header(record.get('key'), record.get('name'),
+                            record.get('latitude_4326'), record.get('longitude_4326'))
+        self.append(parse_timestamp(record['timestamp']), [record.get(field) for field in self.fields])
+
+    @classmethod
+    def from_records(cls, records, fields):
+        batch = cls(fields)
+        for record in records:
+            batch.append_record(record)
+        return batch
+
+    def extend(self, other):
+        """Appends all rows of another batch of the same module"""
+        if self.key is None:
+            self.set_header(other.key, other.name, other.latitude, other.longitude)
+        self.timestamps.extend(other.timestamps)
+        for field in self.fields:
+            self.columns[field].extend(other.columns[field])
+            self.masks[field].extend(other.masks[field])
+
+    def empty_like(self):
+        return ColumnarBatch(self.fields, self.key, self.name, self.latitude, self.longitude)
+
+    def take(self, indices):
+        """Returns new batch holding only rows at given indices"""
+        batch = self.empty_like()
+        for i in indices:
+            batch.timestamps.append(self.timestamps[i])
+            for field in self.fields:
+                batch.columns[field].append(self.columns[field][i])
+                batch.masks[field].append(self.masks[field][i])
+        return batch
+
+    def slice(self, start, stop):
+        """Returns new batch holding rows[start:stop]"""
+        batch = self.empty_like()
+        batch.timestamps = self.timestamps[start:stop]
+        for field in self.fields:
+            batch.columns[field] = self.columns[field][start:stop]
+            batch.masks[field] = self.masks[field][start:stop]
+        return batch
+
+    def iter_slices(self, batch_size):
+        for i in range(0, len(self), batch_size):
+            yield i, self.slice(i, i + batch_size)
+
+    def value(self, field, i):
+        """Value of row i, None for null and for NaN/inf (not valid JSON)"""
+        value = self.columns[field][i]
+        return value if self.masks[field][i] and math.isfinite(value) else None
+
+    def to_records(self, start=0, stop=None):
+        """Materializes rows as API-shaped dicts"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        records = []
+        for i in range(start, stop):
+            record = {'key': self.key, 'name': self.name, 'timestamp': format_timestamp(self.timestamps[i])}
+            for field in self.fields:
+                record[field] = self.value(field, i)
+            record['latitude_4326'] = self.latitude
+            record['longitude_4326'] = self.longitude
+            records.append(record)
+        return records
+
+    def json_rows(self, start=0, stop=None):
+        """Serializes rows[start:stop] as list of JSON objects"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        prefix = '{"key": %s, "name": %s, "timestamp": "' % (
+            json.dumps(self.key, ensure_ascii=False), json.dumps(self.name, ensure_ascii=False))
+        suffix = ', "latitude_4326": %s, "longitude_4326": %s}' % (
+            json.dumps(self.latitude), json.dumps(self.longitude))
+        field_names = [json.dumps(field) for field in self.fields]
+
+        rows = []
+        for i in range(start, stop):
+            parts = [prefix, format_timestamp(self.timestamps[i]), '"']
+            for field, field_name in zip(self.fields, field_names):
+                value = self.columns[field][i]
+                parts.append(', ')
+                parts.append(field_name)
+                parts.append(': ')
+                # NaN and inf are not valid JSON, sent as null
+                parts.append(repr(value) if self.masks[field][i] and math.isfinite(value) else 'null')
+            parts.append(suffix)
+            rows.append(''.join(parts))
+        return rows
+
+    def to_json(self, start=0, stop=None):
+        """Serializes rows[start:stop] as JSON array body for send_data"""
+        return '[' + ','.join(self.json_rows(start, stop)) + ']'
+
+    def to_jsonl(self, start=0, stop=None):
+        """Serializes rows[start:stop] as JSON lines"""
+        return ''.join(row + '\n' for row in self.json_rows(start, stop))
+
+
+class ColumnarCopySink:
+    """File-like target for copy_expert that appends tab-separated rows into a ColumnarBatch"""
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.buffer = b''
+        self.header_len = len(HEADER_FIELDS)
+
+    def write(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split(b'\n')
+        for line in lines:
+            if line:
+                self._add_line(line.decode('utf-8'))
+        return len(chunk)
+
+    def _add_line(self, line):
+        values = [None if v == '\\N' else copy_export.unescape_copy_text(v) for v in line.split('\t')]
+        key, name, latitude, longitude, epoch = values[:self.header_len + 1]
+        if self.batch.key is None:
+            self.batch.set_header(key, name,
+                                  float(latitude) if latitude is not None else None,
+                                  float(longitude) if longitude is not None else None)
+        self.batch.append(float(epoch), values[self.header_len + 1:])
+
+    def close(self):
+        if self.buffer:
+            self.write(b'\n')
+
+
+def build_columnar_query(query, fields):
+    """Wraps single-column jsonb pivot query so it returns one column per field"""
+    columns = [
+        "q.data->>'key'",
+        "q.data->>'name'",
+        "q.data->>'latitude_4326'",
+        "q.data->>'longitude_4326'",
+        "EXTRACT(EPOCH FROM (q.data->>'timestamp')::timestamp)::float8",
+    ]
+    for field in fields:
+        columns.append(f"(q.data->>'{field}')::float8")
+    return f"SELECT {', '.join(columns)} FROM (\n{query.strip().rstrip(';')}\n) q"
+
+
+def copy_columnar(conn, query, params, fields, sink):
+    """Runs pivot query through COPY into sink (ColumnarCopySink or subclass)"""
+    with conn.cursor() as cur:
+        cur.execute("SET search_path TO agrosense, public;")
+        statement = copy_export.build_copy_statement(cur, build_columnar_query(query, fields), params)
+        cur.copy_expert(statement, sink)
+    sink.close()
+
+
+def fetch_columnar(conn, query, params, fields):
+    """Runs pivot query through COPY and loads result into a ColumnarBatch"""
+    batch = ColumnarBatch(fields)
+    copy_columnar(conn, query, params, fields, ColumnarCopySink(batch))
+    return batch
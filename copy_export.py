@@ -0,0 +1,174 @@
+"""
+COPY-based bulk export - streams pivot query results from PostgreSQL
+straight into upload-ready JSON batches, without building a Python dict
+per row. Used by main.py for large historical backfills.
+"""
+
+import re
+import struct
+
+# Backslash sequences used by COPY text format
+COPY_TEXT_ESCAPES = {
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'v': '\v',
+    '\\': '\\',
+}
+
+COPY_TEXT_ESCAPE_RE = re.compile(r'\\(.)')
+
+BINARY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+
+def unescape_copy_text(value):
+    """Reverts COPY text format escaping for a single column value"""
+    if '\\' not in value:
+        return value
+    return COPY_TEXT_ESCAPE_RE.sub(lambda m: COPY_TEXT_ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+class BatchCollector:
+    """Collects JSON row texts and hands them off as JSON array bodies"""
+
+    def __init__(self, on_batch, batch_size):
+        self.on_batch = on_batch
+        self.batch_size = batch_size
+        self.rows = []
+        self.total = 0
+
+    def add(self, row_json):
+        self.rows.append(row_json)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        body = '[' + ','.join(self.rows) + ']'
+        count = len(self.rows)
+        self.rows = []
+        self.total += count
+        self.on_batch(body, count)
+
+
+class CopyTextSink:
+    """File-like target for copy_expert in text format (one jsonb column per line)"""
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.buffer = b''
+
+    def write(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split(b'\n')
+        for line in lines:
+            if line and line != b'\\N':
+                self.collector.add(unescape_copy_text(line.decode('utf-8')))
+        return len(chunk)
+
+    def close(self):
+        if self.buffer:
+            self.write(b'\n')
+
+
+class CopyBinarySink:
+    """File-like target for copy_expert in binary format (one jsonb column per tuple)"""
+
+    def __init__(self, collector):
+        self.collector = collector
+        self.buffer = b''
+        self.header_done = False
+        self.finished = False
+
+    def write(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('latin-1')
+        self.buffer += chunk
+        self._parse()
+        return len(chunk)
+
+    def _parse(self):
+        buf = self.buffer
+        pos = 0
+
+        if not self.header_done:
+            # Signature (11) + flags (4) + header extension length (4)
+            if len(buf) < 19:
+                return
+            if buf[:11] != BINARY_SIGNATURE:
+                raise ValueError("Invalid COPY binary signature")
+            ext_len = struct.unpack('!i', buf[15:19])[0]
+            if len(buf) < 19 + ext_len:
+                return
+            pos = 19 + ext_len
+            self.header_done = True
+
+        while not self.finished and len(buf) - pos >= 2:
+            field_count = struct.unpack('!h', buf[pos:pos + 2])[0]
+            if field_count == -1:
+                self.finished = True
+                pos += 2
+                break
+            if field_count != 1:
+                raise ValueError(f"Expected 1 column in COPY output, got {field_count}")
+            if len(buf) - pos < 6:
+                break
+            length = struct.unpack('!i', buf[pos + 2:pos + 6])[0]
+            if length == -1:
+                pos += 6
+                continue
+            if len(buf) - pos - 6 < length:
+                break
+            value = buf[pos + 6:pos + 6 + length]
+            pos += 6 + length
+            # jsonb binary representation: version byte (1) followed by JSON text
+            if value[:1] == b'\x01':
+                value = value[1:]
+            self.collector.add(value.decode('utf-8'))
+
+        self.buffer = buf[pos:]
+
+    def close(self):
+        pass
+
+
+def build_copy_statement(cur, query, params, copy_format='text'):
+    """Inlines query parameters and wraps query into COPY (...) TO STDOUT"""
+    inner = cur.mogrify(query, params)
+    if isinstance(inner, bytes):
+        inner = inner.decode('utf-8')
+    inner = inner.strip().rstrip(';')
+
+    if copy_format == 'binary':
+        return f"COPY (\n{inner}\n) TO STDOUT WITH (FORMAT binary)"
+    elif copy_format == 'text':
+        return f"COPY (\n{inner}\n) TO STDOUT"
+    else:
+        raise ValueError("Invalid COPY format. Use 'text' or 'binary'.")
+
+
+def stream_query_batches(conn, query, params, on_batch, batch_size=2000, copy_format='text'):
+    """
+    Runs single-column jsonb query through COPY and calls on_batch(body, count)
+    for every batch_size rows. body is a ready-to-send JSON array string.
+    Returns total number of rows streamed.
+    """
+    collector = BatchCollector(on_batch, batch_size)
+    if copy_format == 'binary':
+        sink = CopyBinarySink(collector)
+    else:
+        sink = CopyTextSink(collector)
+
+    with conn.cursor() as cur:
+        cur.execute("SET search_path TO agrosense, public;")
+        statement = build_copy_statement(cur, query, params, copy_format)
+        cur.copy_expert(statement, sink)
+
+    sink.close()
+    collector.flush()
+    return collector.total
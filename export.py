@@ -0,0 +1,250 @@
+"""
+Local export of module data for analysts, streamed through COPY into
+partitioned, append-only files:
+
+    data/export/station_type=PIS/mac=PIS_COKA/month=2024-01/part-20240101T000000Z-20240131T235000Z.jsonl.gz
+
+Formats: jsonl (gzip-compressed JSON lines, same records as sent to the API),
+parquet and arrow (Arrow IPC file) - the columnar ones need pyarrow. Each
+write adds new part files and never touches existing ones; a part is written
+to a temporary name first and hard-linked to its final name, so readers only
+ever see complete files and a name that is taken gets a -1, -2, ... suffix
+instead of being overwritten. Part names hold the first and last timestamp
+to the microsecond. The
+newest exported timestamp per format and module is kept in
+data/export/manifest.json, so every run only exports rows newer than the last
+one. The hive-style directory names let pyarrow.dataset, DuckDB or Spark read
+the whole tree as one table with station_type, mac and month columns.
+"""
+
+import gzip
+import importlib.util
+import json
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+
+from columnar import ColumnarCopySink, ColumnarBatch
+from instrumentation import METRICS, EXPORT_WRITE
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pa = lazy_import('pyarrow')
+pa_parquet = lazy_import('pyarrow.parquet')
+pa_ipc = lazy_import('pyarrow.ipc')
+
+DEFAULT_EXPORT_DIR = os.path.join('data', 'export')
+CHUNK_ROWS = 100000  # Rows buffered from the COPY stream before a part file is written
+FORMATS = {
+    'jsonl': '.jsonl.gz',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+
+# Same records as the backfill/live queries, ascending within one open range
+EXPORT_PARAMS = '''
+            %s::varchar AS mac_address,
+            %s::timestamp AS date_from,
+            %s::timestamp AS date_to'''
+
+EXPORT_DATE_FILTER = 'lm.date > p.date_from AND lm.date < p.date_to'
+
+
+def export_query(station, store=None):
+    """Export query of station type, read from measurement pivot store if given"""
+    if store is not None:
+        return store.build_query(EXPORT_PARAMS, EXPORT_DATE_FILTER, 'ASC', [s for s in station.sensors if s.field])
+    return station.build_query(EXPORT_PARAMS, EXPORT_DATE_FILTER, 'ASC')
+
+
+def missing_dependencies(formats):
+    """Names of packages required by formats that are not installed"""
+    if any(f in COLUMNAR_FORMATS for f in formats) and importlib.util.find_spec('pyarrow') is None:
+        return ['pyarrow']
+    return []
+
+
+def month_ranges(start, end):
+    """
+    Splits open range (start, end) into open ranges within one UTC month each,
+    in ascending order. Ranges after the first start one microsecond before
+    the month, so rows at midnight of the 1st are selected exactly once.
+    """
+    ranges = []
+    month = start.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while True:
+        month = next_month(month)
+        if month >= end:
+            ranges.append((start, end))
+            return ranges
+        ranges.append((start, month))
+        start = month - timedelta(microseconds=1)
+
+
+def next_month(dt):
+    """First instant of the month after dt's month"""
+    year, month = (dt.year + 1, 1) if dt.month == 12 else (dt.year, dt.month + 1)
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+def compact_timestamp(epoch):
+    """20240101T000000Z, with microseconds (20240101T000000.250000Z) if epoch has a fraction"""
+    seconds, micros = divmod(round(epoch * 1000000), 1000000)
+    if micros:
+        return time.strftime('%Y%m%dT%H%M%S', time.gmtime(seconds)) + '.%06dZ' % micros
+    return time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(seconds))
+
+
+def to_arrow_table(batch):
+    """Converts ColumnarBatch into pyarrow Table (nulls from masks, timestamps as UTC microseconds)"""
+    n = len(batch)
+    columns = {
+        'key': pa.array([batch.key] * n, type=pa.string()),
+        'name': pa.array([batch.name] * n, type=pa.string()),
+        'timestamp': pa.array(np.round(np.frombuffer(batch.timestamps, dtype=np.float64) * 1e6).astype(np.int64),
+                              type=pa.timestamp('us', tz='UTC')),
+    }
+    for field in batch.fields:
+        present = np.frombuffer(batch.masks[field], dtype=np.uint8).astype(bool)
+        columns[field] = pa.array(np.frombuffer(batch.columns[field], dtype=np.float64), mask=~present)
+    columns['latitude_4326'] = pa.array([batch.latitude] * n, type=pa.float64())
+    columns['longitude_4326'] = pa.array([batch.longitude] * n, type=pa.float64())
+    return pa.table(columns)
+
+
+def publish(tmp_path, path, suffix):
+    """Links finished file to path (or path with -1, -2, ... before suffix if taken), returns final path"""
+    stem = path[:-len(suffix)]
+    sequence = 0
+    while True:
+        try:
+            os.link(tmp_path, path)
+            break
+        except FileExistsError:
+            sequence += 1
+            path = f"{stem}-{sequence}{suffix}"
+    os.remove(tmp_path)
+    return path
+
+
+def write_part(path, batch, export_format):
+    """Writes batch as one part file, visible under its final name only when complete, returns (path, size)"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if export_format == 'jsonl':
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            f.write(batch.to_jsonl())
+    elif export_format == 'parquet':
+        pa_parquet.write_table(to_arrow_table(batch), tmp_path, compression='zstd')
+    else:
+        table = to_arrow_table(batch)
+        with pa.OSFile(tmp_path, 'wb') as f, pa_ipc.new_file(f, table.schema) as writer:
+            writer.write_table(table)
+    path = publish(tmp_path, path, FORMATS[export_format])
+    return path, os.path.getsize(path)
+
+
+class Manifest:
+    """Newest exported timestamp per format and module, shared by all threads of the process"""
+
+    def __init__(self, path):
+        self.path = path
+        self.watermarks = {}  # format -> {mac: epoch}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.watermarks = json.load(f)
+
+    def get(self, export_format, mac_address):
+        return self.watermarks.get(export_format, {}).get(mac_address)
+
+    def advance(self, export_format, mac_address, epoch):
+        with self.lock:
+            self.watermarks.setdefault(export_format, {})[mac_address] = epoch
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.watermarks, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class ExportSink(ColumnarCopySink):
+    """COPY target that hands rows to exporter every CHUNK_ROWS rows instead of holding them all"""
+
+    def __init__(self, exporter, station_type, fields):
+        super().__init__(ColumnarBatch(fields))
+        self.exporter = exporter
+        self.station_type = station_type
+        self.rows = 0
+
+    def write(self, chunk):
+        written = super().write(chunk)
+        if len(self.batch) >= self.exporter.chunk_rows:
+            self.flush()
+        return written
+
+    def flush(self):
+        if self.batch:
+            self.rows += self.exporter.write(self.station_type, self.batch)
+            self.batch = self.batch.empty_like()
+
+    def close(self):
+        super().close()
+        self.flush()
+
+
+class Exporter:
+    """Writes module batches into partitioned part files of the configured formats"""
+
+    def __init__(self, root=DEFAULT_EXPORT_DIR, formats=('jsonl',), chunk_rows=CHUNK_ROWS):
+        unknown = [f for f in formats if f not in FORMATS]
+        if unknown:
+            raise ValueError(f"Invalid export format(s) {', '.join(unknown)}. Use: {', '.join(FORMATS)}")
+        self.root = root
+        self.formats = list(formats)
+        self.chunk_rows = chunk_rows
+        self.manifest = Manifest(os.path.join(root, 'manifest.json'))
+
+    def resume_from(self, mac_address, default_start):
+        """Start of module's next export - oldest watermark of all formats, default_start for new ones"""
+        starts = []
+        for export_format in self.formats:
+            epoch = self.manifest.get(export_format, mac_address)
+            starts.append(default_start if epoch is None else datetime.fromtimestamp(epoch, timezone.utc))
+        return min(starts)
+
+    def sink(self, station_type, fields):
+        return ExportSink(self, station_type, fields)
+
+    def partition(self, station_type, mac_address, epoch):
+        return os.path.join(self.root, f"station_type={station_type}", f"mac={mac_address}",
+                            f"month={time.strftime('%Y-%m', time.gmtime(epoch))}")
+
+    def write(self, station_type, batch):
+        """
+        Writes rows of batch (ascending timestamps, one module) newer than each
+        format's watermark, one part per month. Returns number of rows in batch.
+        """
+        with METRICS.timer(EXPORT_WRITE) as t:
+            for export_format in self.formats:
+                watermark = self.manifest.get(export_format, batch.key)
+                start = 0 if watermark is None else bisect_right(batch.timestamps, watermark)
+                while start < len(batch):
+                    # Rows up to the end of the month of batch.timestamps[start]
+                    month_end = int(next_month(datetime.fromtimestamp(batch.timestamps[start], timezone.utc)).timestamp())
+                    stop = bisect_left(batch.timestamps, month_end, start)
+                    part = batch.slice(start, stop)
+
+                    directory = self.partition(station_type, batch.key, part.timestamps[0])
+                    os.makedirs(directory, exist_ok=True)
+                    name = f"part-{compact_timestamp(part.timestamps[0])}-{compact_timestamp(part.timestamps[-1])}"
+                    _, nbytes = write_part(os.path.join(directory, name + FORMATS[export_format]), part, export_format)
+                    self.manifest.advance(export_format, batch.key, part.timestamps[-1])
+                    t.add(rows=len(part), nbytes=nbytes)
+                    start = stop
+        return len(batch)
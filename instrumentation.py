@@ -0,0 +1,170 @@
+"""
+Lightweight timing and throughput instrumentation for the sync pipeline.
+Stages (DB connect, query, fetch, serialize, HTTP send, server lookup) are
+timed per module and per run and summarized as JSON (p50/p95, rows/s, bytes/s).
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+DEFAULT_METRICS_DIR = os.environ.get('NOSTRADAMUS_METRICS_DIR', os.path.join('data', 'metrics'))
+
+# Pipeline stages
+DB_CONNECT = 'db_connect'
+DB_QUERY = 'db_query'
+DB_FETCH = 'db_fetch'
+SERIALIZE = 'serialize'
+HTTP_SEND = 'http_send'
+SERVER_LOOKUP = 'server_lookup'
+RATE_LIMIT_WAIT = 'rate_limit_wait'
+PRECHECK = 'precheck'
+MEMORY_WAIT = 'memory_wait'
+VALIDATE = 'validate'
+EXPORT_WRITE = 'export_write'
+
+current_module = ContextVar('current_module', default=None)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class StageTimer:
+    """Handle returned by Metrics.timer - lets caller attach rows/bytes/labels"""
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.labels = {}
+
+    def add(self, rows=0, nbytes=0, **labels):
+        self.rows += rows
+        self.bytes += nbytes
+        self.labels.update(labels)
+
+
+class Metrics:
+    """Collects stage timings and counters for one run"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = datetime.now(timezone.utc)
+            self.started = time.perf_counter()
+            self.samples = []  # (stage, module, seconds, rows, bytes)
+            self.counters = {}
+
+    def add_listener(self, listener):
+        """Registers listener(stage, module, seconds, rows, nbytes, labels) called for every sample"""
+        self.listeners.append(listener)
+
+    @contextmanager
+    def module(self, module):
+        """Marks all stages inside the block as belonging to module"""
+        token = current_module.set(module)
+        try:
+            yield
+        finally:
+            current_module.reset(token)
+
+    @contextmanager
+    def timer(self, stage, module=None):
+        """Times block as stage sample"""
+        handle = StageTimer()
+        start = time.perf_counter()
+        try:
+            yield handle
+        finally:
+            self.record(stage, time.perf_counter() - start, module, handle.rows, handle.bytes, handle.labels)
+
+    def record(self, stage, seconds, module=None, rows=0, nbytes=0, labels=None):
+        module = module or current_module.get()
+        with self.lock:
+            self.samples.append((stage, module, seconds, rows, nbytes))
+        for listener in self.listeners:
+            listener(stage, module, seconds, rows, nbytes, labels or {})
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @staticmethod
+    def summarize(samples):
+        """Per-stage summary of (stage, module, seconds, rows, bytes) samples"""
+        stages = {}
+        for stage, _, seconds, rows, nbytes in samples:
+            entry = stages.setdefault(stage, {'durations': [], 'rows': 0, 'bytes': 0})
+            entry['durations'].append(seconds)
+            entry['rows'] += rows
+            entry['bytes'] += nbytes
+
+        summary = {}
+        for stage, entry in stages.items():
+            total = sum(entry['durations'])
+            summary[stage] = {
+                'count': len(entry['durations']),
+                'total_s': round(total, 6),
+                'p50_ms': round(percentile(entry['durations'], 50) * 1000, 3),
+                'p95_ms': round(percentile(entry['durations'], 95) * 1000, 3),
+                'max_ms': round(max(entry['durations']) * 1000, 3),
+                'rows': entry['rows'],
+                'bytes': entry['bytes'],
+                'rows_per_s': round(entry['rows'] / total, 1) if total > 0 else None,
+                'bytes_per_s': round(entry['bytes'] / total, 1) if total > 0 else None,
+            }
+        return summary
+
+    def summary(self):
+        """Returns machine-readable run summary"""
+        with self.lock:
+            samples = list(self.samples)
+            counters = dict(self.counters)
+            elapsed = time.perf_counter() - self.started
+
+        per_module = {}
+        for sample in samples:
+            if sample[1] is not None:
+                per_module.setdefault(sample[1], []).append(sample)
+
+        return {
+            'started_at': self.started_at.isoformat(),
+            'elapsed_s': round(elapsed, 3),
+            'counters': counters,
+            'stages': self.summarize(samples),
+            'modules': {module: self.summarize(module_samples) for module, module_samples in sorted(per_module.items())},
+        }
+
+    def write_summary(self, name, directory=DEFAULT_METRICS_DIR):
+        """Writes run summary as JSON file, returns its path"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}-{self.started_at.strftime('%Y%m%dT%H%M%SZ')}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        return path
+
+    def print_summary(self):
+        """Prints short per-stage table"""
+        summary = self.summary()
+        print(f"⏱️  Stage timings (run {summary['elapsed_s']}s):")
+        for stage, entry in summary['stages'].items():
+            rate = f", {entry['rows_per_s']} rows/s" if entry['rows'] and entry['rows_per_s'] else ""
+            print(f"   {stage:<14} n={entry['count']:<5} total={entry['total_s']:.3f}s "
+                  f"p50={entry['p50_ms']}ms p95={entry['p95_ms']}ms{rate}")
+
+
+METRICS = Metrics()
@@ -6,15 +6,33 @@ Replace CHANGE_ME!!!
 """
 
 import os
-import psycopg2
+import sys
+import argparse
+from contextlib import nullcontext
+import time
 import json
-import httpx
-from psycopg2.extras import RealDictCursor
-from datetime import datetime, timedelta
-import requests
-import pytz
-
-utc = pytz.UTC
+from datetime import datetime, timedelta, timezone
+import api
+from lazy import lazy_import
+import columnar
+import profiling
+import rate_limit
+import memory_budget
+from stations import REGISTRY
+import sharding
+import module_catalog
+import precheck
+import pivot_store
+import rollups
+import validation
+from instrumentation import METRICS, DB_CONNECT, DB_QUERY, SERIALIZE, HTTP_SEND, SERVER_LOOKUP, PRECHECK
+import prometheus_exporter
+from tracing import TRACER, current_span
+
+# Heavy modules are imported on first use
+psycopg2 = lazy_import('psycopg2')
+
+utc = timezone.utc
 
 # Configuration
 BASE_URL = "https://nostradamus-ioto.issel.ee.auth.gr/api/v1"
@@ -25,21 +43,28 @@ MASTER_KEY = 'CHANGE_ME'
 WRITE_KEY = 'CHANGE_ME'
 READ_KEY = 'd1091a7ac0fea235a022005637ed1f23dd7de7bf50ddf82d69bf68e724ecb65a'
 
-# Station Configuration
-STATION_CONFIG = {
-    'RHMZ': {
-        'prefix': '_RHMZ',
-        'collection_name': 'station_type_1',
-        'collection_id': None,
-        'excluded_modules': []
-    },
-    'PIS': {
-        'prefix': 'PIS_',
-        'collection_name': 'station_type_2',
-        'collection_id': None,
-        'excluded_modules': []
-    },
-}
+# Station types (sensors, fields, routing, collection schema) are configured in stations.json
+STATION_CONFIG = REGISTRY.station_config()
+
+# Modules of all station types, read with one query and cached in data/module_cache.json
+MODULES = module_catalog.ModuleCatalog()
+
+# Skip modules without new rows above their watermark before any server lookup (one query per station type)
+USE_PRECHECK = True
+
+# Read from wide per-station tables in nostradamus_sync (see pivot_store.py, built with "main.py pivot"),
+# refreshed incrementally at the start of each run
+USE_PIVOT_STORE = False
+PIVOT_CURSOR = 'xmin'
+
+# Rollups - hourly/daily aggregates in companion collections, buckets touched by each run are replaced (see rollups.py)
+USE_ROLLUPS = False
+ROLLUP_INTERVALS = ('hourly', 'daily')
+
+# Validation - rows failing range, spike or duplicate timestamp checks (limits per sensor in stations.json)
+# are not sent but written to data/quarantine.jsonl (see validation.py)
+USE_VALIDATION = False
+VALIDATOR = validation.Validator()
 
 # Database connection configuration
 DB_CONFIG = {
@@ -52,11 +77,8 @@ DB_CONFIG = {
 
 
 def get_station_by_mac(mac_address):
-    """Returns station type (PIS or RHMZ) based on MAC address"""
-    if mac_address.startswith('PIS_'):
-        return 'PIS'
-    else:
-        return 'RHMZ'
+    """Returns station type based on MAC address"""
+    return REGISTRY.route(mac_address)
 
 
 def get_collection_id_for_mac(mac_address):
@@ -71,152 +93,32 @@ def is_module_excluded(mac_address):
     return mac_address in STATION_CONFIG[station_type]['excluded_modules']
 
 
-def get_pis_query():
-    """Query for PIS data - fetches data after last_timestamp"""
-    return '''
-    WITH params AS (
-        SELECT
-            %s::varchar AS mac_address,
-            %s::timestamp AS last_timestamp
-    ),
-    module_info AS (
-        SELECT
-            m.mac_address,
-            m.name AS module_name,
-            ROUND(ST_Y(ml.location::geometry)::decimal, 5) AS latitude,
-            ROUND(ST_X(ml.location::geometry)::decimal, 5) AS longitude
-        FROM lora_module m
-        JOIN lora_module_location ml ON m.mac_address = ml.mac_address_lora_module
-        JOIN params p ON m.mac_address = p.mac_address
-    ),
-    raw_data AS (
-        SELECT
-            lm.date,
-            lm.value,
-            st.name AS sensor_name,
-            lm.mac_address_lora_module
-        FROM lora_measurement lm
-        JOIN lora_device_type_sensor_type ldt ON lm.id_lora_device_type_sensor_type = ldt.id
-        JOIN lora_sensor_type st ON ldt.id_lora_sensor_type = st.id
-        JOIN params p ON lm.mac_address_lora_module = p.mac_address
-        WHERE
-            lm.device_on IS TRUE
-            AND lm.valid IS TRUE
-            AND lm.date > p.last_timestamp
-            AND st.name IN (
-                'Temperatura vazduha',
-                'Vlažnost vazduha',
-                'Količina padavina',
-                'Tačka rose',
-                'Vlažnost lista'
-            )
-    )
-    SELECT
-        (jsonb_build_object(
-            'key', mi.mac_address,
-            'name', mi.module_name,
-            'timestamp', rd.date,
-            'air-temperature_celsius', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Temperatura vazduha'), 2),
-            'air-humidity_percent', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Vlažnost vazduha'), 2),
-            'precipitation_mm', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Količina padavina'), 2),
-            'dew-point_celsius', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Tačka rose'), 2),
-            'leaf-wetness_min', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Vlažnost lista'), 2),
-            'latitude_4326', mi.latitude,
-            'longitude_4326', mi.longitude
-        )) AS data
-    FROM raw_data rd
-    JOIN module_info mi ON rd.mac_address_lora_module = mi.mac_address
-    GROUP BY mi.mac_address, mi.module_name, mi.latitude, mi.longitude, rd.date
-    ORDER BY rd.date ASC
-    '''
-
-
-def get_rhmz_query():
-    """Query for RHMZ data - fetches data after last_timestamp"""
-    return '''
-    WITH params AS (
-        SELECT
-            %s::varchar AS mac_address,
-            %s::timestamp AS last_timestamp
-    ),
-    module_info AS (
-        SELECT
-            m.mac_address,
-            m.name AS module_name,
-            ROUND(ST_Y(ml.location::geometry)::decimal, 5) AS latitude,
-            ROUND(ST_X(ml.location::geometry)::decimal, 5) AS longitude
-        FROM lora_module m
-        JOIN lora_module_location ml ON m.mac_address = ml.mac_address_lora_module
-        JOIN params p ON m.mac_address = p.mac_address
-    ),
-    raw_data AS (
-        SELECT
-            lm.date,
-            lm.value,
-            st.name AS sensor_name,
-            lm.mac_address_lora_module
-        FROM lora_measurement lm
-        JOIN lora_device_type_sensor_type ldt ON lm.id_lora_device_type_sensor_type = ldt.id
-        JOIN lora_sensor_type st ON ldt.id_lora_sensor_type = st.id
-        JOIN params p ON lm.mac_address_lora_module = p.mac_address
-        WHERE
-            lm.device_on IS TRUE
-            AND lm.valid IS TRUE
-            AND lm.date > p.last_timestamp
-            AND st.name IN (
-                'Brzina vetra',
-                'Količina padavina',
-                'Smer vetra',
-                'Solarno zračenje',
-                'Tačka rose',
-                'Temperatura vazduha',
-                'Temperatura zemljišta',
-                'Udar vetra',
-                'Vazdušni pritisak',
-                'Vlažnost vazduha'
-            )
-    )
-    SELECT
-        (jsonb_build_object(
-            'key', mi.mac_address,
-            'name', mi.module_name,
-            'timestamp', rd.date,
-            'air-temperature_celsius', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Temperatura vazduha'), 2),
-            'air-humidity_percent', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Vlažnost vazduha'), 2),
-            'air-pressure_mbar', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Vazdušni pritisak'), 2),
-            'precipitation_mm', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Količina padavina'), 2),
-            'dew-point_celsius', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Tačka rose'), 2),
-            'wind-speed_m/s', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Brzina vetra'), 2),
-            'wind-direction_angle', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Smer vetra'), 2),
-            'wind-gust_m/s', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Udar vetra'), 2),
-            'solar-radiation_j/cm2', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Solarno zračenje'), 2),
-            'latitude_4326', mi.latitude,
-            'longitude_4326', mi.longitude
-        )) AS data
-    FROM raw_data rd
-    JOIN module_info mi ON rd.mac_address_lora_module = mi.mac_address
-    GROUP BY mi.mac_address, mi.module_name, mi.latitude, mi.longitude, rd.date
-    ORDER BY rd.date ASC
-    '''
-
-
+@profiling.profiled('fetch_module_data')
 def fetch_module_data(mac_address, last_timestamp):
-    """Fetches data for given module after last_timestamp"""
+    """Fetches data for given module after last_timestamp as ColumnarBatch"""
 
-    if mac_address.startswith('PIS_'):
-        QUERY = get_pis_query()
-    else:
-        QUERY = get_rhmz_query()
+    station_type = get_station_by_mac(mac_address)
+    QUERY = (pivot_store.STORES if USE_PIVOT_STORE else REGISTRY)[station_type].live_query
+    fields = STATION_CONFIG[station_type]['fields']
 
-    conn = psycopg2.connect(**DB_CONFIG)
+    with METRICS.timer(DB_CONNECT):
+        conn = psycopg2.connect(**DB_CONFIG)
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SET search_path TO agrosense, public;")
-            cur.execute(QUERY, (mac_address, last_timestamp))
-            rows = cur.fetchall()
-            return [row['data'] for row in rows]
+        # COPY runs query and transfers rows in one call
+        with METRICS.timer(DB_QUERY) as t:
+            batch = columnar.fetch_columnar(conn, QUERY, (mac_address, last_timestamp), fields)
+            t.add(rows=len(batch), nbytes=batch.nbytes)
     finally:
         conn.close()
+    return validate_batch(mac_address, batch) if USE_VALIDATION else batch
+
+
+def validate_batch(mac_address, batch):
+    """Returns valid rows of batch, rejected rows are quarantined"""
+    valid = VALIDATOR.validate(batch, REGISTRY[get_station_by_mac(mac_address)])
+    if len(valid) < len(batch):
+        print(f"   🚫 {mac_address}: {len(batch) - len(valid)} invalid rows quarantined in {VALIDATOR.path}")
+    return valid
 
 
 def get_collections(project_id, read_key):
@@ -225,8 +127,8 @@ def get_collections(project_id, read_key):
     headers = {"X-API-Key": read_key}
 
     try:
-        response = httpx.get(url, headers=headers, timeout=15.0)
-    except httpx.ReadTimeout:
+        response = api.get(url, headers=headers, timeout=15.0)
+    except api.ApiTimeout:
         print(f"❌ Timeout: Fetching collections failed")
         return []
     if response.status_code == 200:
@@ -238,57 +140,21 @@ def get_collections(project_id, read_key):
         return []
 
 
-def create_collection(project_id, master_key, station_type):
-    """Creates new collection for project"""
+def create_collection(project_id, master_key, station_type, interval=None):
+    """Creates new collection for project (rollup collection of station type with interval)"""
     url = f"{BASE_URL}/projects/{project_id}/collections"
     headers = {"X-API-Key": master_key}
 
-    if station_type == 'PIS':
-        collection_body = {
-            "name": "station_type_2",
-            "description": "IoT data for Serbian pilot for station type 2",
-            "tags": ["temperature", "humidity", "precipitation", "dew_point", "leaf-wetness"],
-            "collection_schema": {
-                "key": "PIS_BOGARAS",
-                "name": "Bogaraš",
-                "latitude_4326": 45.93855,
-                "longitude_4326": 19.91273,
-                "timestamp": "2023-12-31T23:00:00Z",
-                "leaf-wetness_min": 22.5,
-                "precipitation_mm": 0.0,
-                "dew-point_celsius": 5.5,
-                "air-humidity_percent": 100.0,
-                "air-temperature_celsius": 5.61
-            }
-        }
-    elif station_type == 'RHMZ':
-        collection_body = {
-            "name": "station_type_1",
-            "description": "IoT data for Serbian pilot for station type 1",
-            "tags": ["temperature", "precipitation", "humidity", "wind", "pressure", "solar_radiation", "dew_point"],
-            "collection_schema": {
-                "key": "MAC_adresa",
-                "name": "Sremska Mitrovica",
-                "timestamp": "2025-07-28T09:54:00Z",
-                "air-temperature_celsius": 23.2,
-                "precipitation_mm": 0.8,
-                "air-humidity_percent": 75.2,
-                "wind-speed_m/s": 2.6,
-                "wind-direction_angle": 127.0,
-                "wind-gust_m/s": 7.9,
-                "dew-point_celsius": 4.6,
-                "air-pressure_mbar": 997.3,
-                "solar-radiation_j/cm2": 214.8,
-                "latitude_4326": 45.22453,
-                "longitude_4326": 19.58752
-            }
-        }
+    if station_type not in STATION_CONFIG:
+        raise ValueError(f"Invalid station type. Use one of: {', '.join(STATION_CONFIG)}.")
+    if interval is None:
+        collection_body = REGISTRY[station_type].collection_body
     else:
-        raise ValueError("Invalid station type. Use 'PIS' or 'RHMZ'.")
+        collection_body = rollups.collection_body(REGISTRY[station_type], interval)
 
     try:
-        response = httpx.post(url, json=collection_body, headers=headers, timeout=15.0)
-    except httpx.ReadTimeout:
+        response = api.post(url, json=collection_body, headers=headers, timeout=15.0)
+    except api.ApiTimeout:
         print(f"❌ Timeout: Creating collection failed")
         return None
     if response.status_code == 200:
@@ -299,64 +165,128 @@ def create_collection(project_id, master_key, station_type):
         return None
 
 
-def fetch_lora_modules(station_prefix):
-    """Fetches modules for given station type"""
+def delete_data(project_id, collection_id, master_key, key=None, timestamp_from=None, timestamp_to=None):
+    """Delete data from collection based on criteria"""
+    url = f"{BASE_URL}/projects/{project_id}/collections/{collection_id}/delete_data"
+    headers = {"X-API-Key": master_key}
+
+    delete_request = {}
+    if key:
+        delete_request["key"] = key
+    if timestamp_from:
+        delete_request["timestamp_from"] = timestamp_from
+    if timestamp_to:
+        delete_request["timestamp_to"] = timestamp_to
+
+    try:
+        response = api.delete(url, json=delete_request, headers=headers, timeout=60.0)
+    except api.ApiTimeout:
+        print(f"❌ Timeout: Deleting data failed ({delete_request})")
+        return None
+    if response.status_code == 200:
+        return response.json()
+    print(f"❌ Error deleting data: {response.text}")
+    return None
+
+
+def fetch_lora_modules(station_type):
+    """Returns modules of station type (mac_address, name, latitude, longitude) from cached module catalog"""
+    if not MODULES.is_fresh():
+        try:
+            with METRICS.timer(DB_CONNECT):
+                conn = psycopg2.connect(**DB_CONFIG)
+        except psycopg2.OperationalError as e:
+            # Catches connection issues (unreachable IP, wrong port, etc.)
+            print(f"❌ Error connecting to database: {e}")
+            return []
+        except psycopg2.Error as e:
+            print(f"❌ Database error: {e}")
+            return []
+
+        try:
+            with METRICS.timer(DB_QUERY) as t:
+                t.add(rows=MODULES.refresh(conn))
+        finally:
+            conn.close()
+    return MODULES.for_station_type(station_type)
+
+
+def refresh_pivot_store():
+    """Incrementally refreshes measurement pivot tables of all station types, returns True on success"""
     try:
         conn = psycopg2.connect(**DB_CONFIG)
-    except psycopg2.OperationalError as e:
-        print(f"❌ Error connecting to database: {e}")
-        return []
     except psycopg2.Error as e:
-        print(f"❌ Database error: {e}")
-        return []
-
+        print(f"❌ Database connection failed: {e}")
+        return False
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SET search_path TO agrosense, public;")
-            cur.execute(
-                """
-                SELECT m.mac_address
-                FROM lora_module m
-                WHERE m.mac_address LIKE %s
-                """,
-                (f"%{station_prefix}%",)
-            )
-            results = cur.fetchall()
-        return results
+        for station_type in STATION_CONFIG:
+            modules = [row['mac_address'] for row in fetch_lora_modules(station_type)]
+            with METRICS.timer(DB_QUERY) as t:
+                mode, rows = pivot_store.STORES[station_type].refresh(conn, modules, PIVOT_CURSOR)
+                t.add(rows=rows)
+            print(f"🧮 {station_type} pivot store: {mode}, {rows} rows written")
+    except psycopg2.Error as e:
+        print(f"❌ Pivot store refresh failed: {e}")
+        return False
     finally:
         conn.close()
+    return True
 
 
 def send_data(project_id, collection_id, write_key, data):
     """Sends data to collection"""
+    with METRICS.timer(SERIALIZE) as t:
+        body = json.dumps(data, ensure_ascii=False)
+        t.add(rows=len(data), nbytes=len(body))
+    return send_data_raw(project_id, collection_id, write_key, body, len(data))
+
+
+def send_data_raw(project_id, collection_id, write_key, body, count):
+    """Sends already serialized JSON array body to collection"""
     url = f"{BASE_URL}/projects/{project_id}/collections/{collection_id}/send_data"
-    headers = {"X-API-Key": write_key}
+    headers = {"X-API-Key": write_key, "Content-Type": "application/json"}
+    content = body.encode('utf-8')
     try:
-        response = httpx.post(url, json=data, headers=headers, timeout=30.0)
-    except httpx.ReadTimeout:
+        with METRICS.timer(HTTP_SEND) as t:
+            response = api.post(url, content=content, headers=headers, timeout=30.0)
+            t.add(rows=count, nbytes=len(content), status=response.status_code)
+        current_span().set_attribute('http.status_code', response.status_code)
+    except api.ApiTimeout:
         print(f"   ❌ Timeout: Sending data failed")
+        current_span().set_error('timeout')
         return False
     if response.status_code == 200:
-        print(f"   ✅ Sent {len(data)} records")
+        print(f"   ✅ Sent {count} records")
         return True
     else:
         print(f"   ❌ Error sending data: {response.text}")
+        current_span().set_error(f"HTTP {response.status_code}")
         return False
 
 
+@profiling.profiled('send_data_in_batches')
 def send_data_in_batches(project_id, collection_id, write_key, data, batch_size=2000):
-    """Sends data in batches"""
+    """Sends data in batches (list of records or ColumnarBatch), returns True if all batches were sent"""
     total = len(data)
+    ok = True
     for i in range(0, total, batch_size):
-        batch = data[i:i+batch_size]
         print(f"   Sending batch {i+1}-{min(i+batch_size, total)} of {total} records...")
-        send_data(project_id, collection_id, write_key, batch)
-
-
-def get_data(project_id, collection_id, read_key, filters=None, attributes=None, limit=None, order_by=None):
-    """Fetches data from collection"""
-    url = f"{BASE_URL}/projects/{project_id}/collections/{collection_id}/get_data"
-    headers = {"X-API-Key": read_key}
+        with TRACER.span('batch_upload', batch_index=i // batch_size, rows=min(batch_size, total - i)):
+            if isinstance(data, columnar.ColumnarBatch):
+                count = min(batch_size, total - i)
+                with METRICS.timer(SERIALIZE) as t:
+                    body = data.to_json(i, i+batch_size)
+                    t.add(rows=count, nbytes=len(body))
+                # Body of module data already held - accounted, never waits
+                with memory_budget.BUDGET.hold(len(body), block=False):
+                    ok = send_data_raw(project_id, collection_id, write_key, body, count) and ok
+            else:
+                ok = send_data(project_id, collection_id, write_key, data[i:i+batch_size]) and ok
+    return ok
+
+
+def get_data_params(filters=None, attributes=None, limit=None, order_by=None):
+    """Query params of get_data request"""
     params = {}
 
     if order_by:
@@ -367,8 +297,19 @@ def get_data(project_id, collection_id, read_key, filters=None, attributes=None,
         params["limit"] = limit
     if filters:
         params["filters"] = json.dumps(filters)
+    return params
 
-    response = requests.get(url, headers=headers, params=params, timeout=30.0)
+
+def get_data(project_id, collection_id, read_key, filters=None, attributes=None, limit=None, order_by=None):
+    """Fetches data from collection"""
+    url = f"{BASE_URL}/projects/{project_id}/collections/{collection_id}/get_data"
+    headers = {"X-API-Key": read_key}
+    params = get_data_params(filters, attributes, limit, order_by)
+
+    with METRICS.timer(SERVER_LOOKUP) as t:
+        response = api.get(url, headers=headers, params=params, timeout=30.0)
+        t.add(nbytes=len(response.content), status=response.status_code)
+    current_span().set_attribute('http.status_code', response.status_code)
     if response.status_code == 200:
         return response.json()
     else:
@@ -376,8 +317,8 @@ def get_data(project_id, collection_id, read_key, filters=None, attributes=None,
         return {'data': []}
 
 
-def get_last_timestamp_for_module(collection_id, mac_address):
-    """Fetches latest timestamp for specific module from server"""
+def last_timestamp_query(mac_address):
+    """get_data arguments that return latest timestamp of module"""
     filters = [
         {
             "property_name": "key",
@@ -385,17 +326,16 @@ def get_last_timestamp_for_module(collection_id, mac_address):
             "property_value": mac_address
         }
     ]
+    return {
+        'attributes': ['timestamp'],
+        'filters': filters,
+        'order_by': '{"field": "timestamp", "order": "desc"}',
+        'limit': 1,
+    }
 
-    response = get_data(
-        PROJECT_ID,
-        collection_id,
-        READ_KEY,
-        attributes=['timestamp'],
-        filters=filters,
-        order_by='{"field": "timestamp", "order": "desc"}',
-        limit=1
-    )
 
+def parse_last_timestamp(response):
+    """Latest timestamp from get_data response, or 1 hour ago if module has no data"""
     latest_data = response.get('data', []) if isinstance(response, dict) else []
 
     if latest_data and len(latest_data) > 0:
@@ -406,6 +346,12 @@ def get_last_timestamp_for_module(collection_id, mac_address):
         return datetime.now(utc) - timedelta(hours=1)
 
 
+def get_last_timestamp_for_module(collection_id, mac_address):
+    """Fetches latest timestamp for specific module from server"""
+    response = get_data(PROJECT_ID, collection_id, READ_KEY, **last_timestamp_query(mac_address))
+    return parse_last_timestamp(response)
+
+
 def setup_collections():
     """Sets up and checks collections"""
     print("⏳ Checking collections...")
@@ -430,93 +376,327 @@ def setup_collections():
         print(f"   {station_type}: {config['collection_id']}")
     print()
 
+    if USE_ROLLUPS:
+        setup_rollup_collections(collections)
 
-def process_and_send_live_data():
-    """Processes and sends live data from last hour"""
 
-    # Check if collections are set up
-    if not all(config['collection_id'] for config in STATION_CONFIG.values()):
-        print("\n⚠️ Collections not set up properly!")
-        return
+def setup_rollup_collections(collections):
+    """Maps existing and creates missing rollup collections of all station types"""
+    existing = {c.get('collection_name'): c['collection_id'] for c in collections}
+    for station_type, config in STATION_CONFIG.items():
+        for interval in ROLLUP_INTERVALS:
+            name = rollups.collection_name(REGISTRY[station_type], interval)
+            collection_id = existing.get(name) or create_collection(PROJECT_ID, MASTER_KEY, station_type, interval)
+            config['rollup_collection_ids'][interval] = collection_id
+    print(f"📐 Rollups: {', '.join(ROLLUP_INTERVALS)}\n")
+
+
+def send_rollups(mac_address, data):
+    """
+    Recomputes rollup buckets touched by data just sent from all local rows of
+    those buckets and replaces them on server, returns True if all intervals were sent.
+    """
+    station = REGISTRY[get_station_by_mac(mac_address)]
+    config = STATION_CONFIG[station.name]
+    longest = max(rollups.INTERVALS[interval] for interval in ROLLUP_INTERVALS)
+    start = rollups.bucket_start(min(data.timestamps), longest)
+
+    ok = True
+    with memory_budget.BUDGET.admit() as admission:
+        source = fetch_module_data(mac_address, datetime.fromtimestamp(start, utc) - timedelta(microseconds=1))
+        admission.resize(source.nbytes)
+        for interval in ROLLUP_INTERVALS:
+            seconds = rollups.INTERVALS[interval]
+            collection_id = config['rollup_collection_ids'].get(interval)
+            rolled = rollups.aggregate(source, station, seconds)
+            if not rolled:
+                continue
+            end = max(rolled.timestamps) + seconds
+            if delete_data(PROJECT_ID, collection_id, MASTER_KEY, key=mac_address,
+                           timestamp_from=columnar.format_timestamp(start),
+                           timestamp_to=columnar.format_timestamp(end - 1)) is None:
+                ok = False
+                continue
+            ok = send_data_in_batches(PROJECT_ID, collection_id, WRITE_KEY, rolled, batch_size=2000) and ok
+    return ok
 
-    now = datetime.now(utc)
-    print(f"⏰ Processing data up to: {now.isoformat()}\n")
 
-    total_records_sent = 0
+def process_live_module(mac, now, watermarks=None):
+    """Processes one module - returns number of records sent, new precheck watermark goes into watermarks"""
+    print(f"\n⚙️  Processing module: {mac}")
 
-    for station_type, config in STATION_CONFIG.items():
-        print(f"\n{'='*60}")
-        print(f"🔄 Processing {station_type} stations")
-        print(f"{'='*60}")
+    # Get last timestamp from server
+    collection_id = get_collection_id_for_mac(mac)
+    with TRACER.span('server_lookup', mac=mac) as span:
+        last_timestamp_server = get_last_timestamp_for_module(collection_id, mac)
+        span.set_attribute('last_timestamp', last_timestamp_server.isoformat())
+    print(f"   Last timestamp on server: {last_timestamp_server.isoformat()}")
 
-        modules = fetch_lora_modules(config['prefix'])
-        print(f"   Found {len(modules)} modules")
+    # Use max of: last timestamp on server OR 1 hour ago
+    # This ensures we only fetch last hour of data, but don't create duplicates
+    one_hour_ago = now - timedelta(hours=1)
+    last_timestamp = max(last_timestamp_server, one_hour_ago)
 
-        for row in modules:
-            mac = row['mac_address']
+    if last_timestamp > last_timestamp_server:
+        print(f"   Using 1 hour ago limit: {last_timestamp.isoformat()}")
 
-            # Skip excluded modules
-            if is_module_excluded(mac):
-                print(f"   ⏭️  Skipping excluded module: {mac}")
-                continue
+    station_type = get_station_by_mac(mac)
 
-            print(f"\n⚙️  Processing module: {mac}")
+    # Fetch new data from local database (waits while memory budget is exhausted)
+    with memory_budget.BUDGET.admit() as admission:
+        with TRACER.span('db_query', mac=mac) as span:
+            data = fetch_module_data(mac, last_timestamp)
+            span.set_attribute('rows', len(data))
+        admission.resize(data.nbytes)
+        current_span().set_attribute('rows', len(data))
+
+        if not data:
+            print(f"   ℹ️  No new data for {mac}")
+            prometheus_exporter.MODULE_LAG.set((now - last_timestamp_server).total_seconds(), station_type=station_type, mac=mac)
+            if watermarks is not None:
+                watermarks[mac] = last_timestamp_server
+            return 0
+
+        print(f"   📊 Found {len(data)} new records")
+
+        # Send data
+        prometheus_exporter.OUTBOX_DEPTH.inc(len(data))
+        try:
+            sent_all = send_data_in_batches(PROJECT_ID, collection_id, WRITE_KEY, data, batch_size=2000)
+        finally:
+            prometheus_exporter.OUTBOX_DEPTH.dec(len(data))
+    if not sent_all:
+        # Lag stays measured from last record on server, so alerts see the module falling behind
+        print(f"   ❌ Some batches of {mac} failed to send to collection {collection_id}")
+        prometheus_exporter.UPLOAD_FAILURES.inc(station_type=station_type)
+        prometheus_exporter.MODULE_LAG.set((now - last_timestamp_server).total_seconds(), station_type=station_type, mac=mac)
+        return 0
+    print(f"   ✅ Data sent to collection {collection_id}")
+    if watermarks is not None:
+        watermarks[mac] = datetime.fromtimestamp(max(data.timestamps), utc)
+    if USE_ROLLUPS:
+        send_rollups(mac, data)
+
+    prometheus_exporter.RECORDS_SENT.inc(len(data), station_type=station_type)
+    prometheus_exporter.MODULE_LAG.set(now.timestamp() - max(data.timestamps), station_type=station_type, mac=mac)
+    return len(data)
+
+
+def precheck_modules(station_type, modules, now):
+    """Runs one precheck query for all modules of station type, returns modules with new rows"""
+    with METRICS.timer(DB_CONNECT):
+        conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        precheck.ensure_schema(conn)
+        with TRACER.span('precheck', station_type=station_type, modules=len(modules)) as span, \
+                METRICS.timer(PRECHECK) as t:
+            watermarks = precheck.read_watermarks(conn, modules)
+            report = precheck.fetch_new_rows(conn, modules, precheck.window_starts(modules, watermarks, now))
+            active, idle = precheck.split_modules(modules, report)
+            t.add(rows=len(modules))
+            span.set_attributes(active=len(active), new_rows=sum(new_rows for _, new_rows in report.values()))
+    finally:
+        conn.close()
 
-            # Get last timestamp from server
-            collection_id = get_collection_id_for_mac(mac)
-            last_timestamp_server = get_last_timestamp_for_module(collection_id, mac)
-            print(f"   Last timestamp on server: {last_timestamp_server.isoformat()}")
+    for mac in idle:
+        if mac in watermarks:
+            prometheus_exporter.MODULE_LAG.set((now - watermarks[mac]).total_seconds(), station_type=station_type, mac=mac)
+    METRICS.count('modules_skipped_precheck', len(idle))
+    print(f"   💤 {len(idle)} modules with nothing new, {len(active)} to process")
+    return active
 
-            # Use max of: last timestamp on server OR 1 hour ago
-            # This ensures we only fetch last hour of data, but don't create duplicates
-            one_hour_ago = now - timedelta(hours=1)
-            last_timestamp = max(last_timestamp_server, one_hour_ago)
 
-            if last_timestamp > last_timestamp_server:
-                print(f"   Using 1 hour ago limit: {last_timestamp.isoformat()}")
+def save_watermarks(watermarks):
+    if not watermarks:
+        return
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        precheck.write_watermarks(conn, watermarks)
+    finally:
+        conn.close()
 
-            # Fetch new data from local database
-            data = fetch_module_data(mac, last_timestamp)
 
-            if not data:
-                print(f"   ℹ️  No new data for {mac}")
-                continue
+def process_and_send_live_data(shard=None, leases=None, use_precheck=USE_PRECHECK):
+    """
+    Processes and sends live data from last hour.
+    With shard=(index, count) only modules of that shard are processed, and with a
+    sharding.LeaseManager modules leased by another worker are skipped.
+    With use_precheck modules without new local rows are skipped before server lookup.
+    """
+
+    # Check if collections are set up
+    if not all(config['collection_id'] for config in STATION_CONFIG.values()):
+        print("\n⚠️ Collections not set up properly!")
+        return
 
-            print(f"   📊 Found {len(data)} new records")
+    METRICS.reset()
+    now = datetime.now(utc)
+    print(f"⏰ Processing data up to: {now.isoformat()}\n")
 
-            # Send data
-            send_data_in_batches(PROJECT_ID, collection_id, WRITE_KEY, data, batch_size=2000)
-            total_records_sent += len(data)
-            print(f"   ✅ Data sent to collection {collection_id}")
+    total_records_sent = 0
+
+    with TRACER.span('live_run', now=now.isoformat()) as run_span:
+        for station_type, config in STATION_CONFIG.items():
+            print(f"\n{'='*60}")
+            print(f"🔄 Processing {station_type} stations")
+            print(f"{'='*60}")
+
+            with TRACER.span('station_type', station_type=station_type) as station_span:
+                modules = [row['mac_address'] for row in fetch_lora_modules(station_type)]
+                print(f"   Found {len(modules)} modules")
+                if shard is not None:
+                    modules = sharding.select_shard(modules, *shard)
+                    print(f"   Shard {shard[0]}/{shard[1]}: {len(modules)} modules")
+                station_span.set_attribute('modules', len(modules))
+
+                # Skip excluded modules
+                for mac in modules:
+                    if is_module_excluded(mac):
+                        print(f"   ⏭️  Skipping excluded module: {mac}")
+                modules = [mac for mac in modules if not is_module_excluded(mac)]
+
+                watermarks = None
+                if use_precheck and modules:
+                    modules = precheck_modules(station_type, modules, now)
+                    watermarks = {}  # Filled by process_live_module, saved after station type
+
+                for mac in modules:
+                    with leases.lease(mac) if leases else nullcontext(True) as leased:
+                        if not leased:
+                            print(f"   🔒 Skipping {mac} - leased by another worker")
+                            METRICS.count('modules_leased_elsewhere')
+                            continue
+                        with METRICS.module(mac), TRACER.span('module', mac=mac, station_type=station_type):
+                            sent = process_live_module(mac, now, watermarks)
+                    total_records_sent += sent
+                    METRICS.count(f'records_sent_{station_type.lower()}', sent)
+
+                save_watermarks(watermarks)
+
+        run_span.set_attribute('records_sent', total_records_sent)
 
     print(f"\n{'='*60}")
     print(f"🎉 Processing complete! Total records sent: {total_records_sent}")
     print(f"{'='*60}\n")
 
-
-def main():
-    """Main function - runs automatically without user interaction"""
-    print("\n" + "="*60)
-    print("🚀 NOSTRADAMUS Live Data Processor")
-    print("="*60)
-    print(f"🗄️  Database: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}")
-    print(f"🌐 API: {BASE_URL}")
-    print("="*60 + "\n")
-
+    METRICS.print_summary()
+    print(f"📈 Metrics written to {METRICS.write_summary('live')}\n")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="NOSTRADAMUS Live Data Processor")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and sync every --interval seconds")
+    parser.add_argument('--interval', type=int, default=3600,
+                        help="seconds between runs in daemon mode (default: 3600)")
+    parser.add_argument('--metrics-textfile', default=os.environ.get('NOSTRADAMUS_METRICS_TEXTFILE'),
+                        help="write Prometheus metrics to this file after every run (textfile collector)")
+    parser.add_argument('--metrics-port', type=int, default=os.environ.get('NOSTRADAMUS_METRICS_PORT'),
+                        help="serve Prometheus metrics on this port (daemon mode)")
+    parser.add_argument('--profile', default=os.environ.get(profiling.PROFILE_ENV),
+                        help="profile every run (cProfile + tracemalloc) and dump results into this directory")
+    parser.add_argument('--trace-file', help="append tracing spans as JSON lines to this file")
+    parser.add_argument('--otlp-endpoint', help="export tracing spans to OTLP/HTTP collector (e.g. http://localhost:4318)")
+    parser.add_argument('--rate-limits', type=rate_limit.rate_limits_argument,
+                        help=f"API rate limits as endpoint=rate[/burst],... (default ${rate_limit.RATE_LIMITS_ENV} or built-in)")
+    parser.add_argument('--memory-budget', type=memory_budget.size_argument,
+                        help=f"max bytes of data in flight, e.g. 512M, 0 = off (default ${memory_budget.MEMORY_BUDGET_ENV} or off)")
+    parser.add_argument('--no-precheck', dest='precheck', action='store_false',
+                        help="look up every module on server even if it has no new rows locally")
+    parser.add_argument('--engine', choices=['sync', 'async'], default=os.environ.get('NOSTRADAMUS_ENGINE', 'sync'),
+                        help="sync: one module at a time, async: modules overlap in one event loop (asyncpg + httpx)")
+    parser.add_argument('--concurrency', type=int, default=20,
+                        help="modules processed at the same time with --engine async (default: 20)")
+    sharding.add_arguments(parser)
+    args = parser.parse_args()
+    sharding.validate_arguments(parser, args)
+    return args
+
+
+def run_once(args, leases=None):
+    """Runs one sync, returns True on success"""
+    started = time.time()
+    session = profiling.start(args.profile, name='live')
     try:
         # Setup collections
         setup_collections()
 
-        # Process and send live data
-        process_and_send_live_data()
+        if USE_PIVOT_STORE and not refresh_pivot_store():
+            print("⚠️  Reading from pivot store as of its last refresh")
 
+        # Process and send live data
+        shard = (args.shard_index, args.shard_count)
+        engine = args.engine
+        if engine == 'async' and session is not None:
+            # Coroutines interleave and rollups run in worker threads, which cProfile does not see
+            print("🔬 Profiling - using sync engine, one module at a time")
+            engine = 'sync'
+        if engine == 'async':
+            import live_async
+            live_async.process_and_send_live_data(sys.modules[__name__], shard, leases, args.concurrency,
+                                                  USE_PRECHECK and args.precheck)
+        else:
+            process_and_send_live_data(shard, leases, USE_PRECHECK and args.precheck)
+
+        prometheus_exporter.observe_run(started, 'success')
         print("✅ Script completed successfully!")
+        return True
 
     except Exception as e:
+        prometheus_exporter.observe_run(started, 'failure')
         print(f"\n❌ Error occurred: {e}")
         import traceback
         traceback.print_exc()
-        exit(1)
+        return False
+
+    finally:
+        profiling.stop(session)
+        if args.metrics_textfile:
+            prometheus_exporter.write_textfile(args.metrics_textfile)
+
+
+def main():
+    """Main function - runs automatically without user interaction"""
+    args = parse_args()
+
+    print("\n" + "="*60)
+    print("🚀 NOSTRADAMUS Live Data Processor")
+    print("="*60)
+    print(f"🗄️  Database: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}")
+    print(f"🌐 API: {BASE_URL}")
+    print("="*60 + "\n")
+
+    prometheus_exporter.install(METRICS)
+    if args.rate_limits is not None:
+        rate_limit.LIMITER.configure(args.rate_limits)
+    if args.memory_budget is not None:
+        memory_budget.BUDGET.configure(args.memory_budget)
+    print(f"🚦 API rate limits: {rate_limit.LIMITER.describe()}")
+    print(f"🧠 Memory budget: {memory_budget.BUDGET.describe()}\n")
+    if TRACER.configure(args.trace_file, args.otlp_endpoint):
+        print("🧵 Tracing enabled\n")
+    if args.metrics_port:
+        prometheus_exporter.start_http_server(int(args.metrics_port))
+        print(f"📈 Metrics available on :{args.metrics_port}/metrics\n")
+
+    leases = None
+    if sharding.leases_enabled(args):
+        leases = sharding.LeaseManager(DB_CONFIG, args.worker_id)
+        print(f"🔒 Worker {args.worker_id}, shard {args.shard_index}/{args.shard_count}\n")
+
+    try:
+        if not args.daemon:
+            if not run_once(args, leases):
+                exit(1)
+            return
+
+        while True:
+            run_once(args, leases)
+            print(f"😴 Sleeping {args.interval}s until next run...\n")
+            time.sleep(args.interval)
+    finally:
+        if leases is not None:
+            leases.close()
 
 
 if __name__ == "__main__":
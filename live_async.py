@@ -0,0 +1,321 @@
+"""
+Asyncio engine for live.py (--engine async).
+Server timestamp lookups, COPY queries (asyncpg pool) and batch uploads
+(httpx.AsyncClient) of many modules overlap in one event loop instead of
+running module by module. Records sent, metrics, spans and Prometheus
+gauges are the same as with the sync engine; only log lines of different
+modules interleave, so they are prefixed with the MAC address.
+"""
+
+import asyncio
+import re
+from datetime import datetime, timedelta, timezone
+
+import api
+import columnar
+import memory_budget
+import pivot_store
+import precheck
+import prometheus_exporter
+import sharding
+from instrumentation import METRICS, DB_CONNECT, DB_QUERY, SERIALIZE, HTTP_SEND, SERVER_LOOKUP, PRECHECK
+from lazy import lazy_import
+from stations import REGISTRY
+from tracing import TRACER, current_span
+
+asyncpg = lazy_import('asyncpg')
+
+MODULE_CONCURRENCY = 20  # Modules processed at the same time
+DB_POOL_SIZE = 10
+
+PLACEHOLDER_RE = re.compile(r'%s(::timestamp\b(?!tz|\[))?')
+
+
+def to_asyncpg_query(query):
+    """
+    Rewrites psycopg2 %s placeholders into asyncpg $1, $2, ... Timestamp
+    parameters are sent as timestamptz and converted to timestamp by the
+    server in the session time zone, like psycopg2 does with aware datetimes.
+    """
+    counter = iter(range(1, query.count('%s') + 1))
+    return PLACEHOLDER_RE.sub(lambda m: f"${next(counter)}" + ('::timestamptz::timestamp' if m.group(1) else ''), query)
+
+
+def to_asyncpg_param(value):
+    """Aware datetime for timestamptz parameters - naive ones are taken as UTC"""
+    if getattr(value, 'tzinfo', 1) is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class AsyncLiveSync:
+    """
+    One async live run. settings is the live module, so BASE_URL, keys,
+    DB_CONFIG and collection IDs set up by live.setup_collections() are shared.
+    """
+
+    def __init__(self, settings, concurrency=MODULE_CONCURRENCY, use_precheck=True):
+        self.settings = settings
+        self.use_precheck = use_precheck
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pool = None
+
+    async def open(self):
+        config = self.settings.DB_CONFIG
+        with METRICS.timer(DB_CONNECT):
+            self.pool = await asyncpg.create_pool(
+                database=config.get('dbname'), user=config.get('user'), password=config.get('password'),
+                host=config.get('host'), port=config.get('port'),
+                min_size=1, max_size=DB_POOL_SIZE,
+                server_settings={'search_path': 'agrosense, public'},
+            )
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+        await api.aclose()
+
+    async def fetch_lora_modules(self, station_type):
+        """Modules of station type from live.py's module catalog (one cached query, run in a thread)"""
+        return await asyncio.to_thread(self.settings.fetch_lora_modules, station_type)
+
+    async def precheck_modules(self, station_type, modules, now):
+        """One precheck query for all modules of station type, returns modules with new rows"""
+        with TRACER.span('precheck', station_type=station_type, modules=len(modules)) as span, \
+                METRICS.timer(PRECHECK) as t:
+            async with self.pool.acquire() as conn:
+                await conn.execute(precheck.SCHEMA_SQL)
+                rows = await conn.fetch(to_asyncpg_query(precheck.READ_WATERMARKS_SQL), modules)
+                watermarks = {row['mac_address']: row['last_timestamp'] for row in rows}
+                rows = await conn.fetch(to_asyncpg_query(precheck.PRECHECK_QUERY), modules,
+                                        precheck.window_starts(modules, watermarks, now))
+            report = {row['mac_address']: (row['latest'], row['new_rows']) for row in rows}
+            active, idle = precheck.split_modules(modules, report)
+            t.add(rows=len(modules))
+            span.set_attributes(active=len(active), new_rows=sum(new_rows for _, new_rows in report.values()))
+
+        for mac in idle:
+            if mac in watermarks:
+                prometheus_exporter.MODULE_LAG.set((now - watermarks[mac]).total_seconds(), station_type=station_type, mac=mac)
+        METRICS.count('modules_skipped_precheck', len(idle))
+        print(f"   💤 {station_type}: {len(idle)} modules with nothing new, {len(active)} to process")
+        return active
+
+    async def save_watermarks(self, watermarks):
+        if watermarks:
+            await self.pool.execute(to_asyncpg_query(precheck.WRITE_WATERMARKS_SQL),
+                                    list(watermarks), list(watermarks.values()))
+
+    async def fetch_module_data(self, mac_address, last_timestamp):
+        """Fetches data for given module after last_timestamp as ColumnarBatch (COPY through asyncpg)"""
+        station_type = REGISTRY.route(mac_address)
+        fields = self.settings.STATION_CONFIG[station_type]['fields']
+        queries = pivot_store.STORES if self.settings.USE_PIVOT_STORE else REGISTRY
+        query = to_asyncpg_query(columnar.build_columnar_query(queries[station_type].live_query, fields))
+
+        batch = columnar.ColumnarBatch(fields)
+        sink = columnar.ColumnarCopySink(batch)
+
+        async def write(chunk):
+            sink.write(chunk)
+
+        with METRICS.timer(DB_QUERY) as t:
+            async with self.pool.acquire() as conn:
+                await conn.copy_from_query(query, mac_address, to_asyncpg_param(last_timestamp), output=write, format='text')
+            sink.close()
+            t.add(rows=len(batch), nbytes=batch.nbytes)
+        return self.settings.validate_batch(mac_address, batch) if self.settings.USE_VALIDATION else batch
+
+    async def get_last_timestamp_for_module(self, collection_id, mac_address):
+        """Fetches latest timestamp for specific module from server"""
+        live = self.settings
+        url = f"{live.BASE_URL}/projects/{live.PROJECT_ID}/collections/{collection_id}/get_data"
+        params = live.get_data_params(**live.last_timestamp_query(mac_address))
+
+        with METRICS.timer(SERVER_LOOKUP) as t:
+            response = await api.request_async('GET', url, headers={"X-API-Key": live.READ_KEY}, params=params, timeout=30.0)
+            t.add(nbytes=len(response.content), status=response.status_code)
+        current_span().set_attribute('http.status_code', response.status_code)
+        if response.status_code != 200:
+            print(f"   [{mac_address}] ❌ Error fetching data: {response.status_code} - {response.text}")
+            return live.parse_last_timestamp({'data': []})
+        return live.parse_last_timestamp(response.json())
+
+    async def send_data_raw(self, mac, collection_id, body, count):
+        """Sends already serialized JSON array body to collection"""
+        live = self.settings
+        url = f"{live.BASE_URL}/projects/{live.PROJECT_ID}/collections/{collection_id}/send_data"
+        headers = {"X-API-Key": live.WRITE_KEY, "Content-Type": "application/json"}
+        content = body.encode('utf-8')
+        try:
+            with METRICS.timer(HTTP_SEND) as t:
+                response = await api.request_async('POST', url, content=content, headers=headers, timeout=30.0)
+                t.add(rows=count, nbytes=len(content), status=response.status_code)
+            current_span().set_attribute('http.status_code', response.status_code)
+        except api.ApiTimeout:
+            print(f"   [{mac}] ❌ Timeout: Sending data failed")
+            current_span().set_error('timeout')
+            return False
+        if response.status_code == 200:
+            print(f"   [{mac}] ✅ Sent {count} records")
+            return True
+        print(f"   [{mac}] ❌ Error sending data: {response.text}")
+        current_span().set_error(f"HTTP {response.status_code}")
+        return False
+
+    async def send_data_in_batches(self, mac, collection_id, data, batch_size=2000):
+        """Sends ColumnarBatch in batches - batches of one module go in order, returns True if all were sent"""
+        total = len(data)
+        ok = True
+        for i in range(0, total, batch_size):
+            count = min(batch_size, total - i)
+            with TRACER.span('batch_upload', batch_index=i // batch_size, rows=count):
+                with METRICS.timer(SERIALIZE) as t:
+                    body = data.to_json(i, i + batch_size)
+                    t.add(rows=count, nbytes=len(body))
+                with memory_budget.BUDGET.hold(len(body), block=False):
+                    ok = await self.send_data_raw(mac, collection_id, body, count) and ok
+        return ok
+
+    async def process_live_module(self, mac, now, watermarks=None):
+        """Processes one module - returns number of records sent, new precheck watermark goes into watermarks"""
+        print(f"   [{mac}] ⚙️  Processing module")
+        station_type = REGISTRY.route(mac)
+        collection_id = self.settings.STATION_CONFIG[station_type]['collection_id']
+
+        with TRACER.span('server_lookup', mac=mac) as span:
+            last_timestamp_server = await self.get_last_timestamp_for_module(collection_id, mac)
+            span.set_attribute('last_timestamp', last_timestamp_server.isoformat())
+
+        # Only last hour of data, but no duplicates of what server already has
+        last_timestamp = max(last_timestamp_server, now - timedelta(hours=1))
+
+        async with memory_budget.BUDGET.admit_async() as admission:
+            with TRACER.span('db_query', mac=mac) as span:
+                data = await self.fetch_module_data(mac, last_timestamp)
+                span.set_attribute('rows', len(data))
+            admission.resize(data.nbytes)
+            current_span().set_attribute('rows', len(data))
+
+            if not data:
+                print(f"   [{mac}] ℹ️  No new data (server at {last_timestamp_server.isoformat()})")
+                prometheus_exporter.MODULE_LAG.set((now - last_timestamp_server).total_seconds(), station_type=station_type, mac=mac)
+                if watermarks is not None:
+                    watermarks[mac] = last_timestamp_server
+                return 0
+
+            print(f"   [{mac}] 📊 Found {len(data)} new records after {last_timestamp.isoformat()}")
+            prometheus_exporter.OUTBOX_DEPTH.inc(len(data))
+            try:
+                sent_all = await self.send_data_in_batches(mac, collection_id, data, batch_size=2000)
+            finally:
+                prometheus_exporter.OUTBOX_DEPTH.dec(len(data))
+        if not sent_all:
+            # Lag stays measured from last record on server, so alerts see the module falling behind
+            print(f"   [{mac}] ❌ Some batches failed to send to collection {collection_id}")
+            prometheus_exporter.UPLOAD_FAILURES.inc(station_type=station_type)
+            prometheus_exporter.MODULE_LAG.set((now - last_timestamp_server).total_seconds(), station_type=station_type, mac=mac)
+            return 0
+        if watermarks is not None:
+            watermarks[mac] = datetime.fromtimestamp(max(data.timestamps), timezone.utc)
+        if self.settings.USE_ROLLUPS:
+            # Rare compared to raw sends - reuses the sync implementation off the event loop
+            await asyncio.to_thread(self.settings.send_rollups, mac, data)
+
+        prometheus_exporter.RECORDS_SENT.inc(len(data), station_type=station_type)
+        prometheus_exporter.MODULE_LAG.set(now.timestamp() - max(data.timestamps), station_type=station_type, mac=mac)
+        return len(data)
+
+    async def run_module(self, station_type, mac, now, leases, watermarks):
+        """Processes module under concurrency limit and lease, returns records sent"""
+        async with self.semaphore:
+            if leases is not None and not await asyncio.to_thread(leases.acquire, mac):
+                print(f"   🔒 Skipping {mac} - leased by another worker")
+                METRICS.count('modules_leased_elsewhere')
+                return 0
+            try:
+                with METRICS.module(mac), TRACER.span('module', mac=mac, station_type=station_type) as module_span:
+                    try:
+                        sent = await self.process_live_module(mac, now, watermarks)
+                    except Exception as e:
+                        # Only this module fails, others keep the pool and client and their watermarks are saved
+                        print(f"   [{mac}] ❌ Failed: {e}")
+                        module_span.set_error(str(e))
+                        METRICS.count('modules_failed')
+                        sent = 0
+            finally:
+                if leases is not None:
+                    await asyncio.to_thread(leases.release, mac)
+        METRICS.count(f'records_sent_{station_type.lower()}', sent)
+        return sent
+
+    async def process_station_type(self, station_type, config, now, shard, leases):
+        with TRACER.span('station_type', station_type=station_type) as station_span:
+            modules = [row['mac_address'] for row in await self.fetch_lora_modules(station_type)]
+            print(f"🔄 {station_type}: found {len(modules)} modules")
+            if shard is not None:
+                modules = sharding.select_shard(modules, *shard)
+                print(f"   Shard {shard[0]}/{shard[1]}: {len(modules)} {station_type} modules")
+            station_span.set_attribute('modules', len(modules))
+
+            for mac in modules:
+                if mac in config['excluded_modules']:
+                    print(f"   ⏭️  Skipping excluded module: {mac}")
+            modules = [mac for mac in modules if mac not in config['excluded_modules']]
+
+            watermarks = None
+            if self.use_precheck and modules:
+                modules = await self.precheck_modules(station_type, modules, now)
+                watermarks = {}  # Filled by process_live_module, saved after station type
+
+            sent = await asyncio.gather(*(
+                self.run_module(station_type, mac, now, leases, watermarks) for mac in modules
+            ))
+            await self.save_watermarks(watermarks)
+            return sum(sent)
+
+    async def process_and_send_live_data(self, now, shard=None, leases=None):
+        """All station types and their modules concurrently, returns total records sent"""
+        with TRACER.span('live_run', now=now.isoformat(), engine='async') as run_span:
+            # Other station types finish before an error is raised, so the pool is not closed under them
+            results = await asyncio.gather(*(
+                self.process_station_type(station_type, config, now, shard, leases)
+                for station_type, config in self.settings.STATION_CONFIG.items()
+            ), return_exceptions=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+            run_span.set_attribute('records_sent', sum(results))
+        return sum(results)
+
+
+async def run_async(settings, now, shard=None, leases=None, concurrency=MODULE_CONCURRENCY, use_precheck=True):
+    engine = AsyncLiveSync(settings, concurrency, use_precheck)
+    await engine.open()
+    try:
+        return await engine.process_and_send_live_data(now, shard, leases)
+    finally:
+        await engine.close()
+
+
+def process_and_send_live_data(settings, shard=None, leases=None, concurrency=MODULE_CONCURRENCY, use_precheck=True):
+    """
+    Async counterpart of live.process_and_send_live_data - same checks, metrics
+    and summary, with modules processed concurrently in one event loop.
+    """
+    if not all(config['collection_id'] for config in settings.STATION_CONFIG.values()):
+        print("\n⚠️ Collections not set up properly!")
+        return
+
+    METRICS.reset()
+    now = datetime.now(timezone.utc)
+    print(f"⏰ Processing data up to: {now.isoformat()}")
+    print(f"⚡ Async engine, up to {concurrency} modules at a time\n")
+    total_records_sent = asyncio.run(run_async(settings, now, shard, leases, concurrency, use_precheck))
+
+    print(f"\n{'='*60}")
+    print(f"🎉 Processing complete! Total records sent: {total_records_sent}")
+    print(f"{'='*60}\n")
+
+    METRICS.print_summary()
+    print(f"📈 Metrics written to {METRICS.write_summary('live')}\n")
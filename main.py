@@ -2,16 +2,41 @@
 # Jupyter notebook with examples: https://colab.research.google.com/drive/1Uu12nIu1LhkTnb5Y-Sq1ZqeZkn3mjWNE?usp=sharing
 
 import os
-from pkgutil import get_data
-import psycopg2
+import sys
+import time
+import argparse
+import contextvars
+import fnmatch
+from contextlib import nullcontext
 import json
-import httpx
-from psycopg2.extras import RealDictCursor
-from datetime import datetime, timedelta
-import requests
-import pytz
-
-utc=pytz.UTC
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import as_completed
+import api
+from lazy import lazy_import
+import copy_export
+import columnar
+import upload_index
+import reconcile
+import change_tracking
+import pivot_store
+import query_slicing
+import memory_budget
+import rollups
+import validation
+import export
+import profiling
+import rate_limit
+from stations import REGISTRY
+import sharding
+import module_catalog
+from tracing import TRACER, current_span
+from instrumentation import METRICS, DB_CONNECT, DB_QUERY, DB_FETCH, SERIALIZE, HTTP_SEND, SERVER_LOOKUP
+
+# Heavy modules are imported on first use
+psycopg2 = lazy_import('psycopg2')
+psycopg2_extras = lazy_import('psycopg2.extras')
+
+utc = timezone.utc
 
 # Configuration
 BASE_URL = "https://nostradamus-ioto.issel.ee.auth.gr/api/v1"
@@ -22,22 +47,11 @@ MASTER_KEY = 'CHANGE_ME'
 WRITE_KEY = 'CHANGE_ME'
 READ_KEY = 'd1091a7ac0fea235a022005637ed1f23dd7de7bf50ddf82d69bf68e724ecb65a'
 
-# Station Configuration - centralized for easier use
-STATION_CONFIG = {
-    'RHMZ': {
-        'prefix': '_RHMZ',
-        'collection_name': 'station_type_1',
-        'collection_id': None,  # Will be populated dynamically
-        'excluded_modules': []
-    },
-    'PIS': {
-        'prefix': 'PIS_',
-        'collection_name': 'station_type_2',
-        'collection_id': None,  # Will be populated dynamically
-        'excluded_modules': [] 
-        # 'excluded_modules': ['PIS_COKA', 'PIS_BACKI_VINOGRADI', 'PIS_BELA_CRKVA']
-    },
-}
+# Station types (sensors, fields, routing, collection schema) are configured in stations.json
+STATION_CONFIG = REGISTRY.station_config()
+
+# Modules of all station types, read with one query and cached in data/module_cache.json
+MODULES = module_catalog.ModuleCatalog()
 
 # Database connection configuration
 DB_CONFIG = {
@@ -52,13 +66,67 @@ DB_CONFIG = {
 date_from = "2022-01-01T00:00:00Z"
 date_to = "2023-12-31T23:00:00Z"
 
+# Bulk export - stream historical data through COPY instead of SELECT + fetchall
+USE_COPY_EXPORT = True
+COPY_FORMAT = 'text'  # 'text' or 'binary'
+
+# Content-hash deduplication - send only time buckets that changed since last upload
+USE_CONTENT_DEDUP = False
+DEDUP_BUCKET_SECONDS = 24 * 3600
+
+# Reconciliation - bucket size for comparing local and server record counts
+RECONCILE_BUCKET = 'day'  # 'hour', 'day' or 'week'
+
+# Rollups - hourly/daily aggregates per module in companion collections (<collection>_hourly, <collection>_daily),
+# replaced for every period sent (see rollups.py, rebuild with "main.py rollups")
+USE_ROLLUPS = False
+ROLLUP_INTERVALS = ('hourly', 'daily')
+
+# Validation - rows failing range, spike or duplicate timestamp checks (limits per sensor in stations.json)
+# are not sent but written to data/quarantine.jsonl (see validation.py), turns off COPY streaming
+USE_VALIDATION = False
+VALIDATOR = validation.Validator()
+
+# Local export for analysts ("main.py export") - append-only part files per station type/MAC/month
+# in data/export, only rows newer than the previous export (see export.py; parquet/arrow need pyarrow)
+EXPORT_DIR = export.DEFAULT_EXPORT_DIR
+EXPORT_FORMATS = ('jsonl',)  # 'jsonl' (gzip), 'parquet', 'arrow'
+
+# Statement timeout of backfill queries in seconds (0 = none) - ranges that time out are bisected
+# and retried, the slice size that worked is remembered per module in data/slice_sizes.json
+STATEMENT_TIMEOUT = 300
+SLICE_SIZES = query_slicing.SliceSizes()
+
+# Change tracking - insertion-order cursor ('xmin' or 'id') and bucket size of re-sent changes
+CHANGE_CURSOR = 'xmin'
+CHANGE_BUCKET = 'hour'
+
+# Measurement pivot store - read backfill data from wide per-station tables in nostradamus_sync
+# (built with "main.py pivot", refreshed incrementally before each backfill) instead of pivoting lora_measurement
+USE_PIVOT_STORE = False
+PIVOT_CURSOR = 'xmin'
+
+# Bulk delete - time window chunk size and number of parallel delete requests
+DELETE_CHUNK = timedelta(days=30)
+DELETE_CONCURRENCY = 4
+
+# Backfill - number of modules processed in parallel and records per upload batch
+BACKFILL_CONCURRENCY = 1
+BATCH_SIZE = 2000
+
+# CLI exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1        # some modules, batches or delete requests failed - safe to retry
+EXIT_USAGE = 2         # invalid arguments (argparse)
+EXIT_NOT_READY = 3     # collections missing and could not be created
+EXIT_DB_ERROR = 4      # local database unreachable
+EXIT_API_ERROR = 5     # Nostradamus API unreachable
+EXIT_INTERRUPTED = 130
+
 
 def get_station_by_mac(mac_address):
-    """Returns station type (PIS or RHMZ) based on MAC address"""
-    if mac_address.startswith('PIS_'):
-        return 'PIS'
-    else:
-        return 'RHMZ'
+    """Returns station type based on MAC address"""
+    return REGISTRY.route(mac_address)
 
 
 def get_collection_id_for_mac(mac_address):
@@ -73,194 +141,71 @@ def is_module_excluded(mac_address):
     return mac_address in STATION_CONFIG[station_type]['excluded_modules']
 
 
-def get_pis_query(date_from, date_to, date_middle_1, date_middle_2):
-    return '''
-    -- PIS      
-    WITH params AS (
-        SELECT 
-            %s::varchar AS mac_address,
-            %s::timestamp AS date_from,
-            %s::timestamp AS date_to,
-            %s::timestamp AS date_middle_1,
-            %s::timestamp AS date_middle_2
-    ),
-    module_info AS (
-        SELECT
-            m.mac_address,
-            m.name AS module_name,
-            ROUND(ST_Y(ml.location::geometry)::decimal, 5) AS latitude,
-            ROUND(ST_X(ml.location::geometry)::decimal, 5) AS longitude
-        FROM lora_module m
-        JOIN lora_module_location ml ON m.mac_address = ml.mac_address_lora_module
-        JOIN params p ON m.mac_address = p.mac_address
-    ),
-    raw_data AS (
-        SELECT
-            lm.date,
-            lm.value,
-            st.name AS sensor_name,
-            lm.mac_address_lora_module
-        FROM lora_measurement lm
-        JOIN lora_device_type_sensor_type ldt ON lm.id_lora_device_type_sensor_type = ldt.id
-        JOIN lora_sensor_type st ON ldt.id_lora_sensor_type = st.id
-        JOIN params p ON lm.mac_address_lora_module = p.mac_address
-        WHERE
-            lm.device_on IS TRUE
-            AND lm.valid IS TRUE
-            AND (
-                -- Oba middle datuma postoje - dva perioda
-                (p.date_middle_1 IS NOT NULL AND p.date_middle_2 IS NOT NULL AND (
-                    (lm.date > p.date_from AND lm.date < p.date_middle_1) OR
-                    (lm.date > p.date_middle_2 AND lm.date < p.date_to)
-                ))
-                OR
-                -- Samo date_middle_1 postoji - period od date_from do date_middle_1
-                (p.date_middle_1 IS NOT NULL AND p.date_middle_2 IS NULL AND (
-                    lm.date > p.date_from AND lm.date < p.date_middle_1
-                ))
-                OR
-                -- Samo date_middle_2 postoji - period od date_middle_2 do date_to
-                (p.date_middle_1 IS NULL AND p.date_middle_2 IS NOT NULL AND (
-                    lm.date > p.date_middle_2 AND lm.date < p.date_to
-                ))
-                OR
-                -- Nijedan middle datum ne postoji - ceo period
-                (p.date_middle_1 IS NULL AND p.date_middle_2 IS NULL AND (
-                    lm.date > p.date_from AND lm.date < p.date_to
-                ))
-            )
-            AND st.name IN (
-                'Temperatura vazduha',
-                'Vlažnost vazduha',
-                'Količina padavina',
-                'Tačka rose',
-                'Vlažnost lista'
-            )
-    )
-    SELECT
-        (jsonb_build_object(
-            'key', mi.mac_address,
-            'name', mi.module_name,
-            'timestamp', rd.date,
-            'air-temperature_celsius', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Temperatura vazduha'), 2),
-            'air-humidity_percent', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Vlažnost vazduha'), 2),
-            'precipitation_mm', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Količina padavina'), 2),
-            'dew-point_celsius', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Tačka rose'), 2),
-            'leaf-wetness_min', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Vlažnost lista'), 2),
-            'latitude_4326', mi.latitude,
-            'longitude_4326', mi.longitude
-        )) AS data
-    FROM raw_data rd
-    JOIN module_info mi ON rd.mac_address_lora_module = mi.mac_address
-    GROUP BY mi.mac_address, mi.module_name, mi.latitude, mi.longitude, rd.date
-    ORDER BY rd.date DESC
-    '''
-
-
-def get_rhmz_query(date_from, date_to, date_middle_1, date_middle_2):
-    return '''
-    -- RHMZ
-    WITH params AS (
-        SELECT 
-            %s::varchar AS mac_address,
-            %s::timestamp AS date_from,
-            %s::timestamp AS date_to,
-            %s::timestamp AS date_middle_1,
-            %s::timestamp AS date_middle_2
-    ),
-    module_info AS (
-        SELECT
-            m.mac_address,
-            m.name AS module_name,
-            ROUND(ST_Y(ml.location::geometry)::decimal, 5) AS latitude,
-            ROUND(ST_X(ml.location::geometry)::decimal, 5) AS longitude
-        FROM lora_module m
-        JOIN lora_module_location ml ON m.mac_address = ml.mac_address_lora_module
-        JOIN params p ON m.mac_address = p.mac_address
-    ),
-    raw_data AS (
-        SELECT
-            lm.date,
-            lm.value,
-            st.name AS sensor_name,
-            lm.mac_address_lora_module
-        FROM lora_measurement lm
-        JOIN lora_device_type_sensor_type ldt ON lm.id_lora_device_type_sensor_type = ldt.id
-        JOIN lora_sensor_type st ON ldt.id_lora_sensor_type = st.id
-        JOIN params p ON lm.mac_address_lora_module = p.mac_address
-        WHERE
-            lm.device_on IS TRUE
-            AND lm.valid IS TRUE
-            AND (
-                -- Oba middle datuma postoje - dva perioda
-                (p.date_middle_1 IS NOT NULL AND p.date_middle_2 IS NOT NULL AND (
-                    (lm.date > p.date_from AND lm.date < p.date_middle_1) OR
-                    (lm.date > p.date_middle_2 AND lm.date < p.date_to)
-                ))
-                OR
-                -- Samo date_middle_1 postoji - period od date_from do date_middle_1
-                (p.date_middle_1 IS NOT NULL AND p.date_middle_2 IS NULL AND (
-                    lm.date > p.date_from AND lm.date < p.date_middle_1
-                ))
-                OR
-                -- Samo date_middle_2 postoji - period od date_middle_2 do date_to
-                (p.date_middle_1 IS NULL AND p.date_middle_2 IS NOT NULL AND (
-                    lm.date > p.date_middle_2 AND lm.date < p.date_to
-                ))
-                OR
-                -- Nijedan middle datum ne postoji - ceo period
-                (p.date_middle_1 IS NULL AND p.date_middle_2 IS NULL AND (
-                    lm.date > p.date_from AND lm.date < p.date_to
-                ))
-            )
-            AND st.name IN (
-                    'Brzina vetra',
-                    'Količina padavina', 
-                    'Smer vetra',
-                    'Solarno zračenje',
-                    'Tačka rose',
-                    'Temperatura vazduha',
-                    'Temperatura zemljišta',
-                    'Udar vetra',
-                    'Vazdušni pritisak',
-                    'Vlažnost vazduha'
-            )
-    )
-    SELECT
-        (jsonb_build_object(
-            'key', mi.mac_address,
-            'name', mi.module_name,
-            'timestamp', rd.date,
-            'air-temperature_celsius', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Temperatura vazduha'), 2),
-            'air-humidity_percent', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Vlažnost vazduha'), 2),
-            'air-pressure_mbar', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Vazdušni pritisak'), 2),
-            'precipitation_mm', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Količina padavina'), 2),
-            'dew-point_celsius', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Tačka rose'), 2),
-            'wind-speed_m/s', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Brzina vetra'), 2),
-            'wind-direction_angle', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Smer vetra'), 2),
-            'wind-gust_m/s', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Udar vetra'), 2),
-            'solar-radiation_j/cm2', ROUND(MAX(rd.value) FILTER (WHERE rd.sensor_name = 'Solarno zračenje'), 2),
-            'latitude_4326', mi.latitude,
-            'longitude_4326', mi.longitude
-        )) AS data
-    FROM raw_data rd
-    JOIN module_info mi ON rd.mac_address_lora_module = mi.mac_address
-    GROUP BY mi.mac_address, mi.module_name, mi.latitude, mi.longitude, rd.date
-    ORDER BY rd.date DESC
-    '''
-
-
+@profiling.profiled('send_data_in_batches')
 def send_data_in_batches(project_id, collection_id, write_key, data, batch_size=3000):
-    """Sends data in batches"""
+    """Sends data in batches (list of records or ColumnarBatch), returns True if all batches were sent"""
     total = len(data)
+    all_sent = True
     for i in range(0, total, batch_size):
-        batch = data[i:i+batch_size]
         print(f"   Sending batch {i+1}-{min(i+batch_size, total)} of {total} records...")
-        send_data(project_id, collection_id, write_key, batch)
+        with TRACER.span('batch_upload', batch_index=i // batch_size, rows=min(batch_size, total - i)):
+            if isinstance(data, columnar.ColumnarBatch):
+                count = min(batch_size, total - i)
+                with METRICS.timer(SERIALIZE) as t:
+                    body = data.to_json(i, i+batch_size)
+                    t.add(rows=count, nbytes=len(body))
+                # Body of module data already held - accounted, never waits
+                with memory_budget.BUDGET.hold(len(body), block=False):
+                    ok = send_data_raw(project_id, collection_id, write_key, body, count)
+            else:
+                ok = send_data(project_id, collection_id, write_key, data[i:i+batch_size])
+        all_sent = all_sent and ok
+    return all_sent
+
+
+def format_epoch(epoch):
+    """Formats epoch seconds as API timestamp"""
+    return datetime.fromtimestamp(epoch, utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def bucket_bounds(bucket_start, seconds):
+    """API timestamps of first and last microsecond of bucket [bucket_start, bucket_start + seconds)"""
+    return columnar.format_timestamp(bucket_start), columnar.format_timestamp(bucket_start + seconds - columnar.RESOLUTION)
+
+
+def send_changed_buckets(mac_address, collection_id, data, index, range_start=None, range_end=None, batch_size=2000):
+    """Sends only time buckets whose content hash differs from the last successful upload, returns (sent, failed buckets)"""
+    changed, stale, unchanged = upload_index.plan_upload(
+        index, collection_id, mac_address, data, DEDUP_BUCKET_SECONDS, range_start, range_end)
+    print(f"   🧮 Buckets: {len(changed)} changed, {unchanged} unchanged, {len(stale)} removed locally")
+
+    sent = 0
+    failed = 0
+    for bucket_start, bucket, content_hash, _ in changed:
+        timestamp_from, timestamp_to = bucket_bounds(bucket_start, DEDUP_BUCKET_SECONDS)
+        # Drop server copy first - with other content if uploaded before, and an unknown previous hash
+        # (first run, fresh index) may still be data sent by earlier backfills or live.py
+        if delete_data(PROJECT_ID, collection_id, MASTER_KEY, key=mac_address,
+                       timestamp_from=timestamp_from, timestamp_to=timestamp_to) is None:
+            failed += 1
+            continue
+        if send_data_in_batches(PROJECT_ID, collection_id, WRITE_KEY, bucket, batch_size=batch_size):
+            index.record(collection_id, mac_address, bucket_start, content_hash, len(bucket))
+            sent += len(bucket)
+        else:
+            failed += 1
+
+    for bucket_start in stale:
+        timestamp_from, timestamp_to = bucket_bounds(bucket_start, DEDUP_BUCKET_SECONDS)
+        if delete_data(PROJECT_ID, collection_id, MASTER_KEY, key=mac_address,
+                       timestamp_from=timestamp_from, timestamp_to=timestamp_to) is not None:
+            index.forget(collection_id, mac_address, bucket_start)
+
+    return sent, failed
 
         
-def fetch_module_data(mac_address, date_from_dt, date_to_dt, first_timestamp_dt, last_timestamp_dt):
-    """Fetches data for given module"""
+def get_module_query(mac_address, date_from_dt, date_to_dt, first_timestamp_dt, last_timestamp_dt):
+    """Returns query and parameters for given module and period"""
 
     if first_timestamp_dt == date_from_dt:
         date_middle_1 = None
@@ -272,30 +217,175 @@ def fetch_module_data(mac_address, date_from_dt, date_to_dt, first_timestamp_dt,
     else:
         date_middle_2 = last_timestamp_dt
 
-    if mac_address.startswith('PIS_'):
-        QUERY = get_pis_query(date_from_dt, date_to_dt, date_middle_1, date_middle_2)
-    else:
-        QUERY = get_rhmz_query(date_from_dt, date_to_dt, date_middle_1, date_middle_2)
+    queries = pivot_store.STORES if USE_PIVOT_STORE else REGISTRY
+    QUERY = queries[get_station_by_mac(mac_address)].backfill_query
 
-    conn = psycopg2.connect(**DB_CONFIG)
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+    return QUERY, (mac_address, date_from_dt, date_to_dt, date_middle_1, date_middle_2)
+
+
+def report_slice_timeout(params, slices):
+    """on_timeout callback of query_slicing.run_sliced"""
+    mac_address, start, end = params[:3]
+    print(f"   ⏱️  {mac_address}: query for {start.isoformat()} - {end.isoformat()} timed out, retrying as {slices} slices")
+    METRICS.count('statement_timeouts')
+
+
+def connect_for_backfill():
+    """Database connection with STATEMENT_TIMEOUT applied"""
+    with METRICS.timer(DB_CONNECT):
+        conn = psycopg2.connect(**DB_CONFIG)
+    if STATEMENT_TIMEOUT:
+        query_slicing.set_statement_timeout(conn, STATEMENT_TIMEOUT)
+    return conn
+
+
+@profiling.profiled('fetch_module_data')
+def fetch_module_data(mac_address, date_from_dt, date_to_dt, first_timestamp_dt, last_timestamp_dt):
+    """Fetches data for given module"""
+    QUERY, params = get_module_query(mac_address, date_from_dt, date_to_dt, first_timestamp_dt, last_timestamp_dt)
+
+    def fetch(slice_params):
+        with conn.cursor(cursor_factory=psycopg2_extras.RealDictCursor) as cur:
             cur.execute("SET search_path TO agrosense, public;")
-            cur.execute(QUERY, (mac_address, date_from_dt, date_to_dt, date_middle_1, date_middle_2))
-            rows = cur.fetchall()
+            with METRICS.timer(DB_QUERY):
+                cur.execute(QUERY, slice_params)
+            with METRICS.timer(DB_FETCH) as t:
+                rows = cur.fetchall()
+                t.add(rows=len(rows))
             return [row['data'] for row in rows]
+
+    conn = connect_for_backfill()
+    try:
+        slices = query_slicing.run_sliced(conn, params, fetch, SLICE_SIZES, on_timeout=report_slice_timeout)
+        return [record for records in slices for record in records]
     finally:
         conn.close()
 
 
-def save_module_data_to_txt(mac_address, data):
-    """Saves data in JSONL format"""
-    if not data:
-        return
-    out_path = os.path.join('data', f'{mac_address}.txt')
-    with open(out_path, 'w', encoding='utf-8') as f:
-        for row in data:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+@profiling.profiled('fetch_module_batch')
+def fetch_module_batch(mac_address, date_from_dt, date_to_dt, first_timestamp_dt, last_timestamp_dt):
+    """Fetches data for given module as ColumnarBatch - call within memory budget admission, resized to batch.nbytes"""
+    QUERY, params = get_module_query(mac_address, date_from_dt, date_to_dt, first_timestamp_dt, last_timestamp_dt)
+    fields = STATION_CONFIG[get_station_by_mac(mac_address)]['fields']
+
+    def fetch(slice_params):
+        # COPY runs query and transfers rows in one call
+        with TRACER.span('db_query', mac=mac_address) as span, METRICS.timer(DB_QUERY) as t:
+            batch = columnar.fetch_columnar(conn, QUERY, slice_params, fields)
+            t.add(rows=len(batch), nbytes=batch.nbytes)
+            span.set_attribute('rows', len(batch))
+        return batch
+
+    conn = connect_for_backfill()
+    try:
+        slices = query_slicing.run_sliced(conn, params, fetch, SLICE_SIZES, on_timeout=report_slice_timeout)
+        batch = slices[0]
+        for other in slices[1:]:
+            batch.extend(other)
+    finally:
+        conn.close()
+    return validate_batch(mac_address, batch) if USE_VALIDATION else batch
+
+
+def validate_batch(mac_address, batch):
+    """Returns valid rows of batch, rejected rows are quarantined"""
+    valid = VALIDATOR.validate(batch, REGISTRY[get_station_by_mac(mac_address)])
+    if len(valid) < len(batch):
+        print(f"   🚫 {mac_address}: {len(batch) - len(valid)} invalid rows quarantined in {VALIDATOR.path}")
+    return valid
+
+
+@profiling.profiled('stream_module_data')
+def stream_module_data(mac_address, collection_id, date_from_dt, date_to_dt, first_timestamp_dt, last_timestamp_dt, batch_size=2000):
+    """Streams module data through COPY and sends it batch by batch, returns (records, failed batches)"""
+    QUERY, params = get_module_query(mac_address, date_from_dt, date_to_dt, first_timestamp_dt, last_timestamp_dt)
+
+    send_seconds = [0.0]
+    failed = [0]
+    streamed = [0]
+
+    def send_batch(body, count):
+        print(f"   Sending batch of {count} records...")
+        start = time.perf_counter()
+        # COPY stream is the producer - it pauses here while budget is exhausted
+        with memory_budget.BUDGET.hold(len(body)):
+            if not send_data_raw(PROJECT_ID, collection_id, WRITE_KEY, body, count):
+                failed[0] += 1
+        streamed[0] += count
+        send_seconds[0] += time.perf_counter() - start
+
+    def fetch_with(query):
+        def fetch(slice_params):
+            streamed_before = streamed[0]
+            # Batch upload spans end up nested under the streaming query span
+            with TRACER.span('db_query', mac=mac_address, copy_format=COPY_FORMAT) as span:
+                try:
+                    total = copy_export.stream_query_batches(conn, query, slice_params, send_batch, batch_size=batch_size, copy_format=COPY_FORMAT)
+                except psycopg2.Error as e:
+                    if query_slicing.is_statement_timeout(e) and streamed[0] > streamed_before:
+                        # Rows next to server data are sent first, server min/max make re-run resume after the last one
+                        raise query_slicing.SliceAbandoned(f"timed out after {streamed[0] - streamed_before} records were sent")
+                    raise
+                span.set_attribute('rows', total)
+            return total
+        return fetch
+
+    queries = pivot_store.STORES if USE_PIVOT_STORE else REGISTRY
+    ascending_query = queries[get_station_by_mac(mac_address)].backfill_query_ascending
+
+    timeouts = [0]
+
+    def on_timeout(slice_params, slices):
+        timeouts[0] += 1
+        report_slice_timeout(slice_params, slices)
+
+    conn = connect_for_backfill()
+    try:
+        start = time.perf_counter()
+        total = 0
+        try:
+            for part_params, oldest_first in query_slicing.stream_order(params):
+                fetch = fetch_with(ascending_query if oldest_first else QUERY)
+                total += sum(query_slicing.run_sliced(conn, part_params, fetch, SLICE_SIZES, on_timeout=on_timeout,
+                                                      oldest_first=oldest_first, grow=False))
+            if not timeouts[0]:
+                SLICE_SIZES.grow(mac_address)
+        except query_slicing.SliceAbandoned as e:
+            print(f"   ❌ {mac_address}: {e}, the rest is left for the next run")
+            METRICS.count('statement_timeouts')
+            total = streamed[0]
+            failed[0] += 1
+        # Uploads happen inside COPY stream, count only time spent reading from database
+        METRICS.record(DB_FETCH, time.perf_counter() - start - send_seconds[0], rows=total)
+        return total, failed[0]
+    finally:
+        conn.close()
+
+
+def export_module_data(mac_address, exporter, date_from_dt, date_to_dt):
+    """
+    Streams module rows newer than its last export (date_from_dt for first
+    export) up to date_to_dt into exporter's part files, returns rows exported.
+    """
+    station_type = get_station_by_mac(mac_address)
+    station = REGISTRY[station_type]
+    QUERY = export.export_query(station, pivot_store.STORES[station_type] if USE_PIVOT_STORE else None)
+    fields = STATION_CONFIG[station_type]['fields']
+
+    rows = 0
+    conn = connect_for_backfill()
+    try:
+        # One query per month keeps each COPY short, watermark advances with every part written
+        for range_start, range_end in export.month_ranges(exporter.resume_from(mac_address, date_from_dt), date_to_dt):
+            sink = exporter.sink(station_type, fields)
+            with TRACER.span('db_query', mac=mac_address) as span, METRICS.timer(DB_QUERY) as t:
+                columnar.copy_columnar(conn, QUERY, (mac_address, range_start, range_end), fields, sink)
+                t.add(rows=sink.rows)
+                span.set_attribute('rows', sink.rows)
+            rows += sink.rows
+    finally:
+        conn.close()
+    return rows
 
 
 def get_collections(project_id, read_key):
@@ -304,8 +394,8 @@ def get_collections(project_id, read_key):
     headers = {"X-API-Key": read_key}
 
     try:    
-        response = httpx.get(url, headers=headers)
-    except httpx.ReadTimeout:
+        response = api.get(url, headers=headers)
+    except api.ApiTimeout:
         print(f"❌ Timeout: Fetching collections failed")
         return []
     if response.status_code == 200:
@@ -317,57 +407,21 @@ def get_collections(project_id, read_key):
         return []
 
 
-def create_collection(project_id, master_key, station_type):
-    """Creates new collection for project"""
+def create_collection(project_id, master_key, station_type, interval=None):
+    """Creates new collection for project (rollup collection of station type with interval)"""
     url = f"{BASE_URL}/projects/{project_id}/collections"
     headers = {"X-API-Key": master_key}
 
-    if station_type == 'PIS':
-        collection_body = {
-            "name": "station_type_2",
-            "description": "IoT data for Serbian pilot for station type 2",
-            "tags": ["temperature", "humidity", "precipitation", "dew_point", "leaf-wetness"],
-            "collection_schema": {
-                "key": "PIS_BOGARAS",
-                "name": "Bogaraš",
-                "latitude_4326": 45.93855,
-                "longitude_4326": 19.91273,
-                "timestamp": "2023-12-31T23:00:00Z",
-                "leaf-wetness_min": 22.5,
-                "precipitation_mm": 0.0,
-                "dew-point_celsius": 5.5,
-                "air-humidity_percent": 100.0,
-                "air-temperature_celsius": 5.61
-            }
-        }
-    elif station_type == 'RHMZ':
-        collection_body = {
-            "name": "station_type_1",
-            "description": "IoT data for Serbian pilot for station type 1",
-            "tags": ["temperature", "precipitation", "humidity", "wind", "pressure", "solar_radiation", "dew_point"],
-            "collection_schema": {
-                "key": "MAC_adresa",
-                "name": "Sremska Mitrovica",
-                "timestamp": "2025-07-28T09:54:00Z",
-                "air-temperature_celsius": 23.2,
-                "precipitation_mm": 0.8,
-                "air-humidity_percent": 75.2,
-                "wind-speed_m/s": 2.6,
-                "wind-direction_angle": 127.0,
-                "wind-gust_m/s": 7.9,
-                "dew-point_celsius": 4.6,
-                "air-pressure_mbar": 997.3,
-                "solar-radiation_j/cm2": 214.8,
-                "latitude_4326": 45.22453,
-                "longitude_4326": 19.58752
-            }
-        }
+    if station_type not in STATION_CONFIG:
+        raise ValueError(f"Invalid station type. Use one of: {', '.join(STATION_CONFIG)}.")
+    if interval is None:
+        collection_body = REGISTRY[station_type].collection_body
     else:
-        raise ValueError("Invalid station type. Use 'PIS' or 'RHMZ'.")  
+        collection_body = rollups.collection_body(REGISTRY[station_type], interval)
 
     try:    
-        response = httpx.post(url, json=collection_body, headers=headers, timeout=15.0) 
-    except httpx.ReadTimeout:
+        response = api.post(url, json=collection_body, headers=headers, timeout=15.0) 
+    except api.ApiTimeout:
         print(f"❌ Timeout: Creating collection failed")
         return None
     if response.status_code == 200:
@@ -384,12 +438,12 @@ def delete_collection(project_id, master_key, collection_id):
     headers = {"X-API-Key": master_key}
 
     try:
-        response = httpx.delete(url, headers=headers, timeout=15.0)
+        response = api.delete(url, headers=headers, timeout=15.0)
         if response.status_code == 200:
             print(f"✅ Collection deleted", response.json())
         else:
             print(f"❌ Error deleting collection: {response.text}")
-    except httpx.ReadTimeout:
+    except api.ApiTimeout:
         print(f"❌ Timeout: Deleting collection {collection_id} failed")
     except Exception as e:
         print(f"❌ Error deleting collection {collection_id}: {e}")
@@ -408,7 +462,11 @@ def delete_data(project_id, collection_id, master_key, key=None, timestamp_from=
     if timestamp_to:
         delete_request["timestamp_to"] = timestamp_to
 
-    response = requests.delete(url, json=delete_request, headers=headers)
+    try:
+        response = api.delete(url, json=delete_request, headers=headers, timeout=60.0)
+    except api.ApiTimeout:
+        print(f"❌ Timeout: Deleting data failed ({delete_request})")
+        return None
     if response.status_code == 200:
         result = response.json()
         print(f"✅ Data deleted successfully: {result['message']}")
@@ -418,50 +476,121 @@ def delete_data(project_id, collection_id, master_key, key=None, timestamp_from=
         return None
 
 
-def fetch_lora_modules(station_prefix):
-    """Fetches modules for given station type"""
-    try:
-        conn = psycopg2.connect(**DB_CONFIG)
-    except psycopg2.OperationalError as e:
-        # Catches connection issues (unreachable IP, wrong port, etc.)
-        print(f"Error connecting to database: {e}")
-        return []
-    except psycopg2.Error as e:
-        # Catches all other psycopg2 errors
-        print(f"Database error: {e}")
-        return []
-    
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SET search_path TO agrosense, public;")
-            cur.execute(
-                """
-                SELECT m.mac_address
-                FROM lora_module m
-                WHERE m.mac_address LIKE %s
-                """,
-                (f"%{station_prefix}%",)
-            )
-            results = cur.fetchall()
-        return results
-    finally:
-        conn.close()
+def split_time_window(timestamp_from, timestamp_to, chunk=DELETE_CHUNK):
+    """Splits [timestamp_from, timestamp_to] into consecutive windows of at most chunk size"""
+    windows = []
+    start = timestamp_from
+    while start <= timestamp_to:
+        end = min(start + chunk - timedelta(seconds=1), timestamp_to)
+        windows.append((start, end))
+        start = end + timedelta(seconds=1)
+    return windows
+
+
+def bulk_delete_data(project_id, collection_id, master_key, keys=None, windows=None,
+                     chunk=DELETE_CHUNK, max_workers=DELETE_CONCURRENCY):
+    """
+    Deletes data for list of keys and/or time windows [(from_dt, to_dt), ...].
+    Large windows are split into chunks and requests run in parallel.
+    Returns list of failed (key, timestamp_from, timestamp_to) requests.
+    """
+    if not keys and not windows:
+        raise ValueError("Bulk delete needs at least one key or time window.")
+
+    # Only windows=None deletes whole keys - windows must never degrade into an unfiltered delete
+    time_chunks = [(None, None)]
+    if windows is not None:
+        time_chunks = []
+        for window_from, window_to in windows:
+            if window_from is None or window_to is None or window_from > window_to:
+                raise ValueError(f"Invalid delete window {window_from} - {window_to}.")
+            time_chunks.extend(split_time_window(window_from, window_to, chunk))
+        if not time_chunks:
+            raise ValueError("Delete windows produced no time chunks.")
+
+    tasks = []
+    for key in (keys or [None]):
+        for window_from, window_to in time_chunks:
+            tasks.append((
+                key,
+                window_from.strftime('%Y-%m-%dT%H:%M:%SZ') if window_from else None,
+                window_to.strftime('%Y-%m-%dT%H:%M:%SZ') if window_to else None,
+            ))
+
+    print(f"🗑️  Deleting {len(tasks)} chunks with {max_workers} parallel requests...")
+    failed = []
+    done = 0
+    with profiling.executor(max_workers, 'delete requests') as executor:
+        futures = {
+            executor.submit(delete_data, project_id, collection_id, master_key, key, ts_from, ts_to): (key, ts_from, ts_to)
+            for key, ts_from, ts_to in tasks
+        }
+        for future in as_completed(futures):
+            done += 1
+            task = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"❌ Error deleting {task}: {e}")
+                result = None
+            if result is None:
+                failed.append(task)
+            print(f"   [{done}/{len(tasks)}] {task[0] or '*'} {task[1] or ''} - {task[2] or ''}")
+
+    print(f"✅ Bulk delete finished: {len(tasks) - len(failed)} ok, {len(failed)} failed")
+    return failed
+
+
+def fetch_lora_modules(station_type):
+    """Returns modules of station type (mac_address, name, latitude, longitude) from cached module catalog"""
+    if not MODULES.is_fresh():
+        try:
+            with METRICS.timer(DB_CONNECT):
+                conn = psycopg2.connect(**DB_CONFIG)
+        except psycopg2.OperationalError as e:
+            # Catches connection issues (unreachable IP, wrong port, etc.)
+            print(f"❌ Error connecting to database: {e}")
+            return []
+        except psycopg2.Error as e:
+            print(f"❌ Database error: {e}")
+            return []
+
+        try:
+            with METRICS.timer(DB_QUERY) as t:
+                t.add(rows=MODULES.refresh(conn))
+        finally:
+            conn.close()
+    return MODULES.for_station_type(station_type)
 
 
 def send_data(project_id, collection_id, write_key, data):
     """Sends data to collection"""
+    with METRICS.timer(SERIALIZE) as t:
+        body = json.dumps(data, ensure_ascii=False)
+        t.add(rows=len(data), nbytes=len(body))
+    return send_data_raw(project_id, collection_id, write_key, body, len(data))
+
+
+def send_data_raw(project_id, collection_id, write_key, body, count):
+    """Sends already serialized JSON array body to collection"""
     url = f"{BASE_URL}/projects/{project_id}/collections/{collection_id}/send_data"
-    headers = {"X-API-Key": write_key}
-    try:    
-        response = httpx.post(url, json=data, headers=headers)
-    except httpx.ReadTimeout:
+    headers = {"X-API-Key": write_key, "Content-Type": "application/json"}
+    content = body.encode('utf-8')
+    try:
+        with METRICS.timer(HTTP_SEND) as t:
+            response = api.post(url, content=content, headers=headers, timeout=30.0)
+            t.add(rows=count, nbytes=len(content), status=response.status_code)
+        current_span().set_attribute('http.status_code', response.status_code)
+    except api.ApiTimeout:
         print(f"   ❌ Timeout: Sending data failed")
+        current_span().set_error('timeout')
         return False
     if response.status_code == 200:
-        print(f"   ✅ Sent {len(data)} records")
+        print(f"   ✅ Sent {count} records")
         return True
     else:
         print(f"   ❌ Error sending data: {response.text}")
+        current_span().set_error(f"HTTP {response.status_code}")
         return False
 
 
@@ -480,7 +609,10 @@ def get_data(project_id, collection_id, read_key, filters=None, attributes=None,
     if filters:
         params["filters"] = json.dumps(filters)
 
-    response = requests.get(url, headers=headers, params=params)
+    with METRICS.timer(SERVER_LOOKUP) as t:
+        response = api.get(url, headers=headers, params=params)
+        t.add(nbytes=len(response.content), status=response.status_code)
+    current_span().set_attribute('http.status_code', response.status_code)
     if response.status_code == 200:
         # print(response.url)
         return response.json()  # Returns {'data': [...]}
@@ -504,7 +636,7 @@ def setup_collections(state):
                 config['collection_id'] = c['collection_id']
                 state[f'{station_type.lower()}_collection_id'] = c['collection_id']
                 data_on_server = get_statistics(PROJECT_ID, c['collection_id'], READ_KEY, "key", "distinct")
-                state[f'fetched_data_{station_type.lower()}'] = data_on_server['key_statistics']
+                state[f'fetched_data_{station_type.lower()}'] = data_on_server.get('key_statistics')
     
     # Creating missing collections
     for station_type, config in STATION_CONFIG.items():
@@ -519,64 +651,265 @@ def setup_collections(state):
         if state[f'fetched_data_{station_type.lower()}'] is not None:
           print(f"   {station_type} modules #: {len(state[f'fetched_data_{station_type.lower()}'])}")
     print()
+
+    if USE_ROLLUPS:
+        setup_rollup_collections(collections)
     
     return state
 
 
+def setup_rollup_collections(collections):
+    """Maps existing and creates missing rollup collections of all station types"""
+    existing = {c.get('collection_name'): c['collection_id'] for c in collections}
+    for station_type, config in STATION_CONFIG.items():
+        for interval in ROLLUP_INTERVALS:
+            name = rollups.collection_name(REGISTRY[station_type], interval)
+            collection_id = existing.get(name) or create_collection(PROJECT_ID, MASTER_KEY, station_type, interval)
+            config['rollup_collection_ids'][interval] = collection_id
+            print(f"   📐 {station_type} {interval} rollups: {collection_id}")
+    print()
+
+
+def send_rollups(mac_address, date_from_dt, date_to_dt):
+    """
+    Recomputes rollup buckets overlapping period from local data and replaces
+    them on server, returns True if all intervals were sent.
+    """
+    station = REGISTRY[get_station_by_mac(mac_address)]
+    config = STATION_CONFIG[station.name]
+
+    # Whole buckets of the longest interval, so rows outside period sharing a bucket with it count too
+    longest = max(rollups.INTERVALS[interval] for interval in ROLLUP_INTERVALS)
+    start = rollups.bucket_start(int(date_from_dt.timestamp()), longest)
+    end = rollups.bucket_start(int(date_to_dt.timestamp()) - 1, longest) + longest
+    # Query bounds are exclusive, so start just before first bucket
+    range_start = datetime.fromtimestamp(start, utc) - timedelta(microseconds=1)
+    range_end = datetime.fromtimestamp(end, utc)
+
+    ok = True
+    with memory_budget.BUDGET.admit() as admission:
+        data = fetch_module_batch(mac_address, range_start, range_end, range_start, range_end)
+        admission.resize(data.nbytes)
+        for interval in ROLLUP_INTERVALS:
+            collection_id = config['rollup_collection_ids'].get(interval)
+            rolled = rollups.aggregate(data, station, rollups.INTERVALS[interval])
+            if delete_data(PROJECT_ID, collection_id, MASTER_KEY, key=mac_address,
+                           timestamp_from=format_epoch(start), timestamp_to=format_epoch(end - 1)) is None:
+                ok = False
+                continue
+            if rolled:
+                ok = send_data_in_batches(PROJECT_ID, collection_id, WRITE_KEY, rolled, batch_size=BATCH_SIZE) and ok
+            print(f"   📐 {len(rolled)} {interval} rollups of {mac_address} sent")
+    return ok
+
+
 def fetch_and_display_data(state):
     """Fetches sample data from collections"""
-    pis_id = STATION_CONFIG['PIS']['collection_id']
-    rhmz_id = STATION_CONFIG['RHMZ']['collection_id']
-    
-    if not pis_id or not rhmz_id:
+    if not all(config['collection_id'] for config in STATION_CONFIG.values()):
         print("\n⚠️ You must first run option 1 (Setup Collections)!")
         return state
     
     attributes = ['key', 'timestamp', 'air-temperature_celsius']
     
-    print(f"\n📥 Fetching data from PIS collection ({pis_id})...")
-    # Fetch latest data (limit=10, sorted by timestamp desc)
-    response_pis = get_data(
-        PROJECT_ID, 
-        pis_id, 
-        READ_KEY, 
-        attributes=attributes,
-        # attributes = ['key'],
-        order_by='{"field": "timestamp", "order": "desc"}',
-        limit=len(state['fetched_data_pis']),
-    )
-    
-    print(f"📥 Fetching data from RHMZ collection ({rhmz_id})...")
-    response_rhmz = get_data(
-        PROJECT_ID, 
-        rhmz_id, 
-        READ_KEY, 
-        attributes=attributes,
-        order_by='{"field": "timestamp", "order": "desc"}',
-        limit=len(state['fetched_data_rhmz'])
-    )
-
-    # Extract list from API response
-    data_pis = response_pis.get('data', []) if isinstance(response_pis, dict) else []
-    data_rhmz = response_rhmz.get('data', []) if isinstance(response_rhmz, dict) else []
-    
-    state['fetched_data_pis'] = data_pis
-    state['fetched_data_rhmz'] = data_rhmz
+    fetched = {}
+    for station_type, config in STATION_CONFIG.items():
+        print(f"\n📥 Fetching data from {station_type} collection ({config['collection_id']})...")
+        # Fetch latest data (one record per known module, sorted by timestamp desc)
+        response = get_data(
+            PROJECT_ID, 
+            config['collection_id'], 
+            READ_KEY, 
+            attributes=attributes,
+            order_by='{"field": "timestamp", "order": "desc"}',
+            limit=len(state.get(f'fetched_data_{station_type.lower()}') or []),
+        )
+        # Extract list from API response
+        fetched[station_type] = response.get('data', []) if isinstance(response, dict) else []
+        state[f'fetched_data_{station_type.lower()}'] = fetched[station_type]
     
     print(f"\n✅ Data fetched:")
-    print(f"   PIS: {len(data_pis)} items")
-    if data_pis:
-        for first in data_pis:
-            print(f"      Latest: {first.get('key')} @ {first.get('timestamp')} ({first.get('air-temperature_celsius')}°C)")
-    print(f"   RHMZ: {len(data_rhmz)} items")
-    if data_rhmz:
-        for first in data_rhmz:
+    for station_type, data in fetched.items():
+        print(f"   {station_type}: {len(data)} items")
+        for first in data:
             print(f"      Latest: {first.get('key')} @ {first.get('timestamp')} ({first.get('air-temperature_celsius')}°C)")
     print()
     
     return state
 
 
+def process_module(mac, data_on_server, date_from_dt, date_to_dt, index=None, batch_size=BATCH_SIZE):
+    """Processes one module for given period - returns (records sent, True if all batches were sent)"""
+    print(f"\n⚙️ Processing module: {mac}")
+
+    # Proveri da li postoji station sa tim key-em
+    station_data = next((item for item in data_on_server if item['key'] == mac), None)
+
+    if USE_CONTENT_DEDUP:
+        # Compare whole period bucket by bucket with what was already uploaded
+        collection_id = get_collection_id_for_mac(mac)
+        with memory_budget.BUDGET.admit() as admission:
+            data = fetch_module_batch(mac, date_from_dt, date_to_dt, date_from_dt, date_to_dt)
+            admission.resize(data.nbytes)
+            sent, failed = send_changed_buckets(mac, collection_id, data, index,
+                                                int(date_from_dt.timestamp()), int(date_to_dt.timestamp()), batch_size)
+        print(f"   ✅ {sent} records sent to collection {collection_id}")
+        return sent, not failed
+
+    if station_data:
+        print(f"🛰️ Station {mac} found on Nostradamus IoT server:")
+        print(f"   Min timestamp: {station_data['min_timestamp']}")
+        print(f"   Max timestamp: {station_data['max_timestamp']}")
+        print(f"   Total records: {station_data['total_records']}")
+    else:
+        print(f"🛈 Station {mac} not found on Nostradamus IoT server, will fetch all data from {date_from_dt.isoformat()} to {date_to_dt.isoformat()}")
+
+    if station_data is not None:
+        first_timestamp_dt = datetime.fromisoformat(station_data['min_timestamp'].replace('Z', '+00:00')).replace(tzinfo=utc)
+        last_timestamp_dt = datetime.fromisoformat(station_data['max_timestamp'].replace('Z', '+00:00')).replace(tzinfo=utc)
+    else :
+        first_timestamp_dt = date_from_dt
+        last_timestamp_dt = date_to_dt
+
+    if (not station_data) or  ((first_timestamp_dt > date_from_dt) or (last_timestamp_dt < date_to_dt)) :
+        collection_id = get_collection_id_for_mac(mac)
+
+        if USE_COPY_EXPORT and not USE_VALIDATION:
+            # Stream rows from database straight into upload batches (validation needs whole columns)
+            sent, failed = stream_module_data(mac, collection_id, date_from_dt, date_to_dt, first_timestamp_dt, last_timestamp_dt, batch_size=batch_size)
+            if not sent:
+                print(f"   ⚠️  No data fetched from local database for {mac}")
+                return 0, True
+            print(f"   ✅ {sent} records sent to collection {collection_id}")
+            return sent, not failed
+
+        with memory_budget.BUDGET.admit() as admission:
+            # Fetch data from database
+            data = fetch_module_batch(mac, date_from_dt, date_to_dt, first_timestamp_dt, last_timestamp_dt)
+            admission.resize(data.nbytes)
+            if not data:
+                print(f"   ⚠️  No data fetched from local database for {mac}")
+                return 0, True
+
+            # Send data
+            ok = send_data_in_batches(PROJECT_ID, collection_id, WRITE_KEY, data, batch_size=batch_size)
+        print(f"   ✅ Data sent to collection {collection_id}")
+        return len(data), ok
+    else:
+        print(f"   ⏭️  Skipping {mac} - data is already complete up to {date_to_dt.isoformat()}")
+        return 0, True
+
+
+def refresh_pivot_store(station_types=None, cursor=PIVOT_CURSOR, rebuild=False):
+    """Builds (first run, rebuild) or incrementally refreshes measurement pivot tables, returns True on success"""
+    print(f"\n🧮 Refreshing measurement pivot store ({cursor} cursor{', full rebuild' if rebuild else ''})")
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+    except psycopg2.Error as e:
+        print(f"❌ Database connection failed: {e}")
+        return False
+    try:
+        for station_type in station_types or STATION_CONFIG:
+            store = pivot_store.STORES[station_type]
+            modules = [row['mac_address'] for row in fetch_lora_modules(station_type)]
+            with METRICS.timer(DB_QUERY) as t:
+                mode, rows = store.refresh(conn, modules, cursor, rebuild)
+                t.add(rows=rows)
+            print(f"   ✅ {station_type}: {mode} of {store.table}, {rows} rows written")
+    except psycopg2.Error as e:
+        print(f"❌ Pivot store refresh failed: {e}")
+        return False
+    finally:
+        conn.close()
+    return True
+
+
+def select_modules(station_type, mac_patterns=None):
+    """Returns MAC addresses of station type, without excluded modules and limited to mac_patterns (shell-style)"""
+    macs = []
+    for row in fetch_lora_modules(station_type):
+        mac = row['mac_address']
+        if is_module_excluded(mac):
+            print(f"   ⏭️  Skipping excluded module: {mac}")
+            continue
+        if mac_patterns and not any(fnmatch.fnmatchcase(mac, pattern) for pattern in mac_patterns):
+            continue
+        macs.append(mac)
+    return macs
+
+
+def run_backfill(state, date_from_dt, date_to_dt, station_types=None, mac_patterns=None,
+                 concurrency=BACKFILL_CONCURRENCY, batch_size=BATCH_SIZE, shard=None, leases=None):
+    """
+    Backfills modules of given station types for period, up to `concurrency` modules at a time.
+    With shard=(index, count) only modules of that shard are processed, and with a
+    sharding.LeaseManager modules leased by another worker are skipped.
+    Returns (records sent, list of MAC addresses that failed).
+    """
+    if USE_PIVOT_STORE and not refresh_pivot_store(station_types):
+        print("⚠️  Reading from pivot store as of its last refresh")
+
+    index = upload_index.UploadIndex() if USE_CONTENT_DEDUP else None
+    total_sent = 0
+    failed = []
+
+    try:
+        with TRACER.span('backfill_run', date_from=date_from_dt.isoformat(), date_to=date_to_dt.isoformat(),
+                         concurrency=concurrency) as run_span:
+            for station_type in station_types or STATION_CONFIG:
+                print(f"\n{'='*60}")
+                print(f"🔄 Processing {station_type} stations")
+                print(f"{'='*60}")
+
+                with TRACER.span('station_type', station_type=station_type) as station_span:
+                    modules = select_modules(station_type, mac_patterns)
+                    print(f"   Found {len(modules)} modules")
+                    if shard is not None:
+                        modules = sharding.select_shard(modules, *shard)
+                        print(f"   Shard {shard[0]}/{shard[1]}: {len(modules)} modules")
+                    station_span.set_attribute('modules', len(modules))
+                    data_on_server = state.get(f'fetched_data_{station_type.lower()}') or []
+
+                    def run_module(mac):
+                        with leases.lease(mac) if leases else nullcontext(True) as leased:
+                            if not leased:
+                                print(f"   🔒 Skipping {mac} - leased by another worker")
+                                METRICS.count('modules_leased_elsewhere')
+                                return 0, True
+                            return process_leased_module(mac)
+
+                    def process_leased_module(mac):
+                        with METRICS.module(mac), TRACER.span('module', mac=mac, station_type=station_type) as module_span:
+                            sent, ok = process_module(mac, data_on_server, date_from_dt, date_to_dt, index, batch_size)
+                            if USE_ROLLUPS and sent:
+                                ok = send_rollups(mac, date_from_dt, date_to_dt) and ok
+                            module_span.set_attribute('records_sent', sent)
+                            if not ok:
+                                module_span.set_error('upload failed')
+                        return sent, ok
+
+                    with profiling.executor(max(1, concurrency)) as executor:
+                        # Each module runs in copy of current context so spans nest under station span
+                        futures = {executor.submit(contextvars.copy_context().run, run_module, mac): mac for mac in modules}
+                        for future in as_completed(futures):
+                            mac = futures[future]
+                            try:
+                                sent, ok = future.result()
+                            except Exception as e:
+                                print(f"   ❌ {mac} failed: {e}")
+                                sent, ok = 0, False
+                            total_sent += sent
+                            METRICS.count(f'records_sent_{station_type.lower()}', sent)
+                            if not ok:
+                                failed.append(mac)
+
+            run_span.set_attributes(records_sent=total_sent, failed_modules=len(failed))
+    finally:
+        if index is not None:
+            index.close()
+
+    return total_sent, failed
+
+
 def process_and_send_data(state):
     """Processes and sends data in batches"""
     # Check if collections are set up
@@ -584,67 +917,21 @@ def process_and_send_data(state):
         print("\n⚠️ You must first run option 1 (Setup Collections)!")
         return state
 
-    for station_type, config in STATION_CONFIG.items():
-        print(f"\n{'='*60}")
-        print(f"🔄 Processing {station_type} stations")
-        print(f"{'='*60}")
-        
-        modules = fetch_lora_modules(config['prefix'])
-        print(f"   Found {len(modules)} modules")
-        data_on_server = state.get(f'fetched_data_{station_type.lower()}', {})
-
-        for row in modules:
-            mac = row['mac_address']
-            
-            # Skip excluded modules
-            if is_module_excluded(mac):
-                print(f"   ⏭️  Skipping excluded module: {mac}")
-                continue
-            
-            print(f"\n⚙️ Processing module: {mac}")
+    METRICS.reset()
 
-            # Proveri da li postoji station sa tim key-em
-            station_data = next((item for item in data_on_server if item['key'] == mac), None)
-
-            if station_data:
-                print(f"🛰️ Station {mac} found on Nostradamus IoT server:")
-                print(f"   Min timestamp: {station_data['min_timestamp']}")
-                print(f"   Max timestamp: {station_data['max_timestamp']}")
-                print(f"   Total records: {station_data['total_records']}")
-            else:
-                print(f"🛈 Station {mac} not found on Nostradamus IoT server, will fetch all data from {date_from} to {date_to}")
-
-            # Convert date strings to datetime objects
-            date_from_dt = datetime.fromisoformat(date_from.replace('Z', '+00:00')).replace(tzinfo=utc)
-            date_to_dt = datetime.fromisoformat(date_to.replace('Z', '+00:00')).replace(tzinfo=utc)
-
-            if station_data is not None:
-                first_timestamp_dt = datetime.fromisoformat(station_data['min_timestamp'].replace('Z', '+00:00')).replace(tzinfo=utc)
-                last_timestamp_dt = datetime.fromisoformat(station_data['max_timestamp'].replace('Z', '+00:00')).replace(tzinfo=utc)
-            else :
-                first_timestamp_dt = datetime.fromisoformat(date_from.replace('Z', '+00:00')).replace(tzinfo=utc)
-                last_timestamp_dt = datetime.fromisoformat(date_to.replace('Z', '+00:00')).replace(tzinfo=utc)
-
-            if (not station_data) or  ((first_timestamp_dt > date_from_dt) or (last_timestamp_dt < date_to_dt)) :
-                # Fetch data from database
-                data = fetch_module_data(mac, date_from_dt, date_to_dt, first_timestamp_dt, last_timestamp_dt)
-                if not data:
-                    print(f"   ⚠️  No data fetched from local database for {mac}")
-                    continue
-                
-                # Send data
-                collection_id = get_collection_id_for_mac(mac)
-                send_data_in_batches(PROJECT_ID, collection_id, WRITE_KEY, data, batch_size=2000)
-                print(f"   ✅ Data sent to collection {collection_id}")
-            elif (first_timestamp_dt <= date_from_dt) or (last_timestamp_dt >= date_to_dt):
-                print(f"   ⏭️  Skipping {mac} - data is already complete up to {date_to}")
-                continue
+    # Convert date strings to datetime objects
+    date_from_dt = datetime.fromisoformat(date_from.replace('Z', '+00:00')).replace(tzinfo=utc)
+    date_to_dt = datetime.fromisoformat(date_to.replace('Z', '+00:00')).replace(tzinfo=utc)
 
+    _, failed = run_backfill(state, date_from_dt, date_to_dt)
+    state['failed_modules'] = failed
 
-    
     print(f"\n{'='*60}")
-    print("🎉 Processing complete!")
+    print("🎉 Processing complete!" if not failed else f"⚠️  Processing complete, {len(failed)} modules failed: {', '.join(sorted(failed))}")
     print(f"{'='*60}\n")
+
+    METRICS.print_summary()
+    print(f"📈 Metrics written to {METRICS.write_summary('backfill')}\n")
     
     return state
 
@@ -715,12 +1002,9 @@ def get_last_timestamps_for_station(collection_id, station_type):
         return None
 
 
-def get_latest_timestamps_per_key(state):
-    """Fetches latest timestamps for each MAC address"""
-    pis_id = STATION_CONFIG['PIS']['collection_id']
-    rhmz_id = STATION_CONFIG['RHMZ']['collection_id']
-    
-    if not pis_id or not rhmz_id:
+def get_latest_timestamps_per_key(state, station_types=None, mac_patterns=None):
+    """Fetches latest timestamps for each MAC address (optionally limited to station types and MAC patterns)"""
+    if not all(config['collection_id'] for config in STATION_CONFIG.values()):
         print("\n⚠️ You must first run option 1 (Setup Collections)!")
         return state
     
@@ -728,8 +1012,8 @@ def get_latest_timestamps_per_key(state):
     print("🔍 Finding latest timestamps per MAC address")
     print(f"{'='*60}\n")
     
-    for station_type, config in STATION_CONFIG.items():
-        collection_id = config['collection_id']
+    for station_type in station_types or STATION_CONFIG:
+        collection_id = STATION_CONFIG[station_type]['collection_id']
         print(f"📡 {station_type} stations:")
         
         # Fetch all unique keys
@@ -745,6 +1029,8 @@ def get_latest_timestamps_per_key(state):
         
         # Extract unique MAC addresses
         unique_keys = list(set([item['key'] for item in all_keys_data if 'key' in item]))
+        if mac_patterns:
+            unique_keys = [k for k in unique_keys if any(fnmatch.fnmatchcase(k, p) for p in mac_patterns)]
         print(f"   Found {len(unique_keys)} unique MAC addresses\n")
         
         latest_timestamps = {}
@@ -787,14 +1073,178 @@ def get_latest_timestamps_per_key(state):
     return state
 
 
+def reconcile_with_server(state):
+    """Compares bucketed record counts between local database and server, queues mismatched buckets"""
+    if not all(config['collection_id'] for config in STATION_CONFIG.values()):
+        print("\n⚠️ You must first run option 1 (Setup Collections)!")
+        return state
+
+    print(f"\n{'='*60}")
+    print(f"🔎 Reconciling local database with server (per {RECONCILE_BUCKET})")
+    print(f"{'='*60}")
+
+    date_from_dt = datetime.fromisoformat(date_from.replace('Z', '+00:00')).replace(tzinfo=utc)
+    date_to_dt = datetime.fromisoformat(date_to.replace('Z', '+00:00')).replace(tzinfo=utc)
+
+    def statistics(collection_id, attribute, stat, filters, interval):
+        return get_statistics(PROJECT_ID, collection_id, READ_KEY, attribute, stat, filters=filters, interval=interval)
+
+    # Quarantined rows are never sent - counting them locally would queue their buckets on every run
+    quarantined = validation.read_quarantined(VALIDATOR.path) if USE_VALIDATION else {}
+
+    queued = []
+    failed = []
+    for station_type, config in STATION_CONFIG.items():
+        modules = [row['mac_address'] for row in fetch_lora_modules(station_type)
+                   if not is_module_excluded(row['mac_address'])]
+        print(f"\n📡 {station_type}: {len(modules)} modules")
+        if not modules:
+            continue
+
+        conn = psycopg2.connect(**DB_CONFIG)
+        try:
+            local_counts = reconcile.fetch_local_counts(conn, modules, config['sensors'], date_from_dt, date_to_dt, RECONCILE_BUCKET)
+        finally:
+            conn.close()
+        reconcile.subtract_quarantined(local_counts, quarantined, date_from_dt, date_to_dt, RECONCILE_BUCKET)
+
+        for mac in modules:
+            try:
+                server_counts = reconcile.fetch_server_counts(statistics, config['collection_id'], mac, date_from_dt, date_to_dt, RECONCILE_BUCKET)
+            except ValueError as e:
+                # Unknown server counts must not look like an empty server (buckets would be re-sent without delete)
+                print(f"   ❌ {mac}: server counts unavailable, skipped ({e})")
+                failed.append(mac)
+                continue
+            mismatched = reconcile.diff_counts(local_counts.get(mac, {}), server_counts)
+            if mismatched:
+                print(f"   ⚠️  {mac}: {len(mismatched)} mismatched buckets")
+            else:
+                print(f"   ✅ {mac}: in sync")
+            for bucket, local_count, server_count in mismatched:
+                queued.append(reconcile.make_queue_entry(station_type, config['collection_id'], mac, bucket,
+                                                         RECONCILE_BUCKET, local_count, server_count))
+
+    reconcile.write_queue(queued)
+    state['reconcile_queue'] = reconcile.read_queue()
+    print(f"\n📝 Queued {len(queued)} buckets for re-extraction ({reconcile.DEFAULT_QUEUE_PATH})")
+    if failed:
+        print(f"❌ {len(failed)} modules not reconciled: {', '.join(sorted(failed))}")
+    print(f"{'='*60}\n")
+    return state
+
+
+def process_reconcile_queue(state):
+    """Re-extracts and resends buckets from reconciliation queue"""
+    entries = reconcile.read_queue()
+    print(f"\n🔁 Processing {len(entries)} queued buckets")
+
+    remaining = []
+    for entry in entries:
+        mac = entry['key']
+        bucket_start = datetime.fromisoformat(entry['bucket_start'].replace('Z', '+00:00'))
+        bucket_end = datetime.fromisoformat(entry['bucket_end'].replace('Z', '+00:00'))
+        print(f"\n⚙️  {mac} {entry['bucket_start']} (local {entry['local_count']}, server {entry['server_count'] if entry['server_count'] is not None else '?'})")
+
+        if entry['server_count'] != 0:
+            # Remove partial (or, for changed rows, outdated) server copy so bucket is not duplicated
+            timestamp_from, timestamp_to = bucket_bounds(bucket_start.timestamp(), (bucket_end - bucket_start).total_seconds())
+            if delete_data(PROJECT_ID, entry['collection_id'], MASTER_KEY, key=mac,
+                           timestamp_from=timestamp_from, timestamp_to=timestamp_to) is None:
+                remaining.append(entry)
+                continue
+
+        # Query bounds are exclusive, so start just before bucket start
+        range_start = bucket_start - timedelta(microseconds=1)
+        with memory_budget.BUDGET.admit() as admission:
+            data = fetch_module_batch(mac, range_start, bucket_end, range_start, bucket_end)
+            admission.resize(data.nbytes)
+            sent = not data or send_data_in_batches(PROJECT_ID, entry['collection_id'], WRITE_KEY, data, batch_size=2000)
+        if not sent:
+            # Some batches may have been sent - unknown server count makes the retry delete first
+            remaining.append({**entry, 'server_count': None})
+        elif USE_ROLLUPS:
+            # Outside the admission above, rollups fetch (and wait for budget) on their own
+            send_rollups(mac, bucket_start, bucket_end)
+
+    reconcile.rewrite_queue(remaining)
+    state['reconcile_queue'] = remaining
+    print(f"\n✅ Reconciliation queue processed, {len(remaining)} buckets remaining\n")
+    return state
+
+
+def track_changes(state, station_types=None, mac_patterns=None, cursor=CHANGE_CURSOR, dry_run=False):
+    """
+    Queues buckets with rows inserted or updated since last run (by insertion-order
+    watermark, not measurement time) and re-sends them through reconcile queue.
+    Returns number of buckets still in queue afterwards.
+    """
+    if not all(config['collection_id'] for config in STATION_CONFIG.values()):
+        print("\n⚠️ You must first run option 1 (Setup Collections)!")
+        return None
+
+    print(f"\n{'='*60}")
+    print(f"🧾 Tracking changed rows ({cursor} cursor, per {CHANGE_BUCKET})")
+    print(f"{'='*60}")
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        change_tracking.ensure_schema(conn)
+        queued = []
+        watermarks = {}
+        for station_type in station_types or STATION_CONFIG:
+            config = STATION_CONFIG[station_type]
+            consumer = f"{cursor}:{station_type}"
+            since = change_tracking.read_watermark(conn, consumer)
+            watermarks[consumer] = change_tracking.current_watermark(conn, cursor)
+            if since is None:
+                print(f"\n📍 {station_type}: first run, changes are tracked from now on")
+                continue
+
+            modules = [mac for mac in select_modules(station_type, mac_patterns) if not is_module_excluded(mac)]
+            changed = change_tracking.fetch_changed_buckets(conn, since, modules, config['sensors'], cursor, CHANGE_BUCKET)
+            print(f"\n📡 {station_type}: {sum(len(b) for b in changed.values())} changed buckets in {len(changed)} modules")
+            for mac, buckets in sorted(changed.items()):
+                print(f"   ✏️  {mac}: {len(buckets)} buckets, {sum(buckets.values())} rows")
+                for bucket, rows in sorted(buckets.items()):
+                    # Server count unknown - bucket is deleted on server before it is re-sent
+                    queued.append(reconcile.make_queue_entry(station_type, config['collection_id'], mac, bucket,
+                                                             CHANGE_BUCKET, rows, None))
+
+        if dry_run:
+            print(f"\n🔍 Dry run - {len(queued)} buckets would be re-sent, watermarks unchanged")
+            return len(queued)
+
+        # Queue is durable, so watermarks can move on before buckets are sent
+        reconcile.write_queue(queued)
+        for consumer, watermark in watermarks.items():
+            change_tracking.write_watermark(conn, consumer, watermark)
+    finally:
+        conn.close()
+
+    print(f"\n📝 Queued {len(queued)} changed buckets ({reconcile.DEFAULT_QUEUE_PATH})")
+    state = process_reconcile_queue(state)
+    return len(state['reconcile_queue'])
+
+
+def track_changes_menu(state):
+    track_changes(state)
+    return state
+
+
 def delete_menu(state):
     """Menu for deleting collections"""
+    # One option per station type, bulk delete comes after them
+    delete_options = {str(i): station_type for i, station_type in enumerate(STATION_CONFIG, 1)}
+    bulk_option = str(len(delete_options) + 1)
+
     while True:
         print("="*60)
         print("🤖 NOSTRADAMUS Data Processor - Interactive Menu")
         print("="*60)
-        print("1. Delete PIS collection")
-        print("2. Delete RHMZ collection")
+        for option, station_type in delete_options.items():
+            print(f"{option}. Delete {station_type} collection")
+        print(f"{bulk_option}. Bulk delete data by MAC addresses and/or time window")
         print("R. Return to main menu")
         print("="*60)
         
@@ -803,25 +1253,48 @@ def delete_menu(state):
             print("\n↩️  Returning to main menu...")
             break
 
-        elif choice == '1':
+        elif choice in delete_options:
+            station_type = delete_options[choice]
             print(f"\n{'='*60}")
-            print("📊 DELETING PIS COLLECTION")
+            print(f"📊 DELETING {station_type} COLLECTION")
             print(f"{'='*60}")
-            if STATION_CONFIG['PIS']['collection_id'] is None:
-                print("❌ PIS collection ID is not set. Cannot delete.")        
+            if STATION_CONFIG[station_type]['collection_id'] is None:
+                print(f"❌ {station_type} collection ID is not set. Cannot delete.")
             else:
-                delete_collection(PROJECT_ID, MASTER_KEY, STATION_CONFIG['PIS']['collection_id'])
-                state['pis_collection_id'] = None
+                delete_collection(PROJECT_ID, MASTER_KEY, STATION_CONFIG[station_type]['collection_id'])
+                state[f'{station_type.lower()}_collection_id'] = None
 
-        elif choice == '2':
+        elif choice == bulk_option:
             print(f"\n{'='*60}")
-            print("📊 DELETING RHMZ COLLECTION")
+            print("📊 BULK DELETE DATA")
             print(f"{'='*60}")
-            if STATION_CONFIG['RHMZ']['collection_id'] is None:
-                print("❌ RHMZ collection ID is not set. Cannot delete.")
-            else:
-                delete_collection(PROJECT_ID, MASTER_KEY, STATION_CONFIG['RHMZ']['collection_id'])
-                state['rhmz_collection_id'] = None
+            station_type = input(f"➤ Station type ({'/'.join(STATION_CONFIG)}): ").strip().upper()
+            if station_type not in STATION_CONFIG or STATION_CONFIG[station_type]['collection_id'] is None:
+                print(f"❌ Unknown station type or collection not set: {station_type}")
+                continue
+            keys = [k.strip() for k in input("➤ MAC addresses (comma separated, empty = all): ").split(',') if k.strip()]
+            window_from = input("➤ Timestamp from (e.g. 2022-01-01T00:00:00Z, empty = none): ").strip()
+            window_to = input("➤ Timestamp to (e.g. 2022-12-31T23:59:59Z, empty = none): ").strip()
+
+            windows = None
+            if window_from and window_to:
+                try:
+                    windows = [(parse_timestamp_arg(window_from), parse_timestamp_arg(window_to))]
+                except argparse.ArgumentTypeError as e:
+                    print(f"❌ {e}")
+                    continue
+                if windows[0][0] >= windows[0][1]:
+                    print("❌ Timestamp from must be before timestamp to.")
+                    continue
+            elif window_from or window_to:
+                print("❌ Both timestamps are required for time window delete.")
+                continue
+
+            if not keys and not windows:
+                print("❌ Select MAC addresses and/or time window (use options 1/2 to delete whole collection).")
+                continue
+
+            bulk_delete_data(PROJECT_ID, STATION_CONFIG[station_type]['collection_id'], MASTER_KEY, keys, windows)
 
         else:
             print(f"\n❌ Unknown option: {choice}\n")
@@ -830,12 +1303,7 @@ def delete_menu(state):
 
 def interactive_menu():
     """Interactive menu"""
-    state = {
-        'pis_collection_id': None,
-        'rhmz_collection_id': None,
-        'fetched_data_pis': None,
-        'fetched_data_rhmz': None,
-    }
+    state = new_state()
 
     menu_actions = {
         '1': setup_collections,
@@ -843,18 +1311,24 @@ def interactive_menu():
         '3': process_and_send_data,
         '5': get_latest_timestamps_per_key,
         '6': delete_menu,
+        '7': reconcile_with_server,
+        '8': process_reconcile_queue,
+        '9': track_changes_menu,
     }
 
     while True:
         print("="*60)
         print("🤖 NOSTRADAMUS Data Processor - Interactive Menu")
         print("="*60)
-        print("1. Setup/Check PIS & RHMZ collections")
+        print(f"1. Setup/Check {' & '.join(STATION_CONFIG)} collections")
         print("2. Fetch sample data (requires step 1)")
         print("3. Process and send all data (requires step 1)")
         print("4. Display current state (requires step 1)")
         print("5. Find latest timestamps per MAC address (requires step 1)")
         print("6. Delete selected collections (requires step 1)")
+        print("7. Reconcile local DB with server - find gaps (requires step 1)")
+        print("8. Re-send queued gap buckets (requires step 7)")
+        print("9. Re-send late-arriving/corrected rows since last run (requires step 1)")
         print("Q. Exit")
         print("="*60)
         
@@ -912,7 +1386,9 @@ def get_statistics(project_id, collection_id, read_key, attribute, stat=None, fi
     if filters:
         params["filters"] = json.dumps(filters)
 
-    response = requests.get(url, headers=headers, params=params)
+    with METRICS.timer(SERVER_LOOKUP) as t:
+        response = api.get(url, headers=headers, params=params)
+        t.add(nbytes=len(response.content), status=response.status_code)
     if response.status_code == 200:
         stats = response.json()
         # print(f"✅ {stat} for {attribute}: {stats}")
@@ -922,8 +1398,382 @@ def get_statistics(project_id, collection_id, read_key, attribute, stat=None, fi
         return {}
 
 
-def main():
-    """Main function - launches menu"""
+def new_state():
+    """Returns empty state shared by menu actions"""
+    state = {}
+    for station_type in STATION_CONFIG:
+        state[f'{station_type.lower()}_collection_id'] = None
+        state[f'fetched_data_{station_type.lower()}'] = None
+    return state
+
+
+def parse_timestamp_arg(value):
+    """argparse type for ISO timestamps (e.g. 2022-01-01T00:00:00Z)"""
+    try:
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid timestamp: {value!r} (expected e.g. 2022-01-01T00:00:00Z)")
+    return dt.replace(tzinfo=utc) if dt.tzinfo is None else dt.astimezone(utc)
+
+
+def check_database():
+    """Returns True if local database is reachable"""
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+    except psycopg2.Error as e:
+        print(f"❌ Database connection failed: {e}")
+        return False
+    conn.close()
+    return True
+
+
+def prepare_collections(state):
+    """Runs collection setup, returns EXIT_OK or EXIT_NOT_READY"""
+    setup_collections(state)
+    missing = [station_type for station_type, config in STATION_CONFIG.items() if not config['collection_id']]
+    if missing:
+        print(f"❌ Collections not available: {', '.join(missing)}")
+        return EXIT_NOT_READY
+    return EXIT_OK
+
+
+def cli_setup(args, state):
+    return prepare_collections(state)
+
+
+def cli_backfill(args, state):
+    code = prepare_collections(state)
+    if code != EXIT_OK:
+        return code
+    if not check_database():
+        return EXIT_DB_ERROR
+
+    date_from_dt = args.date_from or parse_timestamp_arg(date_from)
+    date_to_dt = args.date_to or parse_timestamp_arg(date_to)
+    if date_from_dt >= date_to_dt:
+        print("❌ --from must be before --to")
+        return EXIT_USAGE
+
+    print(f"📅 Backfilling {date_from_dt.isoformat()} - {date_to_dt.isoformat()} "
+          f"({args.concurrency} parallel modules, batch size {args.batch_size})")
+    METRICS.reset()
+    leases = None
+    if sharding.leases_enabled(args):
+        leases = sharding.LeaseManager(DB_CONFIG, args.worker_id)
+        print(f"🔒 Worker {args.worker_id}, shard {args.shard_index}/{args.shard_count}")
+    try:
+        sent, failed = run_backfill(state, date_from_dt, date_to_dt, args.station_types, args.macs,
+                                    args.concurrency, args.batch_size,
+                                    (args.shard_index, args.shard_count), leases)
+    finally:
+        if leases is not None:
+            leases.close()
+
+    METRICS.print_summary()
+    print(f"📈 Metrics written to {METRICS.write_summary('backfill')}")
+    if failed:
+        print(f"❌ {len(failed)} modules failed: {', '.join(sorted(failed))}")
+        return EXIT_FAILED
+    print(f"🎉 Backfill complete, {sent} records sent")
+    return EXIT_OK
+
+
+def cli_status(args, state):
+    code = prepare_collections(state)
+    if code != EXIT_OK:
+        return code
+
+    status = {}
+    for station_type in args.station_types or STATION_CONFIG:
+        on_server = {
+            item['key']: item for item in state.get(f'fetched_data_{station_type.lower()}') or []
+            if not args.macs or any(fnmatch.fnmatchcase(item['key'], p) for p in args.macs)
+        }
+        local = select_modules(station_type, args.macs)
+        status[station_type] = {
+            'collection_id': STATION_CONFIG[station_type]['collection_id'],
+            'modules': [
+                {'key': key, 'min_timestamp': item.get('min_timestamp'), 'max_timestamp': item.get('max_timestamp'),
+                 'total_records': item.get('total_records')}
+                for key, item in sorted(on_server.items())
+            ],
+            'missing_on_server': sorted(mac for mac in local if mac not in on_server),
+        }
+
+    if args.json:
+        print(json.dumps(status, ensure_ascii=False, indent=2))
+        return EXIT_OK
+
+    for station_type, entry in status.items():
+        print(f"\n📁 {station_type} ({entry['collection_id']}): {len(entry['modules'])} modules on server")
+        for module in entry['modules']:
+            print(f"   {module['key']:<30} {module['min_timestamp']} - {module['max_timestamp']} "
+                  f"({module['total_records']} records)")
+        if entry['missing_on_server']:
+            print(f"   ⚠️  Not on server yet: {', '.join(entry['missing_on_server'])}")
+    print()
+    return EXIT_OK
+
+
+def cli_latest_timestamps(args, state):
+    code = prepare_collections(state)
+    if code != EXIT_OK:
+        return code
+    get_latest_timestamps_per_key(state, args.station_types, args.macs)
+    return EXIT_OK
+
+
+def cli_delete(args, state):
+    code = prepare_collections(state)
+    if code != EXIT_OK:
+        return code
+
+    collection_id = STATION_CONFIG[args.station_type]['collection_id']
+    if args.collection:
+        if args.macs or args.date_from or args.date_to:
+            print("❌ --collection deletes whole collection and cannot be combined with --mac/--from/--to")
+            return EXIT_USAGE
+        if not args.yes:
+            print(f"❌ Refusing to delete {args.station_type} collection without --yes")
+            return EXIT_USAGE
+        delete_collection(PROJECT_ID, MASTER_KEY, collection_id)
+        return EXIT_OK
+
+    if bool(args.date_from) != bool(args.date_to):
+        print("❌ Both --from and --to are required for time window delete")
+        return EXIT_USAGE
+    windows = [(args.date_from, args.date_to)] if args.date_from else None
+
+    keys = None
+    if args.macs:
+        # Patterns are expanded against keys stored on server
+        server_keys = [item['key'] for item in state.get(f'fetched_data_{args.station_type.lower()}') or []]
+        keys = sorted({key for key in server_keys if any(fnmatch.fnmatchcase(key, p) for p in args.macs)} |
+                      {p for p in args.macs if not any(c in p for c in '*?[')})
+    if not keys and not windows:
+        print("❌ Select --mac and/or --from/--to (or --collection to delete whole collection)")
+        return EXIT_USAGE
+    if not args.yes:
+        print(f"❌ Refusing to delete {len(keys or [])} keys / {len(windows or [])} windows from {args.station_type} without --yes")
+        return EXIT_USAGE
+
+    failed = bulk_delete_data(PROJECT_ID, collection_id, MASTER_KEY, keys, windows, max_workers=args.concurrency)
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def cli_changes(args, state):
+    code = prepare_collections(state)
+    if code != EXIT_OK:
+        return code
+    if not check_database():
+        return EXIT_DB_ERROR
+
+    METRICS.reset()
+    remaining = track_changes(state, args.station_types, args.macs, args.cursor, args.dry_run)
+    if args.dry_run:
+        return EXIT_OK
+    METRICS.print_summary()
+    print(f"📈 Metrics written to {METRICS.write_summary('changes')}")
+    if remaining:
+        print(f"❌ {remaining} buckets could not be re-sent and stay queued")
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def cli_pivot(args, state):
+    if not check_database():
+        return EXIT_DB_ERROR
+    METRICS.reset()
+    if not refresh_pivot_store(args.station_types, args.cursor, args.rebuild):
+        return EXIT_FAILED
+    if not USE_PIVOT_STORE:
+        print("ℹ️  Set USE_PIVOT_STORE = True in main.py/live.py to read from the pivot store")
+    return EXIT_OK
+
+
+def cli_export(args, state):
+    formats = args.formats or EXPORT_FORMATS
+    missing = export.missing_dependencies(formats)
+    if missing:
+        print(f"❌ Export formats {', '.join(formats)} need: {', '.join(missing)} (pip install {' '.join(missing)})")
+        return EXIT_USAGE
+    if not check_database():
+        return EXIT_DB_ERROR
+
+    exporter = export.Exporter(args.output, formats)
+    date_from_dt = args.date_from or parse_timestamp_arg(date_from)
+    date_to_dt = args.date_to or datetime.now(utc)
+    METRICS.reset()
+    failed = []
+    total = 0
+    for station_type in args.station_types or STATION_CONFIG:
+        for mac in select_modules(station_type, args.macs):
+            with METRICS.module(mac):
+                try:
+                    rows = export_module_data(mac, exporter, date_from_dt, date_to_dt)
+                except psycopg2.Error as e:
+                    print(f"   ❌ {mac}: {e}")
+                    failed.append(mac)
+                    continue
+            total += rows
+            print(f"   📦 {mac}: {rows} rows exported")
+    METRICS.print_summary()
+    print(f"📈 Metrics written to {METRICS.write_summary('export')}")
+    print(f"📦 {total} rows exported to {args.output} ({', '.join(formats)})")
+    if failed:
+        print(f"❌ {len(failed)} modules failed: {', '.join(sorted(failed))}")
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def cli_rollups(args, state):
+    code = prepare_collections(state)
+    if code != EXIT_OK:
+        return code
+    if not check_database():
+        return EXIT_DB_ERROR
+    setup_rollup_collections(get_collections(PROJECT_ID, READ_KEY))
+    missing = [f"{station_type} {interval}" for station_type, config in STATION_CONFIG.items()
+               for interval in ROLLUP_INTERVALS if not config['rollup_collection_ids'].get(interval)]
+    if missing:
+        print(f"❌ Rollup collections not available: {', '.join(missing)}")
+        return EXIT_NOT_READY
+
+    date_from_dt = args.date_from or parse_timestamp_arg(date_from)
+    date_to_dt = args.date_to or parse_timestamp_arg(date_to)
+    METRICS.reset()
+    failed = []
+    for station_type in args.station_types or STATION_CONFIG:
+        for mac in select_modules(station_type, args.macs):
+            print(f"\n⚙️ Rollups of {mac}")
+            with METRICS.module(mac):
+                if not send_rollups(mac, date_from_dt, date_to_dt):
+                    failed.append(mac)
+    METRICS.print_summary()
+    print(f"📈 Metrics written to {METRICS.write_summary('rollups')}")
+    if failed:
+        print(f"❌ {len(failed)} modules failed: {', '.join(sorted(failed))}")
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+CLI_COMMANDS = {
+    'setup': cli_setup,
+    'backfill': cli_backfill,
+    'status': cli_status,
+    'latest-timestamps': cli_latest_timestamps,
+    'delete': cli_delete,
+    'changes': cli_changes,
+    'pivot': cli_pivot,
+    'rollups': cli_rollups,
+    'export': cli_export,
+}
+
+
+def parse_args(argv=None):
+    """Command line arguments - without subcommand the interactive menu is started"""
+    parser = argparse.ArgumentParser(
+        description="Nostradamus IoT historical data processor",
+        epilog="Exit codes: 0 ok, 1 partial failure, 2 usage, 3 collections not ready, "
+               "4 database unreachable, 5 API unreachable, 130 interrupted."
+    )
+    parser.add_argument('--profile', default=os.environ.get(profiling.PROFILE_ENV),
+                        help="profile run (cProfile + tracemalloc) and dump results into this directory")
+    parser.add_argument('--trace-file', help="append tracing spans as JSON lines to this file")
+    parser.add_argument('--otlp-endpoint', help="export tracing spans to OTLP/HTTP collector (e.g. http://localhost:4318)")
+    parser.add_argument('--rate-limits', type=rate_limit.rate_limits_argument,
+                        help=f"API rate limits as endpoint=rate[/burst],... (default ${rate_limit.RATE_LIMITS_ENV} or built-in)")
+    parser.add_argument('--memory-budget', type=memory_budget.size_argument,
+                        help=f"max bytes of data in flight, e.g. 512M, 0 = off (default ${memory_budget.MEMORY_BUDGET_ENV} or off)")
+
+    filters = argparse.ArgumentParser(add_help=False)
+    filters.add_argument('--station-type', dest='station_types', action='append', choices=list(STATION_CONFIG),
+                         help="limit to station type (repeatable, default: all)")
+    filters.add_argument('--mac', dest='macs', action='append',
+                         help="limit to MAC address or shell-style pattern, e.g. 'PIS_*' (repeatable)")
+
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.add_parser('setup', help="check/create collections of all station types")
+
+    backfill = commands.add_parser('backfill', parents=[filters], help="send local data for period to server")
+    backfill.add_argument('--from', dest='date_from', type=parse_timestamp_arg, help=f"period start (default {date_from})")
+    backfill.add_argument('--to', dest='date_to', type=parse_timestamp_arg, help=f"period end (default {date_to})")
+    backfill.add_argument('--concurrency', type=int, default=BACKFILL_CONCURRENCY, help="modules processed in parallel")
+    backfill.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="records per upload request")
+    sharding.add_arguments(backfill)
+
+    status = commands.add_parser('status', parents=[filters], help="show per-module data ranges on server")
+    status.add_argument('--json', action='store_true', help="print status as JSON")
+
+    commands.add_parser('latest-timestamps', parents=[filters], help="show latest timestamp per MAC address on server")
+
+    changes = commands.add_parser('changes', parents=[filters],
+                                  help="re-send buckets with rows inserted or corrected since last run")
+    changes.add_argument('--cursor', choices=change_tracking.CURSORS, default=CHANGE_CURSOR,
+                         help=f"xmin: inserts and updates (PostgreSQL 13+), id: inserts only, index-friendly (default {CHANGE_CURSOR})")
+    changes.add_argument('--dry-run', action='store_true', help="only list changed buckets, do not send or move watermark")
+
+    rollups_command = commands.add_parser('rollups', parents=[filters],
+                                          help="recompute hourly/daily rollups for period and replace them on server")
+    rollups_command.add_argument('--from', dest='date_from', type=parse_timestamp_arg, help=f"period start (default {date_from})")
+    rollups_command.add_argument('--to', dest='date_to', type=parse_timestamp_arg, help=f"period end (default {date_to})")
+
+    export_command = commands.add_parser('export', parents=[filters],
+                                         help="append rows newer than last export to local partitioned files (see export.py)")
+    export_command.add_argument('--from', dest='date_from', type=parse_timestamp_arg,
+                                help=f"start of first export of a module (default {date_from}), later runs continue from last export")
+    export_command.add_argument('--to', dest='date_to', type=parse_timestamp_arg, help="period end (default now)")
+    export_command.add_argument('--format', dest='formats', action='append', choices=list(export.FORMATS),
+                                help=f"output format (repeatable, default {', '.join(EXPORT_FORMATS)})")
+    export_command.add_argument('--output', default=EXPORT_DIR, help=f"export directory (default {EXPORT_DIR})")
+
+    pivot = commands.add_parser('pivot', help="create/refresh wide measurement tables per station type (see pivot_store.py)")
+    pivot.add_argument('--station-type', dest='station_types', action='append', choices=list(STATION_CONFIG),
+                       help="limit to station type (repeatable, default: all)")
+    pivot.add_argument('--cursor', choices=change_tracking.CURSORS, default=PIVOT_CURSOR,
+                       help=f"change cursor of incremental refresh, see 'changes' (default {PIVOT_CURSOR})")
+    pivot.add_argument('--rebuild', action='store_true', help="rebuild tables from scratch (e.g. after routing changes)")
+
+    delete = commands.add_parser('delete', help="delete data by MAC and/or time window, or whole collection")
+    delete.add_argument('--station-type', required=True, choices=list(STATION_CONFIG))
+    delete.add_argument('--mac', dest='macs', action='append', help="MAC address or pattern to delete (repeatable)")
+    delete.add_argument('--from', dest='date_from', type=parse_timestamp_arg, help="window start")
+    delete.add_argument('--to', dest='date_to', type=parse_timestamp_arg, help="window end")
+    delete.add_argument('--collection', action='store_true', help="delete whole collection")
+    delete.add_argument('--concurrency', type=int, default=DELETE_CONCURRENCY, help="parallel delete requests")
+    delete.add_argument('--yes', action='store_true', help="confirm deletion")
+
+    args = parser.parse_args(argv)
+    for name in ('concurrency', 'batch_size'):
+        if getattr(args, name, 1) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    if args.command == 'backfill':
+        sharding.validate_arguments(parser, args)
+    if args.command == 'delete' and args.date_from and args.date_to and args.date_from >= args.date_to:
+        parser.error("--from must be before --to")
+    return args
+
+
+def run_command(args):
+    """Runs CLI subcommand, returns exit code"""
+    state = new_state()
+    try:
+        return CLI_COMMANDS[args.command](args, state)
+    except KeyboardInterrupt:
+        print("\n⛔ Interrupted")
+        return EXIT_INTERRUPTED
+    except psycopg2.OperationalError as e:
+        print(f"❌ Database error: {e}")
+        return EXIT_DB_ERROR
+    except (api.ApiUnavailable, api.ApiTimeout) as e:
+        print(f"❌ API unreachable: {e}")
+        return EXIT_API_ERROR
+
+
+def main(argv=None):
+    """Main function - runs CLI subcommand or launches menu, returns exit code"""
+    args = parse_args(argv)
+
     print("\n" + "="*60)
     print("🚀 NOSTRADAMUS IoT Data Processor")
     print("="*60)
@@ -931,9 +1781,25 @@ def main():
     print(f"🗄️  Database: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['dbname']}")
     print(f"🌐 API: {BASE_URL}")
     print("="*60 + "\n")
-    
-    interactive_menu()
+
+    if args.rate_limits is not None:
+        rate_limit.LIMITER.configure(args.rate_limits)
+    if args.memory_budget is not None:
+        memory_budget.BUDGET.configure(args.memory_budget)
+    print(f"🚦 API rate limits: {rate_limit.LIMITER.describe()}")
+    print(f"🧠 Memory budget: {memory_budget.BUDGET.describe()}\n")
+    if TRACER.configure(args.trace_file, args.otlp_endpoint):
+        print("🧵 Tracing enabled\n")
+
+    session = profiling.start(args.profile, name=args.command or 'main')
+    try:
+        if args.command is None:
+            interactive_menu()
+            return EXIT_OK
+        return run_command(args)
+    finally:
+        profiling.stop(session)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Global byte budget for data held in memory between database and server.
+Every stage that holds module data reserves its size and releases it when
+the data is gone: fetched module batches (the outbox), batches streamed out
+of COPY and serialized request bodies. Producers - the stages that bring new
+data in - wait while the budget is exhausted; stages that only move data
+already held towards the server never wait (they would deadlock against
+their own input).
+
+Admission and reservation are one step under the budget's lock: a module
+fetch is admitted with an estimate (largest batch seen so far, the whole
+budget until the first one is known) already reserved, and replaces it with
+the real size once fetched. Concurrent producers therefore see each other's
+reservations, and the budget is overshot by at most one item whose size
+exceeds the estimate.
+
+Configured as NOSTRADAMUS_MEMORY_BUDGET="512M" (or --memory-budget); 0 turns
+it off.
+"""
+
+import argparse
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from instrumentation import METRICS, MEMORY_WAIT
+from lazy import lazy_import
+
+asyncio = lazy_import('asyncio')
+
+MEMORY_BUDGET_ENV = 'NOSTRADAMUS_MEMORY_BUDGET'
+POLL_SECONDS = 0.05  # Async waiters poll instead of blocking the event loop
+
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(value):
+    """Parses "512M", "2G", "65536" into bytes"""
+    text = str(value).strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in UNITS else ''
+    try:
+        return int(float(text[:len(text) - len(unit)]) * UNITS[unit])
+    except ValueError:
+        raise ValueError(f"Invalid memory size '{value}' (expected bytes or number with K/M/G).")
+
+
+def size_argument(value):
+    """argparse type for --memory-budget"""
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def format_size(nbytes):
+    for unit in ('G', 'M', 'K'):
+        if nbytes >= UNITS[unit]:
+            return f"{nbytes / UNITS[unit]:.1f} {unit}B"
+    return f"{nbytes} B"
+
+
+class Admission:
+    """Budget held by one admitted producer - its estimate until resize() sets the real size"""
+
+    def __init__(self, budget, nbytes):
+        self.budget = budget
+        self.nbytes = nbytes
+
+    def resize(self, nbytes):
+        self.budget.adjust(nbytes - self.nbytes, item_size=nbytes)
+        self.nbytes = nbytes
+
+
+class MemoryBudget:
+    """Bytes in flight across all threads of the process, with blocking admission"""
+
+    def __init__(self, limit=None):
+        self.condition = threading.Condition()
+        self.used = 0
+        self.peak = 0
+        self.largest = 0  # Largest admitted item so far, estimate for the next admission
+        self.configure(limit)
+
+    def configure(self, limit=None):
+        """Sets limit in bytes (None reads $NOSTRADAMUS_MEMORY_BUDGET, 0 disables) - active holds stay counted"""
+        if limit is None:
+            limit = parse_size(os.environ.get(MEMORY_BUDGET_ENV) or 0)
+        with self.condition:
+            self.limit = limit
+            self.peak = self.used
+            self.condition.notify_all()
+
+    def exhausted(self):
+        return bool(self.limit) and self.used >= self.limit
+
+    def estimate(self):
+        # Until one item was seen, first admission takes whole budget so sizes are learned one at a time
+        return self.largest or self.limit
+
+    def wait_locked(self):
+        """Blocks while budget is exhausted, caller holds self.condition - returns seconds waited or None"""
+        if not self.exhausted():
+            return None
+        start = time.perf_counter()
+        while self.exhausted():
+            self.condition.wait()
+        return time.perf_counter() - start
+
+    def add(self, nbytes):
+        """Adds nbytes to used, caller holds self.condition"""
+        self.used += nbytes
+        self.peak = max(self.peak, self.used)
+
+    def adjust(self, delta, item_size=0):
+        with self.condition:
+            self.add(delta)
+            self.largest = max(self.largest, item_size)
+            if delta < 0:
+                self.condition.notify_all()
+
+    def reserve(self, nbytes, block=True):
+        """Adds nbytes to data in flight - producers (block=True) wait for budget first, in the same step"""
+        with self.condition:
+            waited = self.wait_locked() if block else None
+            self.add(nbytes)
+        if waited is not None:
+            METRICS.record(MEMORY_WAIT, waited)
+
+    def release(self, nbytes):
+        with self.condition:
+            self.used = max(0, self.used - nbytes)
+            self.condition.notify_all()
+
+    @contextmanager
+    def hold(self, nbytes, block=True):
+        """Reserves nbytes for the duration of the block"""
+        self.reserve(nbytes, block)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    @contextmanager
+    def admit(self):
+        """
+        Admits one producer for the duration of the block: waits while budget is
+        exhausted and reserves the estimate in the same step, yields Admission
+        whose resize() swaps the estimate for the fetched size
+        """
+        with self.condition:
+            waited = self.wait_locked()
+            estimate = self.estimate()
+            self.add(estimate)
+        if waited is not None:
+            METRICS.record(MEMORY_WAIT, waited)
+        admission = Admission(self, estimate)
+        try:
+            yield admission
+        finally:
+            self.release(admission.nbytes)
+
+    @asynccontextmanager
+    async def admit_async(self):
+        """Like admit, but sleeps without blocking the event loop"""
+        start = None
+        while True:
+            with self.condition:
+                estimate = self.estimate()
+                if not self.exhausted():
+                    self.add(estimate)
+                    break
+            if start is None:
+                start = time.perf_counter()
+            await asyncio.sleep(POLL_SECONDS)
+        if start is not None:
+            METRICS.record(MEMORY_WAIT, time.perf_counter() - start)
+        admission = Admission(self, estimate)
+        try:
+            yield admission
+        finally:
+            self.release(admission.nbytes)
+
+    def describe(self):
+        return format_size(self.limit) if self.limit else 'off'
+
+
+BUDGET = MemoryBudget()
@@ -0,0 +1,127 @@
+"""
+Cached module discovery for all station types.
+One query reads lora_module (with name and location), modules are assigned to
+station types by the same routing as the sync (anchored prefix/suffix from
+stations.json, then the default station type), and the result is cached in
+data/module_cache.json. Later refreshes only fetch modules
+added or changed since the last check (xmin watermark); a changed module count
+(deleted module), another database or a day-old cache triggers a full reload.
+"""
+
+import json
+import os
+import time
+
+from stations import REGISTRY
+
+DEFAULT_CACHE_PATH = os.path.join('data', 'module_cache.json')
+FULL_REFRESH_SECONDS = 24 * 3600  # Full reload at least once a day
+MIN_REFRESH_SECONDS = 60  # Repeated lookups within a run reuse the catalog
+
+SNAPSHOT_SQL = '''
+    SELECT
+        pg_snapshot_xmin(pg_current_snapshot())::text::bigint,
+        pg_snapshot_xmax(pg_current_snapshot())::text::bigint,
+        (SELECT COUNT(*) FROM lora_module),
+        concat_ws(':', inet_server_addr(), inet_server_port(), current_database())
+'''
+
+MODULES_QUERY = '''
+    SELECT DISTINCT ON (m.mac_address)
+        m.mac_address,
+        m.name,
+        ROUND(ST_Y(ml.location::geometry)::decimal, 5)::float8 AS latitude,
+        ROUND(ST_X(ml.location::geometry)::decimal, 5)::float8 AS longitude
+    FROM lora_module m
+    LEFT JOIN lora_module_location ml ON m.mac_address = ml.mac_address_lora_module
+    {where}
+    ORDER BY m.mac_address
+'''
+
+# Rows of either table written after watermark (xmin distance from next xid, see change_tracking.py)
+CHANGED_FILTER = 'WHERE age(m.xmin) <= %(next_xid)s - %(since)s OR age(ml.xmin) <= %(next_xid)s - %(since)s'
+
+
+class ModuleCatalog:
+    """All LoRa modules with metadata, refreshed incrementally and cached on disk"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, full_refresh_seconds=FULL_REFRESH_SECONDS):
+        self.path = path
+        self.full_refresh_seconds = full_refresh_seconds
+        self.modules = {}  # mac -> {'mac_address', 'name', 'latitude', 'longitude'}
+        self.watermark = None
+        self.count = None
+        self.source = None  # Database the cache was read from
+        self.full_refreshed_at = 0.0
+        self.checked_at = 0.0
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return  # Corrupt cache - next refresh is a full reload
+        self.modules = cache.get('modules', {})
+        self.watermark = cache.get('watermark')
+        self.count = cache.get('count')
+        self.source = cache.get('source')
+        self.full_refreshed_at = cache.get('full_refreshed_at', 0.0)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"  # Sharded workers may save at the same time
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'watermark': self.watermark,
+                'count': self.count,
+                'source': self.source,
+                'full_refreshed_at': self.full_refreshed_at,
+                'modules': self.modules,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self, conn):
+        """Loads new/changed modules (or all of them), returns number of modules read"""
+        with conn.cursor() as cur:
+            cur.execute("SET search_path TO agrosense, public;")
+            cur.execute(SNAPSHOT_SQL)
+            watermark, next_xid, count, source = cur.fetchone()
+
+            full = (self.watermark is None or count != self.count or source != self.source
+                    or time.time() - self.full_refreshed_at > self.full_refresh_seconds)
+            if full:
+                cur.execute(MODULES_QUERY.format(where=''))
+            else:
+                cur.execute(MODULES_QUERY.format(where=CHANGED_FILTER), {'next_xid': next_xid, 'since': self.watermark})
+            rows = cur.fetchall()
+
+        modules = {} if full else dict(self.modules)
+        for mac, name, latitude, longitude in rows:
+            modules[mac] = {'mac_address': mac, 'name': name, 'latitude': latitude, 'longitude': longitude}
+        self.modules = modules
+        self.watermark = watermark
+        self.count = count
+        self.source = source
+        self.checked_at = time.time()
+        if full:
+            self.full_refreshed_at = self.checked_at
+        self.save()
+        return len(rows)
+
+    def is_fresh(self, min_refresh_seconds=MIN_REFRESH_SECONDS):
+        return time.time() - self.checked_at < min_refresh_seconds
+
+    def for_station_type(self, station_type):
+        """Modules routed to station type (prefix, suffix, then default), sorted by MAC"""
+        return [module for mac, module in sorted(self.modules.items()) if route(mac) == station_type]
+
+
+def route(mac_address):
+    """Station type of module, None if no rule matches and there is no default station type"""
+    try:
+        return REGISTRY.route(mac_address)
+    except ValueError:
+        return None
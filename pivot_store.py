@@ -0,0 +1,164 @@
+"""
+Optional wide measurement table per station type, kept in the local PostgreSQL.
+nostradamus_sync.measurement_pivot_<station type> holds one row per
+(mac_address, date) with one numeric column per output field - the same
+rounded values the pivot queries in stations.py compute from narrow
+lora_measurement rows on every fetch. Reads are then a primary key range scan.
+
+The table is maintained in batches: the first refresh builds it, later ones
+only recompute (mac_address, date) pairs with rows inserted or updated since
+the previous refresh (change_tracking watermark, consumer pivot:<cursor>:<type>),
+so late and corrected rows are picked up too. Modules routed to the station
+type after it was built need a rebuild (main.py pivot --rebuild).
+"""
+
+import change_tracking
+from stations import (BACKFILL_DATE_FILTER, BACKFILL_PARAMS, LIVE_DATE_FILTER, LIVE_PARAMS,
+                      MODULE_INFO_CTE, REGISTRY, sql_literal)
+
+PIVOT_SCHEMA = 'nostradamus_sync'
+
+READ_QUERY_TEMPLATE = '''
+    -- {station_type} (measurement pivot)
+    WITH params AS (
+        SELECT{params}
+    ),
+{module_info}
+    SELECT
+        (jsonb_build_object(
+            'key', mi.mac_address,
+            'name', mi.module_name,
+            'timestamp', lm.date,
+{fields}
+            'latitude_4326', mi.latitude,
+            'longitude_4326', mi.longitude
+        )) AS data
+    FROM {table} lm
+    JOIN params p ON lm.mac_address = p.mac_address
+    JOIN module_info mi ON lm.mac_address = mi.mac_address
+    WHERE {date_filter}
+    ORDER BY lm.date {order}
+    '''
+
+# Recomputes pivot rows from lora_measurement, {keys} narrows it to the rows being refreshed
+INSERT_TEMPLATE = '''
+    INSERT INTO {table} (mac_address, date, {columns})
+    SELECT
+        lm.mac_address_lora_module,
+        lm.date,
+{aggregates}
+    FROM lora_measurement lm
+    JOIN lora_device_type_sensor_type ldt ON lm.id_lora_device_type_sensor_type = ldt.id
+    JOIN lora_sensor_type st ON ldt.id_lora_sensor_type = st.id
+    {keys}
+    WHERE
+        lm.device_on IS TRUE
+        AND lm.valid IS TRUE
+        AND lm.mac_address_lora_module = ANY(%s)
+        AND st.name IN ({sensor_names})
+    GROUP BY lm.mac_address_lora_module, lm.date
+'''
+
+CHANGED_KEYS_TEMPLATE = '''
+    CREATE TEMP TABLE pivot_changed ON COMMIT DROP AS
+    SELECT DISTINCT lm.mac_address_lora_module AS mac_address, lm.date
+    FROM lora_measurement lm
+    WHERE {changed_since}
+      AND lm.mac_address_lora_module = ANY(%s)
+'''
+
+CHANGED_KEYS_JOIN = 'JOIN pivot_changed c ON lm.mac_address_lora_module = c.mac_address AND lm.date = c.date'
+
+
+def sql_identifier(name):
+    """Quotes field name as SQL identifier (fields contain '-' and '/')"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class PivotStore:
+    """Wide table of one station type with its DDL, refresh and read queries"""
+
+    def __init__(self, station):
+        self.station = station
+        self.table = f"{PIVOT_SCHEMA}.measurement_pivot_{station.name.lower()}"
+        sensors = [s for s in station.sensors if s.field]
+        columns = [sql_identifier(s.field) for s in sensors]
+
+        self.create_sql = (
+            f"CREATE SCHEMA IF NOT EXISTS {PIVOT_SCHEMA};\n"
+            f"CREATE TABLE IF NOT EXISTS {self.table} (\n"
+            "    mac_address varchar NOT NULL,\n"
+            "    date timestamp NOT NULL,\n"
+            + ''.join(f"    {column} numeric,\n" for column in columns)
+            + "    PRIMARY KEY (mac_address, date)\n);"
+        )
+        insert = INSERT_TEMPLATE.format(
+            table=self.table,
+            columns=', '.join(columns),
+            aggregates=',\n'.join(f"        {s.value_expression('lm.value', 'st.name')}" for s in sensors),
+            sensor_names=', '.join(sql_literal(name) for name in station.sensor_names),
+            keys='{keys}',
+        )
+        self.build_sql = insert.replace('{keys}', '')
+        self.insert_changed_sql = insert.replace('{keys}', CHANGED_KEYS_JOIN)
+        self.delete_changed_sql = (f"DELETE FROM {self.table} pv USING pivot_changed c "
+                                   "WHERE pv.mac_address = c.mac_address AND pv.date = c.date")
+
+        self.backfill_query = self.build_query(BACKFILL_PARAMS, BACKFILL_DATE_FILTER, 'DESC', sensors)
+        self.backfill_query_ascending = self.build_query(BACKFILL_PARAMS, BACKFILL_DATE_FILTER, 'ASC', sensors)
+        self.live_query = self.build_query(LIVE_PARAMS, LIVE_DATE_FILTER, 'ASC', sensors)
+
+    def build_query(self, params, date_filter, order, sensors):
+        """Same data column as StationType queries, read from the wide table"""
+        return READ_QUERY_TEMPLATE.format(
+            station_type=self.station.name,
+            params=params,
+            module_info=MODULE_INFO_CTE,
+            table=self.table,
+            date_filter=date_filter,
+            fields='\n'.join(f"            {sql_literal(s.field)}, lm.{sql_identifier(s.field)}," for s in sensors),
+            order=order,
+        )
+
+    def consumer(self, cursor):
+        # Watermarks of different cursors are not comparable - switching cursor rebuilds
+        return f"pivot:{cursor}:{self.station.name}"
+
+    def refresh(self, conn, mac_addresses, cursor='xmin', rebuild=False):
+        """
+        Brings the table up to date for modules, returns (mode, rows written).
+        Table changes and the new watermark are committed in one transaction.
+        """
+        if cursor not in change_tracking.CURSORS:
+            raise ValueError(f"Invalid change cursor. Use one of: {', '.join(change_tracking.CURSORS)}")
+        change_tracking.ensure_schema(conn)
+        with conn.cursor() as cur:
+            if rebuild:
+                cur.execute(f"DROP TABLE IF EXISTS {self.table}")  # Picks up added/removed fields
+            cur.execute(self.create_sql)
+        conn.commit()
+
+        consumer = self.consumer(cursor)
+        with conn.cursor() as cur:
+            # Concurrent workers refresh one after another, the second one finds little to do
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (self.table,))
+        since = None if rebuild else change_tracking.read_watermark(conn, consumer)
+        watermark = change_tracking.current_watermark(conn, cursor)
+        with conn.cursor() as cur:
+            cur.execute("SET search_path TO agrosense, public;")
+            if since is None:
+                mode = 'build'
+                cur.execute(f"TRUNCATE {self.table}")
+                cur.execute(self.build_sql, (list(mac_addresses),))
+            else:
+                mode = 'incremental'
+                query = CHANGED_KEYS_TEMPLATE.format(changed_since=change_tracking.CHANGED_SINCE[cursor])
+                cur.execute(query, (since, list(mac_addresses)))
+                cur.execute(self.delete_changed_sql)
+                cur.execute(self.insert_changed_sql, (list(mac_addresses),))
+            rows = cur.rowcount
+        change_tracking.write_watermark(conn, consumer, watermark)
+        return mode, rows
+
+
+STORES = {name: PivotStore(REGISTRY[name]) for name in REGISTRY}
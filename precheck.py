@@ -0,0 +1,96 @@
+"""
+"Anything new?" precheck for live sync.
+One query over lora_measurement returns, for all modules of a run, the row
+count and max(date) above each module's watermark (last timestamp known to be
+on the server, kept in nostradamus_sync.live_watermark in the local
+PostgreSQL). Modules with nothing new are skipped before any server lookup or
+pivot query.
+
+Watermarks only ever make the precheck include more modules than needed:
+a missing watermark falls back to the live window (1 hour), and a stale one
+just lets the regular server lookup decide.
+"""
+
+from datetime import timedelta
+
+LIVE_WINDOW = timedelta(hours=1)
+
+SCHEMA_SQL = '''
+    CREATE SCHEMA IF NOT EXISTS nostradamus_sync;
+    CREATE TABLE IF NOT EXISTS nostradamus_sync.live_watermark (
+        mac_address varchar PRIMARY KEY,
+        last_timestamp timestamptz NOT NULL,
+        updated_at timestamptz NOT NULL DEFAULT now()
+    );
+'''
+
+READ_WATERMARKS_SQL = '''
+    SELECT mac_address, last_timestamp
+    FROM nostradamus_sync.live_watermark
+    WHERE mac_address = ANY(%s)
+'''
+
+WRITE_WATERMARKS_SQL = '''
+    INSERT INTO nostradamus_sync.live_watermark (mac_address, last_timestamp, updated_at)
+    SELECT w.mac_address, w.last_timestamp, now()
+    FROM unnest(%s::varchar[], %s::timestamptz[]) AS w(mac_address, last_timestamp)
+    ON CONFLICT (mac_address) DO UPDATE
+        SET last_timestamp = EXCLUDED.last_timestamp, updated_at = now()
+'''
+
+# Index (mac_address_lora_module, date) makes each lateral lookup a short range scan
+PRECHECK_QUERY = '''
+    SELECT w.mac_address, s.latest, s.new_rows
+    FROM unnest(%s::varchar[], %s::timestamptz[]) AS w(mac_address, watermark)
+    CROSS JOIN LATERAL (
+        SELECT MAX(lm.date) AS latest, COUNT(*) AS new_rows
+        FROM lora_measurement lm
+        WHERE lm.mac_address_lora_module = w.mac_address
+          AND lm.date > w.watermark::timestamp
+          AND lm.device_on IS TRUE
+          AND lm.valid IS TRUE
+    ) s
+'''
+
+
+def window_starts(mac_addresses, watermarks, now):
+    """Lower bound per module - watermark, but never before the live window"""
+    earliest = now - LIVE_WINDOW
+    return [max(watermarks.get(mac, earliest), earliest) for mac in mac_addresses]
+
+
+def ensure_schema(conn):
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+    conn.commit()
+
+
+def read_watermarks(conn, mac_addresses):
+    """Returns {mac: last_timestamp} for modules that have a watermark"""
+    with conn.cursor() as cur:
+        cur.execute(READ_WATERMARKS_SQL, (list(mac_addresses),))
+        return dict(cur.fetchall())
+
+
+def write_watermarks(conn, watermarks):
+    if not watermarks:
+        return
+    with conn.cursor() as cur:
+        cur.execute(WRITE_WATERMARKS_SQL, (list(watermarks), list(watermarks.values())))
+    conn.commit()
+
+
+def fetch_new_rows(conn, mac_addresses, starts):
+    """Returns {mac: (latest, new_rows)} - latest is None when module has nothing above its start"""
+    with conn.cursor() as cur:
+        cur.execute("SET search_path TO agrosense, public;")
+        cur.execute(PRECHECK_QUERY, (list(mac_addresses), starts))
+        return {mac: (latest, new_rows) for mac, latest, new_rows in cur.fetchall()}
+
+
+def split_modules(mac_addresses, report):
+    """Returns (modules with new rows, modules with nothing new) in original order"""
+    active, idle = [], []
+    for mac in mac_addresses:
+        (active if report.get(mac, (None, 0))[1] else idle).append(mac)
+    return active, idle
@@ -0,0 +1,194 @@
+"""
+Opt-in profiling for main.py and live.py.
+Enabled with NOSTRADAMUS_PROFILE=<dir> (or --profile <dir>). A run is
+wrapped in cProfile, and calls decorated with @profiled record tracemalloc
+snapshots. Results are dumped per run as profile.prof, top_functions.txt,
+allocations.txt and summary.json.
+
+cProfile only sees the thread that started it and tracemalloc peaks are
+process-wide, so a profiled run processes modules one at a time in the
+profiled thread: thread pools come from executor(), which runs submitted
+calls inline while profiling, and live.py falls back to the sync engine.
+"""
+
+import functools
+import io
+import json
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from lazy import lazy_import
+
+# Only needed once profiling is enabled
+cProfile = lazy_import('cProfile')
+pstats = lazy_import('pstats')
+tracemalloc = lazy_import('tracemalloc')
+
+PROFILE_ENV = 'NOSTRADAMUS_PROFILE'
+MAX_SNAPSHOTS_PER_LABEL = 50
+TOP_N = 30
+
+ACTIVE_SESSION = None
+
+
+class ProfileSession:
+    """One profiled run - CPU profile plus allocation sites per decorated function"""
+
+    def __init__(self, directory, name):
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        self.directory = os.path.join(directory, f"{name}-{stamp}-{os.getpid()}")
+        self.name = name
+        self.profiler = cProfile.Profile()
+        self.allocations = {}  # label -> {'calls', 'snapshots', 'peak_bytes', 'sites': {site: bytes}}
+        self.started = None
+
+    def start(self):
+        global ACTIVE_SESSION
+        os.makedirs(self.directory, exist_ok=True)
+        tracemalloc.start(10)
+        self.started = time.perf_counter()
+        ACTIVE_SESSION = self
+        self.profiler.enable()
+        return self
+
+    def stop(self):
+        global ACTIVE_SESSION
+        self.profiler.disable()
+        ACTIVE_SESSION = None
+        elapsed = time.perf_counter() - self.started
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.dump(elapsed, peak)
+        print(f"🔬 Profile written to {self.directory}")
+        return self.directory
+
+    def snapshot(self):
+        """Takes tracemalloc snapshot without charging its cost to the CPU profile"""
+        self.profiler.disable()
+        try:
+            return tracemalloc.take_snapshot()
+        finally:
+            self.profiler.enable()
+
+    def record_call(self, label, before, after, peak):
+        entry = self.allocations.setdefault(label, {'calls': 0, 'snapshots': 0, 'peak_bytes': 0, 'sites': {}})
+        entry['calls'] += 1
+        entry['peak_bytes'] = max(entry['peak_bytes'], peak)
+        if before is None or after is None:
+            return
+        entry['snapshots'] += 1
+        for stat in after.compare_to(before, 'lineno')[:TOP_N]:
+            if stat.size_diff <= 0:
+                continue
+            frame = stat.traceback[0]
+            site = f"{frame.filename}:{frame.lineno}"
+            entry['sites'][site] = entry['sites'].get(site, 0) + stat.size_diff
+
+    def dump(self, elapsed, peak):
+        self.profiler.dump_stats(os.path.join(self.directory, 'profile.prof'))
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(TOP_N)
+        stats.sort_stats('tottime').print_stats(TOP_N)
+        with open(os.path.join(self.directory, 'top_functions.txt'), 'w', encoding='utf-8') as f:
+            f.write(stream.getvalue())
+
+        with open(os.path.join(self.directory, 'allocations.txt'), 'w', encoding='utf-8') as f:
+            for label, entry in self.allocations.items():
+                f.write(f"== {label}: {entry['calls']} calls, peak {entry['peak_bytes'] / 1024 / 1024:.1f} MiB\n")
+                for site, size in sorted(entry['sites'].items(), key=lambda item: -item[1])[:TOP_N]:
+                    f.write(f"   {size / 1024:>12.1f} KiB  {site}\n")
+                f.write("\n")
+
+        top_functions = []
+        for (filename, lineno, func), (cc, nc, tt, ct, callers) in sorted(
+                pstats.Stats(self.profiler).stats.items(), key=lambda item: -item[1][3])[:TOP_N]:
+            top_functions.append({'function': f"{filename}:{lineno}({func})", 'calls': nc,
+                                  'tottime_s': round(tt, 6), 'cumtime_s': round(ct, 6)})
+
+        summary = {
+            'name': self.name,
+            'elapsed_s': round(elapsed, 3),
+            'peak_traced_bytes': peak,
+            'top_functions': top_functions,
+            'allocations': {
+                label: {
+                    'calls': entry['calls'],
+                    'peak_bytes': entry['peak_bytes'],
+                    'top_sites': dict(sorted(entry['sites'].items(), key=lambda item: -item[1])[:10]),
+                }
+                for label, entry in self.allocations.items()
+            },
+        }
+        with open(os.path.join(self.directory, 'summary.json'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+
+def profiled(label):
+    """Decorator - records allocation snapshot and peak memory of each call while profiling is active"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            session = ACTIVE_SESSION
+            if session is None:
+                return func(*args, **kwargs)
+
+            entry = session.allocations.get(label)
+            take_snapshot = entry is None or entry['snapshots'] < MAX_SNAPSHOTS_PER_LABEL
+            before = session.snapshot() if take_snapshot else None
+            tracemalloc.reset_peak()
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            try:
+                return func(*args, **kwargs)
+            finally:
+                peak = tracemalloc.get_traced_memory()[1] - start_bytes
+                after = session.snapshot() if take_snapshot else None
+                session.record_call(label, before, after, peak)
+        return wrapper
+    return decorator
+
+
+class InlineExecutor:
+    """Executor that runs each submitted call right away in the calling thread"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def executor(max_workers, what='modules'):
+    """ThreadPoolExecutor of max_workers - inline executor while profiling is active, so work runs in the profiled thread"""
+    if ACTIVE_SESSION is not None:
+        if max_workers > 1:
+            print(f"🔬 Profiling - processing {what} one at a time instead of {max_workers} in parallel")
+        return InlineExecutor()
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def start(directory=None, name='run'):
+    """Starts profiling session if directory is given or NOSTRADAMUS_PROFILE is set, returns session or None"""
+    directory = directory or os.environ.get(PROFILE_ENV)
+    if not directory:
+        return None
+    print(f"🔬 Profiling enabled ({directory})")
+    return ProfileSession(directory, name).start()
+
+
+def stop(session):
+    """Stops session started by start(), returns output directory"""
+    if session is not None:
+        return session.stop()
+    return None
@@ -0,0 +1,209 @@
+"""
+Prometheus metrics for live.py - text exposition format without external
+dependencies. Written to a textfile-collector file in cron mode or served
+over HTTP in daemon mode.
+"""
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import instrumentation
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base class - stores values per label set"""
+
+    type_name = 'untyped'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple((name, str(labels.get(name, ''))) for name in self.label_names)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def dec(self, value=1, **labels):
+        self.inc(-value, **labels)
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def samples(self):
+        result = []
+        with self.lock:
+            for key, entry in self.values.items():
+                labels = dict(key)
+                for bound, count in zip(self.buckets, entry['buckets']):
+                    result.append((f"{self.name}_bucket", {**labels, 'le': format_value(bound)}, count))
+                result.append((f"{self.name}_sum", labels, entry['sum']))
+                result.append((f"{self.name}_count", labels, entry['count']))
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+RECORDS_SENT = REGISTRY.register(Counter(
+    'nostradamus_records_sent_total', 'Records sent to Nostradamus per station type', ('station_type',)))
+UPLOAD_FAILURES = REGISTRY.register(Counter(
+    'nostradamus_module_upload_failures_total', 'Module uploads with at least one failed batch', ('station_type',)))
+BATCH_LATENCY = REGISTRY.register(Histogram(
+    'nostradamus_batch_upload_duration_seconds', 'send_data batch upload latency'))
+API_ERRORS = REGISTRY.register(Counter(
+    'nostradamus_api_errors_total', 'Nostradamus API errors by request stage and status', ('stage', 'status')))
+DB_QUERY_DURATION = REGISTRY.register(Histogram(
+    'nostradamus_db_query_duration_seconds', 'Local database query duration', ('stage',)))
+MODULE_LAG = REGISTRY.register(Gauge(
+    'nostradamus_module_lag_seconds', 'Now minus last timestamp sent to server per module', ('station_type', 'mac')))
+OUTBOX_DEPTH = REGISTRY.register(Gauge(
+    'nostradamus_outbox_depth', 'Records fetched from database and not yet sent'))
+LAST_RUN = REGISTRY.register(Gauge(
+    'nostradamus_last_run_timestamp_seconds', 'Unix time of last finished run', ('status',)))
+RUN_DURATION = REGISTRY.register(Gauge(
+    'nostradamus_last_run_duration_seconds', 'Duration of last run'))
+
+
+def on_stage(stage, module, seconds, rows, nbytes, labels):
+    """instrumentation listener - maps stage samples to Prometheus metrics"""
+    if stage == instrumentation.HTTP_SEND:
+        BATCH_LATENCY.observe(seconds)
+    elif stage in (instrumentation.DB_QUERY, instrumentation.DB_FETCH):
+        DB_QUERY_DURATION.observe(seconds, stage=stage)
+
+    if stage in (instrumentation.HTTP_SEND, instrumentation.SERVER_LOOKUP):
+        status = labels.get('status')
+        if status is None:
+            API_ERRORS.inc(stage=stage, status='error')
+        elif status >= 400:
+            API_ERRORS.inc(stage=stage, status=status)
+
+
+def install(metrics=instrumentation.METRICS):
+    """Connects exporter to instrumentation samples"""
+    metrics.add_listener(on_stage)
+
+
+def observe_run(started, status='success'):
+    finished = time.time()
+    LAST_RUN.set(finished, status=status)
+    RUN_DURATION.set(finished - started)
+
+
+def write_textfile(path):
+    """Writes metrics atomically for node_exporter textfile collector"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp_path, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host='0.0.0.0'):
+    """Serves /metrics in background thread"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,181 @@
+"""
+Statement timeouts with automatic range splitting for backfill queries.
+A module's backfill query runs under statement_timeout; when it is cancelled
+the time range is bisected and both halves are retried (in the order of the
+query, newest first unless oldest_first) until they fit or get shorter than
+MIN_SLICE.
+The slice size that worked is remembered per module in data/slice_sizes.json,
+so the next run starts with slices of that size instead of timing out again.
+After a run without timeouts the remembered size doubles, until the module
+goes back to a single query.
+"""
+
+import json
+import os
+import threading
+from datetime import timedelta
+
+DEFAULT_SIZES_PATH = os.path.join('data', 'slice_sizes.json')
+MIN_SLICE = timedelta(hours=6)  # Slices that still time out at this size fail the module
+MAX_SLICE = timedelta(days=366)  # Remembered sizes grown past this are forgotten
+QUERY_CANCELED = '57014'  # SQLSTATE of statement_timeout
+RESOLUTION = timedelta(microseconds=1)  # PostgreSQL timestamp precision
+
+
+class SliceAbandoned(Exception):
+    """Raised by fetch when a slice timed out after part of it was already sent"""
+
+
+def set_statement_timeout(conn, seconds):
+    """Sets statement_timeout for the session (0 or None disables it)"""
+    with conn.cursor() as cur:
+        cur.execute("SET statement_timeout = %s", (int((seconds or 0) * 1000),))
+    conn.commit()  # Session setting survives rollbacks after a timeout
+
+
+def is_statement_timeout(error):
+    return getattr(error, 'pgcode', None) == QUERY_CANCELED
+
+
+def open_ranges(date_from, date_to, date_middle_1, date_middle_2):
+    """Open (start, end) ranges selected by BACKFILL_DATE_FILTER, newest first"""
+    if date_middle_1 is not None and date_middle_2 is not None:
+        return [(date_middle_2, date_to), (date_from, date_middle_1)]
+    if date_middle_1 is not None:
+        return [(date_from, date_middle_1)]
+    if date_middle_2 is not None:
+        return [(date_middle_2, date_to)]
+    return [(date_from, date_to)]
+
+
+def stream_order(params):
+    """
+    Splits backfill query params for streaming into [(params, oldest_first)].
+    The range above the server's newest record (date_middle_2, date_to) goes
+    oldest first, everything else newest first, so a stream cut off part way
+    has always sent the rows next to data already on the server - server
+    min/max then tell the next run where to resume.
+    """
+    mac_address, date_from, date_to, date_middle_1, date_middle_2 = params
+    if date_middle_2 is None:
+        return [(params, False)]
+    parts = [((mac_address, date_middle_2, date_to, None, None), True)]
+    if date_middle_1 is not None:
+        parts.append(((mac_address, date_from, date_middle_1, None, None), False))
+    return parts
+
+
+def split_range(start, end, size, oldest_first=False):
+    """
+    Splits open range into open slices of about size, newest first unless
+    oldest_first. Each newer slice starts one microsecond before the boundary,
+    so rows at the boundary are selected exactly once.
+    """
+    slices = []
+    while end - start > size:
+        boundary = end - size
+        slices.append((boundary - RESOLUTION, end))
+        end = boundary
+    slices.append((start, end))
+    return slices[::-1] if oldest_first else slices
+
+
+def bisect(start, end, oldest_first=False):
+    middle = start + (end - start) / 2
+    halves = [(middle - RESOLUTION, end), (start, middle)]
+    return halves[::-1] if oldest_first else halves
+
+
+class SliceSizes:
+    """Remembered slice size per module, shared by all threads of the process"""
+
+    def __init__(self, path=DEFAULT_SIZES_PATH):
+        self.path = path
+        self.sizes = {}  # mac -> seconds
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.sizes = json.load(f)
+            except (OSError, ValueError):
+                pass  # Corrupt file - modules start with a single query again
+
+    def get(self, mac_address):
+        seconds = self.sizes.get(mac_address)
+        return timedelta(seconds=seconds) if seconds else None
+
+    def shrink(self, mac_address, size):
+        with self.lock:
+            current = self.sizes.get(mac_address)
+            seconds = int(size.total_seconds())
+            if current is None or seconds < current:
+                self.sizes[mac_address] = seconds
+                self.save()
+
+    def grow(self, mac_address):
+        with self.lock:
+            current = self.sizes.get(mac_address)
+            if current is None:
+                return
+            if current * 2 >= MAX_SLICE.total_seconds():
+                del self.sizes[mac_address]
+            else:
+                self.sizes[mac_address] = current * 2
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.sizes, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def run_sliced(conn, params, fetch, sizes, min_slice=MIN_SLICE, on_timeout=None, oldest_first=False, grow=True):
+    """
+    Runs fetch(params) for backfill query params (mac, date_from, date_to,
+    date_middle_1, date_middle_2), split into slices of the module's remembered
+    size. A slice cancelled by statement_timeout is bisected and retried.
+    Returns list of fetch results, newest slice first (oldest first if
+    oldest_first, for ascending queries). Without grow the remembered size
+    is left alone after a run without timeouts (caller grows it once for
+    several calls).
+    """
+    mac_address = params[0]
+    size = sizes.get(mac_address)
+    if size is None:
+        pending = [params]
+    else:
+        ranges = open_ranges(*params[1:])
+        pending = [(mac_address, start, end, None, None)
+                   for range_start, range_end in (ranges[::-1] if oldest_first else ranges)
+                   for start, end in split_range(range_start, range_end, size, oldest_first)]
+
+    results = []
+    timed_out = False
+    while pending:
+        current = pending.pop(0)
+        try:
+            results.append(fetch(current))
+        except SliceAbandoned:
+            # Next run starts with smaller slices
+            sizes.shrink(mac_address, max(end - start for start, end in open_ranges(*current[1:])) / 2)
+            raise
+        except Exception as e:
+            if not is_statement_timeout(e):
+                raise
+            conn.rollback()
+            ranges = open_ranges(*current[1:])
+            slices = [s for start, end in ranges for s in
+                      (bisect(start, end, oldest_first) if end - start > min_slice else [(start, end)])]
+            if len(slices) == len(ranges):
+                raise  # Nothing left to split
+            timed_out = True
+            sizes.shrink(mac_address, max(end - start for start, end in slices))
+            if on_timeout is not None:
+                on_timeout(current, len(slices))
+            pending[:0] = [(mac_address, start, end, None, None) for start, end in slices]
+
+    if grow and not timed_out:
+        sizes.grow(mac_address)
+    return results
@@ -0,0 +1,162 @@
+"""
+Client-side rate limiting for the Nostradamus IoT API.
+One token bucket per endpoint class (send_data, get_data, statistics) is
+shared by all threads of the process. When the server answers 429/503 the
+bucket halves its rate (and pauses for Retry-After), then creeps back to the
+configured rate on successful responses - steady throughput at the limit
+instead of bursts followed by retries.
+
+Rates are configured as NOSTRADAMUS_RATE_LIMITS="send_data=10/20,get_data=20/40"
+(requests per second / burst size); a rate of 0 disables limiting for that class.
+"""
+
+import argparse
+import os
+import threading
+import time
+
+from lazy import lazy_import
+
+asyncio = lazy_import('asyncio')
+
+RATE_LIMITS_ENV = 'NOSTRADAMUS_RATE_LIMITS'
+
+# Endpoint class -> (requests per second, burst)
+DEFAULT_RATE_LIMITS = {
+    'send_data': (10.0, 20),
+    'get_data': (20.0, 40),
+    'statistics': (5.0, 10),
+}
+
+THROTTLE_STATUSES = (429, 503)
+MIN_RATE_FRACTION = 0.05  # Never slow below 5% of configured rate
+RECOVERY_FRACTION = 0.05  # Each success gives back 5% of configured rate
+
+
+class TokenBucket:
+    """Token bucket with multiplicative decrease on throttling and additive recovery"""
+
+    def __init__(self, rate, burst):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """Takes a token if available (returns 0), otherwise returns seconds to wait before retrying"""
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+    def acquire(self):
+        """Blocks until a token is available, returns seconds waited"""
+        waited = 0.0
+        while True:
+            delay = self.reserve()
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    async def acquire_async(self):
+        """Like acquire, but sleeps without blocking the event loop"""
+        waited = 0.0
+        while True:
+            delay = self.reserve()
+            if not delay:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def throttled(self, retry_after=None):
+        """Server pushed back - halve the rate and drain burst, pause for retry_after seconds"""
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            self.rate = max(self.max_rate * MIN_RATE_FRACTION, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                now = time.monotonic()
+                self.refill(now)
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_FRACTION)
+
+
+def parse_rate_limits(value):
+    """Parses "send_data=10/20,statistics=5" into {endpoint_class: (rate, burst)}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, spec = item.partition('=')
+        rate, _, burst = spec.partition('/')
+        try:
+            rate = float(rate)
+            burst = int(burst) if burst else max(1, int(rate))
+        except ValueError:
+            raise ValueError(f"Invalid rate limit '{item}' (expected endpoint=rate[/burst]).")
+        limits[name.strip()] = (rate, burst)
+    return limits
+
+
+def rate_limits_argument(value):
+    """argparse type for --rate-limits"""
+    try:
+        return parse_rate_limits(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_retry_after(value):
+    """Seconds from Retry-After header (HTTP dates are ignored)"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Token buckets by endpoint class, shared across threads"""
+
+    def __init__(self, overrides=None):
+        self.buckets = {}
+        self.configure(overrides)
+
+    def configure(self, overrides=None):
+        """Rebuilds buckets from defaults updated with overrides (or $NOSTRADAMUS_RATE_LIMITS)"""
+        if overrides is None:
+            overrides = parse_rate_limits(os.environ.get(RATE_LIMITS_ENV, ''))
+        limits = dict(DEFAULT_RATE_LIMITS)
+        limits.update(overrides)
+        self.buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in limits.items() if rate > 0}
+
+    @staticmethod
+    def endpoint_class(url):
+        """Last path segment of request URL (send_data, get_data, statistics, collections...)"""
+        return url.rstrip('/').rsplit('/', 1)[-1].split('?', 1)[0]
+
+    def bucket(self, url):
+        return self.buckets.get(self.endpoint_class(url))
+
+    def rates(self):
+        """Current (possibly slowed down) rate of every bucket"""
+        return {name: bucket.rate for name, bucket in self.buckets.items()}
+
+    def describe(self):
+        return ', '.join(f"{name} {bucket.max_rate:g}/s (burst {bucket.burst})" for name, bucket in self.buckets.items()) or 'off'
+
+
+LIMITER = RateLimiter()
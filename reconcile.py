@@ -0,0 +1,176 @@
+"""
+Gap detection between local database and Nostradamus server.
+Compares per-module, per-bucket record counts (one GROUP BY query locally,
+one statistics request per module on the server) and queues only the
+mismatched buckets for re-extraction.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from lazy import lazy_import
+
+psycopg2_extras = lazy_import('psycopg2.extras')
+
+DEFAULT_QUEUE_PATH = os.path.join('data', 'reconcile_queue.jsonl')
+
+# Supported bucket sizes (PostgreSQL date_trunc units)
+BUCKET_UNITS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+
+LOCAL_COUNTS_QUERY = '''
+    SELECT
+        lm.mac_address_lora_module AS mac_address,
+        date_trunc(%s, lm.date) AS bucket,
+        COUNT(DISTINCT lm.date) AS records
+    FROM lora_measurement lm
+    JOIN lora_device_type_sensor_type ldt ON lm.id_lora_device_type_sensor_type = ldt.id
+    JOIN lora_sensor_type st ON ldt.id_lora_sensor_type = st.id
+    WHERE
+        lm.device_on IS TRUE
+        AND lm.valid IS TRUE
+        AND lm.date > %s::timestamp
+        AND lm.date < %s::timestamp
+        AND lm.mac_address_lora_module = ANY(%s)
+        AND st.name = ANY(%s)
+    GROUP BY 1, 2
+'''
+
+
+def truncate(dt, unit):
+    """Truncates datetime to bucket start the same way date_trunc does (UTC)"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    dt = dt.astimezone(timezone.utc)
+    if unit == 'hour':
+        return dt.replace(minute=0, second=0, microsecond=0)
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if unit == 'day':
+        return day
+    if unit == 'week':
+        return day - timedelta(days=day.weekday())
+    raise ValueError(f"Invalid bucket unit. Use one of: {', '.join(BUCKET_UNITS)}")
+
+
+def parse_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+
+
+def fetch_local_counts(conn, mac_addresses, sensor_names, date_from_dt, date_to_dt, unit='day'):
+    """Returns {mac: {bucket_start: count}} from local database in a single query"""
+    counts = {}
+    with conn.cursor(cursor_factory=psycopg2_extras.RealDictCursor) as cur:
+        cur.execute("SET search_path TO agrosense, public;")
+        cur.execute(LOCAL_COUNTS_QUERY, (unit, date_from_dt, date_to_dt, list(mac_addresses), list(sensor_names)))
+        for row in cur.fetchall():
+            bucket = truncate(row['bucket'], unit)
+            counts.setdefault(row['mac_address'], {})[bucket] = row['records']
+    return counts
+
+
+def subtract_quarantined(local_counts, quarantined, date_from_dt, date_to_dt, unit='day'):
+    """
+    Removes rows never sent because validation quarantined them ({mac: {timestamp}})
+    from local counts of fetch_local_counts for the same period.
+    """
+    for mac_address, timestamps in quarantined.items():
+        buckets = local_counts.get(mac_address)
+        if not buckets:
+            continue
+        for timestamp in timestamps:
+            if not date_from_dt < timestamp < date_to_dt:
+                continue
+            bucket = truncate(timestamp, unit)
+            if buckets.get(bucket):
+                buckets[bucket] -= 1
+    return local_counts
+
+
+def parse_server_counts(stats, attribute='timestamp', unit='day'):
+    """
+    Extracts {bucket_start: count} from statistics response with interval,
+    {"<attribute>_statistics": [{"interval_start": ..., "count": ...}, ...]}.
+    Raises ValueError for any other response (failed request included), so a
+    module whose server counts are unknown is never taken as empty.
+    """
+    entries = stats.get(f'{attribute}_statistics') if isinstance(stats, dict) else None
+    if not isinstance(entries, list):
+        raise ValueError(f"Unexpected statistics response: {str(stats)[:200]}")
+
+    counts = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or entry.get('interval_start') is None or entry.get('count') is None:
+            raise ValueError(f"Unexpected statistics entry: {str(entry)[:200]}")
+        start = truncate(parse_timestamp(entry['interval_start']), unit)
+        counts[start] = counts.get(start, 0) + int(entry['count'])
+    return counts
+
+
+def fetch_server_counts(get_statistics, collection_id, mac_address, date_from_dt, date_to_dt, unit='day'):
+    """Returns {bucket_start: count} for one module using statistics endpoint, raises ValueError if unavailable"""
+    filters = [
+        {"property_name": "key", "operator": "eq", "property_value": mac_address},
+        {"property_name": "timestamp", "operator": "gte", "property_value": date_from_dt.strftime('%Y-%m-%dT%H:%M:%SZ')},
+        {"property_name": "timestamp", "operator": "lte", "property_value": date_to_dt.strftime('%Y-%m-%dT%H:%M:%SZ')},
+    ]
+    stats = get_statistics(collection_id, 'timestamp', 'count', filters, unit)
+    return parse_server_counts(stats, 'timestamp', unit)
+
+
+def diff_counts(local, server):
+    """Returns sorted list of (bucket_start, local_count, server_count) that differ"""
+    mismatched = []
+    for bucket in sorted(set(local) | set(server)):
+        local_count = local.get(bucket, 0)
+        server_count = server.get(bucket, 0)
+        if local_count != server_count:
+            mismatched.append((bucket, local_count, server_count))
+    return mismatched
+
+
+def queue_key(entry):
+    return entry['collection_id'], entry['key'], entry['bucket_start']
+
+
+def write_queue(entries, path=DEFAULT_QUEUE_PATH):
+    """Adds mismatched buckets to reconciliation queue (JSONL), a bucket already queued is replaced"""
+    queue = {queue_key(entry): entry for entry in read_queue(path)}
+    for entry in entries:
+        queue[queue_key(entry)] = entry
+    rewrite_queue(list(queue.values()), path)
+
+
+def read_queue(path=DEFAULT_QUEUE_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def rewrite_queue(entries, path=DEFAULT_QUEUE_PATH):
+    """Replaces queue content with remaining entries"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+
+def make_queue_entry(station_type, collection_id, mac_address, bucket, unit, local_count, server_count):
+    bucket_end = bucket + BUCKET_UNITS[unit]
+    return {
+        'station_type': station_type,
+        'collection_id': collection_id,
+        'key': mac_address,
+        'bucket_start': bucket.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'bucket_end': bucket_end.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'local_count': local_count,
+        'server_count': server_count,
+    }
@@ -0,0 +1,105 @@
+"""
+Hourly and daily rollups of module data, computed locally with NumPy.
+Each station type gets companion collections (station_type_1_hourly,
+station_type_1_daily, ...) with one record per module and bucket: number of
+raw rows, and per field the aggregate configured in stations.json
+("rollup" of the sensor):
+    stats     - <field>_mean, <field>_min, <field>_max (default)
+    sum       - <field>_sum (precipitation, solar radiation, leaf wetness)
+    direction - <field>_mean as vector mean of angles in degrees (wind direction)
+Buckets are UTC-aligned. A bucket touched by newly sent raw data is always
+recomputed from all local rows of that bucket and replaced on the server.
+"""
+
+from columnar import ColumnarBatch, to_array
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+INTERVALS = {'hourly': 3600, 'daily': 86400}
+AGGREGATES = {
+    'stats': ('mean', 'min', 'max'),
+    'sum': ('sum',),
+    'direction': ('mean',),
+}
+SAMPLES_FIELD = 'samples'
+DECIMALS = 2
+
+
+def collection_name(station, interval):
+    return f"{station.collection_name}_{interval}"
+
+
+def rollup_fields(station):
+    """Output fields of rollup records of station type"""
+    fields = [SAMPLES_FIELD]
+    for sensor in station.sensors:
+        if sensor.field:
+            fields.extend(f"{sensor.field}_{aggregate}" for aggregate in AGGREGATES[sensor.rollup])
+    return fields
+
+
+def collection_body(station, interval):
+    schema = dict(station.schema_sample)
+    schema[SAMPLES_FIELD] = 0
+    for field in rollup_fields(station)[1:]:
+        schema[field] = 0.0
+    return {
+        'name': collection_name(station, interval),
+        'description': f"{station.description} ({interval} rollups)",
+        'tags': list(station.tags) + ['rollup', interval],
+        'collection_schema': schema,
+    }
+
+
+def bucket_start(epoch, seconds):
+    return epoch // seconds * seconds
+
+
+def aggregate(batch, station, seconds):
+    """Aggregates ColumnarBatch of raw rows into ColumnarBatch of rollup records (one per bucket)"""
+    rolled = ColumnarBatch(rollup_fields(station), batch.key, batch.name, batch.latitude, batch.longitude)
+    if not batch:
+        return rolled
+
+    # Rows of one bucket next to each other, reduceat works on runs starting at `starts`
+    buckets = np.frombuffer(batch.timestamps, dtype=np.float64) // seconds * seconds
+    order = np.argsort(buckets, kind='stable')
+    buckets = buckets[order]
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    sizes = np.diff(np.r_[starts, len(buckets)])
+
+    rolled.timestamps = to_array('d', buckets[starts])
+    rolled.columns[SAMPLES_FIELD] = to_array('d', sizes.astype(np.float64))
+    rolled.masks[SAMPLES_FIELD] = bytearray(b'\x01' * len(starts))
+
+    for sensor in station.sensors:
+        if not sensor.field:
+            continue
+        values = np.frombuffer(batch.columns[sensor.field], dtype=np.float64)[order]
+        present = np.frombuffer(batch.masks[sensor.field], dtype=np.uint8)[order].astype(bool)
+        counts = np.add.reduceat(present.astype(np.int64), starts)
+
+        if sensor.rollup == 'direction':
+            radians = np.deg2rad(values)
+            sin = np.add.reduceat(np.where(present, np.sin(radians), 0.0), starts)
+            cos = np.add.reduceat(np.where(present, np.cos(radians), 0.0), starts)
+            results = {'mean': np.round(np.rad2deg(np.arctan2(sin, cos)), DECIMALS) % 360.0}
+        else:
+            total = np.add.reduceat(np.where(present, values, 0.0), starts)
+            if sensor.rollup == 'sum':
+                results = {'sum': total}
+            else:
+                results = {
+                    'mean': total / np.maximum(counts, 1),
+                    'min': np.minimum.reduceat(np.where(present, values, np.inf), starts),
+                    'max': np.maximum.reduceat(np.where(present, values, -np.inf), starts),
+                }
+
+        # Buckets without a single value of the field stay null
+        mask = bytearray((counts > 0).astype(np.uint8).tobytes())
+        for name, column in results.items():
+            field = f"{sensor.field}_{name}"
+            rolled.columns[field] = to_array('d', np.where(counts > 0, np.round(column, DECIMALS), 0.0))
+            rolled.masks[field] = bytearray(mask)
+    return rolled
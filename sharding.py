@@ -0,0 +1,186 @@
+"""
+Sharded module processing across several sync workers.
+Each worker takes a deterministic subset of MAC addresses (consistent hash
+ring with shard index/count), and a lease table in the local PostgreSQL
+(nostradamus_sync.module_lease) makes sure two workers never process the
+same module at the same time.
+"""
+
+import bisect
+import hashlib
+import os
+import socket
+import threading
+from contextlib import contextmanager
+
+from lazy import lazy_import
+
+psycopg2 = lazy_import('psycopg2')
+
+SHARD_INDEX_ENV = 'NOSTRADAMUS_SHARD_INDEX'
+SHARD_COUNT_ENV = 'NOSTRADAMUS_SHARD_COUNT'
+WORKER_ID_ENV = 'NOSTRADAMUS_WORKER_ID'
+
+VIRTUAL_NODES = 64
+DEFAULT_LEASE_SECONDS = 900
+
+SCHEMA_SQL = '''
+    CREATE SCHEMA IF NOT EXISTS nostradamus_sync;
+    CREATE TABLE IF NOT EXISTS nostradamus_sync.module_lease (
+        mac_address varchar PRIMARY KEY,
+        worker_id varchar NOT NULL,
+        acquired_at timestamptz NOT NULL DEFAULT now(),
+        expires_at timestamptz NOT NULL
+    );
+'''
+
+# Takes free or expired lease (or renews own) - returns row only when lease is ours
+ACQUIRE_SQL = '''
+    INSERT INTO nostradamus_sync.module_lease (mac_address, worker_id, acquired_at, expires_at)
+    VALUES (%s, %s, now(), now() + make_interval(secs => %s))
+    ON CONFLICT (mac_address) DO UPDATE
+        SET worker_id = EXCLUDED.worker_id, acquired_at = now(), expires_at = EXCLUDED.expires_at
+        WHERE nostradamus_sync.module_lease.expires_at < now()
+           OR nostradamus_sync.module_lease.worker_id = EXCLUDED.worker_id
+    RETURNING mac_address
+'''
+
+RENEW_SQL = '''
+    UPDATE nostradamus_sync.module_lease
+    SET expires_at = now() + make_interval(secs => %s)
+    WHERE worker_id = %s AND mac_address = ANY(%s)
+'''
+
+RELEASE_SQL = '''
+    DELETE FROM nostradamus_sync.module_lease
+    WHERE mac_address = %s AND worker_id = %s
+'''
+
+
+def stable_hash(value):
+    """64-bit hash that is the same in every process (unlike hash())"""
+    return int.from_bytes(hashlib.sha1(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hash ring - adding a shard moves only ~1/N of the keys"""
+
+    def __init__(self, shard_count, virtual_nodes=VIRTUAL_NODES):
+        if shard_count < 1:
+            raise ValueError("Shard count must be at least 1.")
+        self.shard_count = shard_count
+        points = sorted(
+            (stable_hash(f"shard-{shard}-{node}"), shard)
+            for shard in range(shard_count)
+            for node in range(virtual_nodes)
+        )
+        self.points = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        i = bisect.bisect(self.points, stable_hash(key)) % len(self.points)
+        return self.shards[i]
+
+
+def select_shard(macs, shard_index, shard_count):
+    """Returns MAC addresses that belong to shard_index out of shard_count"""
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index must be in [0, {shard_count}).")
+    if shard_count == 1:
+        return list(macs)
+    ring = HashRing(shard_count)
+    return [mac for mac in macs if ring.shard_for(mac) == shard_index]
+
+
+def default_worker_id():
+    return os.environ.get(WORKER_ID_ENV) or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def shard_from_env():
+    """Returns (shard_index, shard_count) from NOSTRADAMUS_SHARD_INDEX/COUNT, (0, 1) if unset"""
+    return int(os.environ.get(SHARD_INDEX_ENV, 0)), int(os.environ.get(SHARD_COUNT_ENV, 1))
+
+
+class LeaseManager:
+    """Per-module leases in local PostgreSQL, renewed in background while held"""
+
+    def __init__(self, db_config, worker_id=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.conn = psycopg2.connect(**db_config)
+        self.conn.autocommit = True
+        self.lock = threading.Lock()
+        self.held = set()
+        self.stopped = threading.Event()
+        with self.lock, self.conn.cursor() as cur:
+            cur.execute(SCHEMA_SQL)
+        self.renewer = threading.Thread(target=self.renew_loop, daemon=True)
+        self.renewer.start()
+
+    def acquire(self, mac):
+        """Returns True if lease on mac was taken (or already held) by this worker"""
+        with self.lock, self.conn.cursor() as cur:
+            cur.execute(ACQUIRE_SQL, (mac, self.worker_id, self.lease_seconds))
+            acquired = cur.fetchone() is not None
+            if acquired:
+                self.held.add(mac)
+        return acquired
+
+    def release(self, mac):
+        with self.lock, self.conn.cursor() as cur:
+            cur.execute(RELEASE_SQL, (mac, self.worker_id))
+            self.held.discard(mac)
+
+    def renew_loop(self):
+        # Long backfills outlive lease duration, so extend held leases regularly
+        while not self.stopped.wait(self.lease_seconds / 3):
+            try:
+                with self.lock, self.conn.cursor() as cur:
+                    if self.held:
+                        cur.execute(RENEW_SQL, (self.lease_seconds, self.worker_id, list(self.held)))
+            except psycopg2.Error as e:
+                print(f"⚠️  Renewing module leases failed: {e}")
+
+    @contextmanager
+    def lease(self, mac):
+        """Holds lease on mac for duration of block, yields False if another worker holds it"""
+        if not self.acquire(mac):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self.release(mac)
+
+    def close(self):
+        self.stopped.set()
+        self.renewer.join()
+        with self.lock:
+            if self.held:
+                with self.conn.cursor() as cur:
+                    for mac in list(self.held):
+                        cur.execute(RELEASE_SQL, (mac, self.worker_id))
+                self.held.clear()
+            self.conn.close()
+
+
+def add_arguments(parser):
+    """Adds --shard-index/--shard-count/--worker-id/--leases to argparse parser"""
+    shard_index, shard_count = shard_from_env()
+    parser.add_argument('--shard-index', type=int, default=shard_index,
+                        help=f"index of this worker's shard (default ${SHARD_INDEX_ENV} or 0)")
+    parser.add_argument('--shard-count', type=int, default=shard_count,
+                        help=f"total number of shards/workers (default ${SHARD_COUNT_ENV} or 1)")
+    parser.add_argument('--worker-id', default=default_worker_id(),
+                        help=f"lease owner name (default ${WORKER_ID_ENV} or host-pid)")
+    parser.add_argument('--leases', action='store_true',
+                        help="take per-module leases in local DB even without sharding")
+
+
+def validate_arguments(parser, args):
+    if args.shard_count < 1 or not 0 <= args.shard_index < args.shard_count:
+        parser.error("--shard-index must be in [0, --shard-count) and --shard-count at least 1")
+
+
+def leases_enabled(args):
+    return args.shard_count > 1 or args.leases
@@ -0,0 +1,259 @@
+"""
+Station type registry loaded from stations.json.
+Each station type declares its sensors (sensor name -> output field,
+rounding, schema sample), collection metadata and MAC routing. SQL queries,
+collection schemas and the routing tries are generated once at load time,
+so adding a station type is a config change in stations.json.
+"""
+
+import json
+import os
+
+STATIONS_ENV = 'NOSTRADAMUS_STATIONS'
+DEFAULT_STATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stations.json')
+
+BACKFILL_PARAMS = '''
+            %s::varchar AS mac_address,
+            %s::timestamp AS date_from,
+            %s::timestamp AS date_to,
+            %s::timestamp AS date_middle_1,
+            %s::timestamp AS date_middle_2'''
+
+BACKFILL_DATE_FILTER = '''(
+                -- Oba middle datuma postoje - dva perioda
+                (p.date_middle_1 IS NOT NULL AND p.date_middle_2 IS NOT NULL AND (
+                    (lm.date > p.date_from AND lm.date < p.date_middle_1) OR
+                    (lm.date > p.date_middle_2 AND lm.date < p.date_to)
+                ))
+                OR
+                -- Samo date_middle_1 postoji - period od date_from do date_middle_1
+                (p.date_middle_1 IS NOT NULL AND p.date_middle_2 IS NULL AND (
+                    lm.date > p.date_from AND lm.date < p.date_middle_1
+                ))
+                OR
+                -- Samo date_middle_2 postoji - period od date_middle_2 do date_to
+                (p.date_middle_1 IS NULL AND p.date_middle_2 IS NOT NULL AND (
+                    lm.date > p.date_middle_2 AND lm.date < p.date_to
+                ))
+                OR
+                -- Nijedan middle datum ne postoji - ceo period
+                (p.date_middle_1 IS NULL AND p.date_middle_2 IS NULL AND (
+                    lm.date > p.date_from AND lm.date < p.date_to
+                ))
+            )'''
+
+LIVE_PARAMS = '''
+            %s::varchar AS mac_address,
+            %s::timestamp AS last_timestamp'''
+
+LIVE_DATE_FILTER = 'lm.date > p.last_timestamp'
+
+# Name and location of the module in params, shared by all record queries
+MODULE_INFO_CTE = '''    module_info AS (
+        SELECT
+            m.mac_address,
+            m.name AS module_name,
+            ROUND(ST_Y(ml.location::geometry)::decimal, 5) AS latitude,
+            ROUND(ST_X(ml.location::geometry)::decimal, 5) AS longitude
+        FROM lora_module m
+        JOIN lora_module_location ml ON m.mac_address = ml.mac_address_lora_module
+        JOIN params p ON m.mac_address = p.mac_address
+    )'''
+
+QUERY_TEMPLATE = '''
+    -- {station_type}
+    WITH params AS (
+        SELECT{params}
+    ),
+{module_info},
+    raw_data AS (
+        SELECT
+            lm.date,
+            lm.value,
+            st.name AS sensor_name,
+            lm.mac_address_lora_module
+        FROM lora_measurement lm
+        JOIN lora_device_type_sensor_type ldt ON lm.id_lora_device_type_sensor_type = ldt.id
+        JOIN lora_sensor_type st ON ldt.id_lora_sensor_type = st.id
+        JOIN params p ON lm.mac_address_lora_module = p.mac_address
+        WHERE
+            lm.device_on IS TRUE
+            AND lm.valid IS TRUE
+            AND {date_filter}
+            AND st.name IN (
+{sensor_names}
+            )
+    )
+    SELECT
+        (jsonb_build_object(
+            'key', mi.mac_address,
+            'name', mi.module_name,
+            'timestamp', rd.date,
+{fields}
+            'latitude_4326', mi.latitude,
+            'longitude_4326', mi.longitude
+        )) AS data
+    FROM raw_data rd
+    JOIN module_info mi ON rd.mac_address_lora_module = mi.mac_address
+    GROUP BY mi.mac_address, mi.module_name, mi.latitude, mi.longitude, rd.date
+    ORDER BY rd.date {order}
+    '''
+
+
+def sql_literal(value):
+    """Quotes config string as SQL literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class Sensor:
+    """Local sensor name and the output field it is sent as (field None = filtered only)"""
+
+    def __init__(self, sensor, field=None, round=None, sample=None, rollup='stats', valid_range=None, max_rate=None):
+        self.name = sensor
+        self.field = field
+        self.round = round
+        self.sample = sample
+        self.rollup = rollup  # Aggregation in rollup collections: stats (mean/min/max), sum or direction
+        self.valid_range = tuple(valid_range) if valid_range is not None else None  # Physical [min, max] of values
+        self.max_rate = max_rate  # Largest plausible change per hour, isolated jumps beyond it are spikes
+
+    def value_expression(self, value='rd.value', sensor_name='rd.sensor_name'):
+        """Aggregate picking this sensor's (rounded) value out of grouped narrow rows"""
+        expression = f"MAX({value}) FILTER (WHERE {sensor_name} = {sql_literal(self.name)})"
+        if self.round is not None:
+            expression = f"ROUND({expression}, {int(self.round)})"
+        return expression
+
+    def sql_expression(self):
+        return f"{sql_literal(self.field)}, {self.value_expression()}"
+
+
+class StationType:
+    """One station type with its generated queries and collection schema"""
+
+    def __init__(self, name, config):
+        self.name = name
+        self.collection_name = config['collection_name']
+        self.description = config.get('description', '')
+        self.tags = config.get('tags', [])
+        routing = config.get('routing', {})
+        self.prefixes = routing.get('prefixes', [])
+        self.suffixes = routing.get('suffixes', [])
+        self.default = routing.get('default', False)
+        self.excluded_modules = config.get('excluded_modules', [])
+        self.schema_sample = config.get('schema_sample', {})
+        self.sensors = [Sensor(**sensor) for sensor in config['sensors']]
+
+        self.fields = [s.field for s in self.sensors if s.field]
+        self.sensor_names = [s.name for s in self.sensors]
+        self.backfill_query = self.build_query(BACKFILL_PARAMS, BACKFILL_DATE_FILTER, 'DESC')
+        self.backfill_query_ascending = self.build_query(BACKFILL_PARAMS, BACKFILL_DATE_FILTER, 'ASC')
+        self.live_query = self.build_query(LIVE_PARAMS, LIVE_DATE_FILTER, 'ASC')
+        self.collection_body = self.build_collection_body()
+
+    def build_query(self, params, date_filter, order):
+        return QUERY_TEMPLATE.format(
+            station_type=self.name,
+            params=params,
+            module_info=MODULE_INFO_CTE,
+            date_filter=date_filter,
+            sensor_names=',\n'.join(f"                {sql_literal(name)}" for name in self.sensor_names),
+            fields='\n'.join(f"            {s.sql_expression()}," for s in self.sensors if s.field),
+            order=order,
+        )
+
+    def build_collection_body(self):
+        schema = dict(self.schema_sample)
+        for sensor in self.sensors:
+            if sensor.field:
+                schema[sensor.field] = sensor.sample if sensor.sample is not None else 0.0
+        return {
+            'name': self.collection_name,
+            'description': self.description,
+            'tags': self.tags,
+            'collection_schema': schema,
+        }
+
+    def station_config(self):
+        """Mutable per-script entry of STATION_CONFIG"""
+        return {
+            'collection_name': self.collection_name,
+            'fields': list(self.fields),
+            'sensors': list(self.sensor_names),
+            'collection_id': None,  # Will be populated dynamically
+            'rollup_collection_ids': {},  # interval -> collection_id, when rollups are enabled
+            'excluded_modules': list(self.excluded_modules),
+        }
+
+
+class PrefixTrie:
+    """Maps longest matching prefix of a string to a value"""
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, prefix, value):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = value
+
+    def longest_match(self, text):
+        node = self.root
+        match = node.get(None)
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            match = node.get(None, match)
+        return match
+
+
+class StationRegistry:
+    """All station types, with MAC routing by prefix/suffix trie and a default type"""
+
+    def __init__(self, station_types):
+        self.station_types = station_types
+        self.prefixes = PrefixTrie()
+        self.suffixes = PrefixTrie()  # Holds reversed suffixes
+        self.default = None
+        for station in station_types.values():
+            for prefix in station.prefixes:
+                self.prefixes.insert(prefix, station.name)
+            for suffix in station.suffixes:
+                self.suffixes.insert(suffix[::-1], station.name)
+            if station.default:
+                if self.default is not None:
+                    raise ValueError(f"Only one default station type allowed ({self.default}, {station.name}).")
+                self.default = station.name
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or os.environ.get(STATIONS_ENV) or DEFAULT_STATIONS_PATH
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+        return cls({name: StationType(name, entry) for name, entry in config.items()})
+
+    def __iter__(self):
+        return iter(self.station_types)
+
+    def __getitem__(self, name):
+        return self.station_types[name]
+
+    def match(self, mac_address):
+        """Returns station type whose prefix or suffix anchors MAC address, None if no routing rule matches"""
+        return self.prefixes.longest_match(mac_address) or self.suffixes.longest_match(mac_address[::-1])
+
+    def route(self, mac_address):
+        """Returns station type name for MAC address (prefix, then suffix, then default)"""
+        station = self.match(mac_address) or self.default
+        if station is None:
+            raise ValueError(f"No station type for module {mac_address}.")
+        return station
+
+    def station_config(self):
+        """Returns fresh STATION_CONFIG dict for a script"""
+        return {name: station.station_config() for name, station in self.station_types.items()}
+
+
+REGISTRY = StationRegistry.load()
@@ -0,0 +1,203 @@
+"""
+Minimal OpenTelemetry-style tracing - nested spans (run -> station type ->
+module -> server lookup / DB query / batch upload) with attributes, exported
+to a JSONL file and/or a local OTLP/HTTP (JSON) collector.
+Disabled (no-op spans) unless configured.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from lazy import lazy_import
+
+# Only needed when exporting to OTLP collector
+urllib_request = lazy_import('urllib.request')
+
+TRACE_FILE_ENV = 'NOSTRADAMUS_TRACE_FILE'
+OTLP_ENDPOINT_ENV = 'NOSTRADAMUS_OTLP_ENDPOINT'
+SERVICE_NAME = 'nostradamus-sync'
+FLUSH_EVERY = 1000
+
+current = ContextVar('current_span', default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_span_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = 'ok'
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def set_error(self, error):
+        self.status = 'error'
+        self.error = str(error)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_span_id,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def set_error(self, error):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class FileExporter:
+    """Appends finished spans as JSON lines"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def export(self, spans):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False) + "\n")
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OtlpHttpExporter:
+    """Posts spans to OTLP/HTTP JSON endpoint (e.g. http://localhost:4318/v1/traces)"""
+
+    def __init__(self, endpoint, timeout=5.0):
+        if not endpoint.rstrip('/').endswith('/v1/traces'):
+            endpoint = endpoint.rstrip('/') + '/v1/traces'
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def export(self, spans):
+        payload = {
+            'resourceSpans': [{
+                'resource': {'attributes': [{'key': 'service.name', 'value': otlp_value(SERVICE_NAME)}]},
+                'scopeSpans': [{
+                    'scope': {'name': 'nostradamus.tracing'},
+                    'spans': [{
+                        'traceId': span.trace_id,
+                        'spanId': span.span_id,
+                        'parentSpanId': span.parent_span_id or '',
+                        'name': span.name,
+                        'kind': 1,
+                        'startTimeUnixNano': str(span.start_ns),
+                        'endTimeUnixNano': str(span.end_ns),
+                        'attributes': [{'key': k, 'value': otlp_value(v)} for k, v in span.attributes.items()],
+                        'status': {'code': 2, 'message': span.error or ''} if span.status == 'error' else {'code': 1},
+                    } for span in spans],
+                }],
+            }],
+        }
+        request = urllib_request.Request(
+            self.endpoint, data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        try:
+            with urllib_request.urlopen(request, timeout=self.timeout):
+                pass
+        except OSError as e:
+            print(f"⚠️  Exporting traces to {self.endpoint} failed: {e}")
+
+
+class Tracer:
+    def __init__(self):
+        self.exporters = []
+        self.finished = []
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.exporters)
+
+    def configure(self, trace_file=None, otlp_endpoint=None):
+        """Enables exporters from arguments or NOSTRADAMUS_TRACE_FILE / NOSTRADAMUS_OTLP_ENDPOINT"""
+        trace_file = trace_file or os.environ.get(TRACE_FILE_ENV)
+        otlp_endpoint = otlp_endpoint or os.environ.get(OTLP_ENDPOINT_ENV)
+        self.exporters = []
+        if trace_file:
+            self.exporters.append(FileExporter(trace_file))
+        if otlp_endpoint:
+            self.exporters.append(OtlpHttpExporter(otlp_endpoint))
+        return self.enabled
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Starts span as child of current span (or new trace)"""
+        if not self.exporters:
+            yield NOOP_SPAN
+            return
+
+        parent = current.get()
+        trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        span = Span(name, trace_id, parent.span_id if parent else None, attributes)
+        token = current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(e)
+            raise
+        finally:
+            current.reset(token)
+            span.end_ns = time.time_ns()
+            with self.lock:
+                self.finished.append(span)
+                pending = len(self.finished)
+            if parent is None or pending >= FLUSH_EVERY:
+                self.flush()
+
+    def flush(self):
+        """Exports all finished spans"""
+        with self.lock:
+            spans, self.finished = self.finished, []
+        if not spans:
+            return
+        for exporter in self.exporters:
+            exporter.export(spans)
+
+
+TRACER = Tracer()
+
+
+def current_span():
+    """Returns active span (no-op span when tracing is off)"""
+    return current.get() or NOOP_SPAN
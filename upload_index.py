@@ -0,0 +1,120 @@
+"""
+Local index of per-(key, time bucket) content hashes recorded on successful
+upload. Lets re-runs skip buckets that were already sent unchanged and
+resend only buckets whose content changed.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from datetime import datetime, timezone
+
+DEFAULT_INDEX_PATH = os.path.join('data', 'upload_index.sqlite3')
+
+
+class UploadIndex:
+    """SQLite-backed store of uploaded bucket hashes"""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # Connection is shared by parallel backfill workers
+        self.lock = threading.Lock()
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS upload_index (
+                collection_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                bucket_start INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                record_count INTEGER NOT NULL,
+                uploaded_at TEXT NOT NULL,
+                PRIMARY KEY (collection_id, key, bucket_start)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def get_hashes(self, collection_id, key, start=None, end=None):
+        """Returns {bucket_start: content_hash} for key, optionally limited to [start, end)"""
+        query = "SELECT bucket_start, content_hash FROM upload_index WHERE collection_id = ? AND key = ?"
+        params = [collection_id, key]
+        if start is not None:
+            query += " AND bucket_start >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND bucket_start < ?"
+            params.append(end)
+        with self.lock:
+            return dict(self.conn.execute(query, params).fetchall())
+
+    def record(self, collection_id, key, bucket_start, content_hash, record_count):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO upload_index VALUES (?, ?, ?, ?, ?, ?)",
+                (collection_id, key, bucket_start, content_hash, record_count,
+                 datetime.now(timezone.utc).isoformat())
+            )
+            self.conn.commit()
+
+    def forget(self, collection_id, key, bucket_start):
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM upload_index WHERE collection_id = ? AND key = ? AND bucket_start = ?",
+                (collection_id, key, bucket_start)
+            )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def split_into_buckets(batch, bucket_seconds):
+    """Splits ColumnarBatch into {bucket_start: ColumnarBatch}, rows sorted by timestamp"""
+    groups = {}
+    for i, ts in enumerate(batch.timestamps):
+        groups.setdefault(int(ts // bucket_seconds * bucket_seconds), []).append(i)
+    return {
+        bucket_start: batch.take(sorted(indices, key=lambda i: batch.timestamps[i]))
+        for bucket_start, indices in sorted(groups.items())
+    }
+
+
+def content_hash(batch):
+    """Hashes header, timestamps and all value columns of a ColumnarBatch"""
+    h = hashlib.sha256()
+    h.update(repr((batch.key, batch.name, batch.latitude, batch.longitude, batch.fields)).encode('utf-8'))
+    seconds = array('q', map(int, batch.timestamps))
+    # Whole-second timestamps hash as int64 like before fractions were kept, so indexed buckets stay unchanged
+    h.update(seconds.tobytes() if seconds.tolist() == batch.timestamps.tolist() else batch.timestamps.tobytes())
+    for field in batch.fields:
+        h.update(batch.columns[field].tobytes())
+        h.update(bytes(batch.masks[field]))
+    return h.hexdigest()
+
+
+def plan_upload(index, collection_id, key, batch, bucket_seconds, range_start=None, range_end=None):
+    """
+    Compares batch buckets with index. Returns (changed, stale, unchanged_count):
+    changed - list of (bucket_start, bucket_batch, content_hash, previous_hash)
+    stale   - bucket starts recorded in index (within range) that are no longer in batch
+    """
+    if range_start is not None:
+        range_start -= range_start % bucket_seconds
+    known = index.get_hashes(collection_id, key, range_start, range_end)
+    changed = []
+    unchanged = 0
+    buckets = split_into_buckets(batch, bucket_seconds) if batch else {}
+
+    for bucket_start, bucket in buckets.items():
+        digest = content_hash(bucket)
+        previous = known.get(bucket_start)
+        if previous == digest:
+            unchanged += 1
+        else:
+            changed.append((bucket_start, bucket, digest, previous))
+
+    stale = sorted(set(known) - set(buckets))
+    return changed, stale, unchanged
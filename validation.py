@@ -0,0 +1,206 @@
+"""
+Pre-send validation of module batches, vectorized with NumPy.
+Every fetched ColumnarBatch is checked column by column before it is sent:
+    range     - value outside the sensor's "valid_range" in stations.json
+                (glitches such as 6553.5 °C or negative humidity)
+    spike     - isolated jump: value differs from both of its neighbours by
+                more than the sensor's "max_rate" (change per hour) allows
+    duplicate - timestamp already present in the batch (first row is kept)
+Rows failing any check are dropped and appended to data/quarantine.jsonl
+together with the reasons, valid rows go on to the server. Rows already in
+the file (read once per process) are not written again when later runs fetch
+them again. The last accepted value per module and field is remembered, so
+the first row of the next batch is checked against it as its left neighbour.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from columnar import format_timestamp, parse_timestamp, to_array
+from instrumentation import METRICS, VALIDATE
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+DEFAULT_QUARANTINE_PATH = os.path.join('data', 'quarantine.jsonl')
+MIN_RATE_SECONDS = 600  # Rows closer together may still change as much as in one 10 minute interval
+MAX_REFERENCE_GAP = 3 * 3600  # Remembered value is a neighbour only of rows at most this much later
+MAX_REMEMBERED = 100000  # Quarantined rows (newest of the file) remembered against re-writing
+
+DUPLICATE = 'duplicate timestamp'
+
+
+def compress(batch, keep):
+    """Returns new batch holding rows where boolean array keep is set"""
+    result = batch.empty_like()
+    result.timestamps = to_array('d', np.frombuffer(batch.timestamps, dtype=np.float64)[keep])
+    for field in batch.fields:
+        result.columns[field] = to_array('d', np.frombuffer(batch.columns[field], dtype=np.float64)[keep])
+        result.masks[field] = bytearray(np.frombuffer(batch.masks[field], dtype=np.uint8)[keep].tobytes())
+    return result
+
+
+def find_spikes(times, values, max_rate, reference=None):
+    """
+    Marks values of time-ordered series that jump by more than max_rate per
+    hour both from the previous and to the next value. A jump at the end of
+    the series is kept - it can not be told apart from a real step yet.
+    """
+    if reference is not None:
+        times = np.r_[reference[0], times]
+        values = np.r_[reference[1], values]
+    gaps = np.maximum(np.diff(times), MIN_RATE_SECONDS)
+    jumps = np.abs(np.diff(values)) > max_rate * gaps / 3600.0
+    spikes = np.zeros(len(values), dtype=bool)
+    spikes[1:-1] = jumps[:-1] & jumps[1:]
+    return spikes[1:] if reference is not None else spikes
+
+
+class Validator:
+    """Checks batches against station type limits and writes rejected rows to quarantine file"""
+
+    def __init__(self, path=DEFAULT_QUARANTINE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.last_values = {}  # (mac, field) -> (epoch, value) of newest accepted value
+        self.quarantined = None  # OrderedDict of (mac, microseconds) already written, loaded from file on first use
+
+    def check(self, batch, station):
+        """Returns dict reason -> boolean array of rows failing that check"""
+        timestamps = np.frombuffer(batch.timestamps, dtype=np.float64)
+        order = np.argsort(timestamps, kind='stable')
+        ordered = timestamps[order]
+        duplicate = np.zeros(len(batch), dtype=bool)
+        duplicate[order[1:]] = ordered[1:] == ordered[:-1]
+        failures = {DUPLICATE: duplicate}
+
+        for sensor in station.sensors:
+            if not sensor.field or (sensor.valid_range is None and sensor.max_rate is None):
+                continue
+            values = np.frombuffer(batch.columns[sensor.field], dtype=np.float64)
+            usable = np.frombuffer(batch.masks[sensor.field], dtype=np.uint8).astype(bool) & ~duplicate
+
+            if sensor.valid_range is not None:
+                low, high = sensor.valid_range
+                # Written as negation so NaN fails too
+                out_of_range = usable & ~((values >= low) & (values <= high))
+                failures[f"{sensor.field} out of range"] = out_of_range
+                usable &= ~out_of_range
+
+            if sensor.max_rate is not None and usable.any():
+                rows = order[usable[order]]
+                times = timestamps[rows]
+                reference = self.last_values.get((batch.key, sensor.field))
+                if reference is not None and not 0 < times[0] - reference[0] <= MAX_REFERENCE_GAP:
+                    reference = None
+                spikes = np.zeros(len(batch), dtype=bool)
+                spikes[rows] = find_spikes(times, values[rows], sensor.max_rate, reference)
+                failures[f"{sensor.field} spike"] = spikes
+        return failures
+
+    def remember(self, batch, station, valid):
+        """Keeps newest accepted value of rate-checked fields as reference for next batch"""
+        timestamps = np.frombuffer(batch.timestamps, dtype=np.float64)
+        for sensor in station.sensors:
+            if not sensor.field or sensor.max_rate is None:
+                continue
+            accepted = np.flatnonzero(valid & np.frombuffer(batch.masks[sensor.field], dtype=np.uint8).astype(bool))
+            if not len(accepted):
+                continue
+            newest = accepted[np.argmax(timestamps[accepted])]
+            value = (float(timestamps[newest]), batch.columns[sensor.field][newest])
+            previous = self.last_values.get((batch.key, sensor.field))
+            if previous is None or value[0] > previous[0]:
+                self.last_values[(batch.key, sensor.field)] = value
+
+    def validate(self, batch, station):
+        """Returns batch of valid rows, rejected rows are appended to quarantine file"""
+        if not batch:
+            return batch
+        with METRICS.timer(VALIDATE) as t:
+            failures = self.check(batch, station)
+            rejected = np.logical_or.reduce(list(failures.values()))
+            self.remember(batch, station, ~rejected)
+            valid = compress(batch, ~rejected) if rejected.any() else batch
+            t.add(rows=len(batch), nbytes=batch.nbytes)
+        if valid is not batch:
+            METRICS.count('rows_quarantined', len(batch) - len(valid))
+            self.quarantine(batch, station, failures, np.flatnonzero(rejected))
+        return valid
+
+    def quarantine(self, batch, station, failures, rows):
+        """Appends rejected rows with their reasons to quarantine file, returns number written"""
+        quarantined_at = format_timestamp(int(time.time()))
+        lines = []
+        with self.lock:
+            if self.quarantined is None:
+                self.quarantined = read_quarantine_keys(self.path)
+            for i in rows.tolist():
+                key = quarantine_key(batch.key, batch.timestamps[i])
+                if key in self.quarantined:
+                    continue
+                self.remember_quarantined(key)
+                entry = {
+                    'quarantined_at': quarantined_at,
+                    'station_type': station.name,
+                    'reasons': [reason for reason, failed in failures.items() if failed[i]],
+                    'record': batch.take([i]).to_records()[0],
+                }
+                lines.append(json.dumps(entry, ensure_ascii=False))
+            if lines:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write('\n'.join(lines) + '\n')
+        return len(lines)
+
+
+    def remember_quarantined(self, key):
+        self.quarantined[key] = None
+        if len(self.quarantined) > MAX_REMEMBERED:
+            self.quarantined.popitem(last=False)
+
+
+def quarantine_key(mac_address, epoch):
+    # Whole microseconds, so timestamps read back from the file compare equal
+    return mac_address, round(epoch * 1000000)
+
+
+def read_quarantine_keys(path=DEFAULT_QUARANTINE_PATH):
+    """Keys of the newest MAX_REMEMBERED rows in quarantine file, oldest first"""
+    keys = OrderedDict()
+    if not os.path.exists(path):
+        return keys
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)['record']
+            keys[quarantine_key(record['key'], parse_timestamp(record['timestamp']))] = None
+            if len(keys) > MAX_REMEMBERED:
+                keys.popitem(last=False)
+    return keys
+
+
+def read_quarantined(path=DEFAULT_QUARANTINE_PATH):
+    """
+    Returns {mac: {timestamp, ...}} of rows in quarantine file that were never
+    sent. Rows rejected only as duplicate timestamp are left out - the first
+    row of their timestamp was sent.
+    """
+    quarantined = {}
+    if not os.path.exists(path):
+        return quarantined
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry['reasons'] == [DUPLICATE]:
+                continue
+            timestamp = datetime.fromisoformat(entry['record']['timestamp'].replace('Z', '+00:00'))
+            quarantined.setdefault(entry['record']['key'], set()).add(timestamp)
+    return quarantined